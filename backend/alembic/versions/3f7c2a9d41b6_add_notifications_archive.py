@@ -0,0 +1,56 @@
+"""add_notifications_archive
+
+Revision ID: 3f7c2a9d41b6
+Revises: ac1b1c8e8887
+Create Date: 2026-10-19 11:40:05.271930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f7c2a9d41b6'
+down_revision: Union[str, Sequence[str], None] = 'ac1b1c8e8887'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'notifications_archive' not in existing:
+        op.create_table('notifications_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient_id', sa.Integer(), nullable=False),
+        sa.Column('sender_id', sa.Integer(), nullable=True),
+        sa.Column('hobby_category_id', sa.Integer(), nullable=True),
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('event_post_id', sa.Integer(), nullable=True),
+        sa.Column('is_read', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.ForeignKeyConstraint(['recipient_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('notifications_archive', schema=None) as batch_op:
+            batch_op.create_index('ix_notifications_archive_recipient_created', ['recipient_id', 'created_at'], unique=False)
+
+    # 受信箱クエリ用の複合インデックス
+    indexes = {ix['name'] for ix in inspector.get_indexes('notifications')}
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        if 'ix_notifications_recipient_created' not in indexes:
+            batch_op.create_index('ix_notifications_recipient_created', ['recipient_id', 'created_at'], unique=False)
+        if 'ix_notifications_recipient_is_read' not in indexes:
+            batch_op.create_index('ix_notifications_recipient_is_read', ['recipient_id', 'is_read'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('notifications', schema=None) as batch_op:
+        batch_op.drop_index('ix_notifications_recipient_is_read')
+        batch_op.drop_index('ix_notifications_recipient_created')
+    op.drop_table('notifications_archive')
@@ -0,0 +1,40 @@
+"""add_meetup_chat_archives
+
+Revision ID: 4b9e1d7a2c65
+Revises: e7b3c9d05f18
+Create Date: 2026-10-19 16:40:12.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b9e1d7a2c65'
+down_revision: Union[str, Sequence[str], None] = 'e7b3c9d05f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'meetup_chat_archives' not in existing:
+        op.create_table('meetup_chat_archives',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('codec', sa.String(length=10), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.Column('last_message_id', sa.Integer(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['hobby_posts.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('post_id')
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('meetup_chat_archives')
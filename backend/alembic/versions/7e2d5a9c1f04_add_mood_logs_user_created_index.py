@@ -0,0 +1,33 @@
+"""add_mood_logs_user_created_index
+
+Revision ID: 7e2d5a9c1f04
+Revises: 4b9e1d7a2c65
+Create Date: 2026-10-19 17:05:41.287316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e2d5a9c1f04'
+down_revision: Union[str, Sequence[str], None] = '4b9e1d7a2c65'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    indexes = {ix['name'] for ix in inspector.get_indexes('mood_logs')}
+
+    with op.batch_alter_table('mood_logs', schema=None) as batch_op:
+        if 'ix_mood_logs_user_created' not in indexes:
+            batch_op.create_index('ix_mood_logs_user_created', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('mood_logs', schema=None) as batch_op:
+        batch_op.drop_index('ix_mood_logs_user_created')
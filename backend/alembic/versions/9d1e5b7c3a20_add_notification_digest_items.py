@@ -0,0 +1,47 @@
+"""add_notification_digest_items
+
+Revision ID: 9d1e5b7c3a20
+Revises: 3f7c2a9d41b6
+Create Date: 2026-10-19 13:05:48.902611
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d1e5b7c3a20'
+down_revision: Union[str, Sequence[str], None] = '3f7c2a9d41b6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'notification_digest_items' not in existing:
+        op.create_table('notification_digest_items',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('recipient_id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(length=20), nullable=False),
+        sa.Column('sender_id', sa.Integer(), nullable=False),
+        sa.Column('hobby_category_id', sa.Integer(), nullable=False),
+        sa.Column('event_post_id', sa.Integer(), nullable=True),
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('dedupe_key', sa.String(length=100), nullable=True),
+        sa.Column('send_email', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.ForeignKeyConstraint(['recipient_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('notification_digest_items', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_notification_digest_items_id'), ['id'], unique=False)
+            batch_op.create_index(batch_op.f('ix_notification_digest_items_recipient_id'), ['recipient_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_table('notification_digest_items')
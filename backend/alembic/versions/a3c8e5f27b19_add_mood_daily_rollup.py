@@ -0,0 +1,63 @@
+"""add_mood_daily_rollup
+
+Revision ID: a3c8e5f27b19
+Revises: 7e2d5a9c1f04
+Create Date: 2026-10-19 17:32:08.664120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c8e5f27b19'
+down_revision: Union[str, Sequence[str], None] = '7e2d5a9c1f04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MOOD_SCORES = {
+    'MOTIVATED': 5, 'EXCITED': 5, 'HAPPY': 4, 'GRATEFUL': 4, 'CALM': 3,
+    'NEUTRAL': 3, 'ANXIOUS': 2, 'TIRED': 2, 'SAD': 1, 'ANGRY': 1,
+}
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'mood_daily_rollup' not in existing:
+        op.create_table('mood_daily_rollup',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('category', sa.String(length=50), nullable=False),
+        sa.Column('total', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('score_sum', sa.Integer(), server_default='0', nullable=False),
+        *[sa.Column(f'count_{m.lower()}', sa.Integer(), server_default='0', nullable=False) for m in MOOD_SCORES],
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'day', 'category')
+        )
+
+    # 既存の気分ログから日別集計を作成（日付は日本時間）
+    if conn.dialect.name == 'postgresql':
+        day_expr = "(created_at AT TIME ZONE 'Asia/Tokyo')::date"
+    else:
+        day_expr = "date(created_at, '+9 hours')"
+    count_cols = ", ".join(f"count_{m.lower()}" for m in MOOD_SCORES)
+    count_sums = ", ".join(f"SUM(CASE WHEN mood_type = '{m}' THEN 1 ELSE 0 END)" for m in MOOD_SCORES)
+    score_case = " ".join(f"WHEN '{m}' THEN {s}" for m, s in MOOD_SCORES.items())
+    op.execute(f"""
+        INSERT INTO mood_daily_rollup (user_id, day, category, total, score_sum, {count_cols})
+        SELECT user_id, {day_expr}, COALESCE(category, ''), COUNT(*),
+               SUM(CASE mood_type {score_case} ELSE 3 END), {count_sums}
+        FROM mood_logs
+        WHERE created_at IS NOT NULL
+        GROUP BY user_id, {day_expr}, COALESCE(category, '')
+        ON CONFLICT (user_id, day, category) DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('mood_daily_rollup')
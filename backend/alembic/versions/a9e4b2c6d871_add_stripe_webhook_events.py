@@ -0,0 +1,48 @@
+"""add_stripe_webhook_events
+
+Revision ID: a9e4b2c6d871
+Revises: f7a3d5c8e294
+Create Date: 2026-10-19 21:26:13.058471
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9e4b2c6d871'
+down_revision: Union[str, Sequence[str], None] = 'f7a3d5c8e294'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'stripe_webhook_events' not in existing:
+        op.create_table('stripe_webhook_events',
+        sa.Column('event_id', sa.String(length=255), nullable=False),
+        sa.Column('event_type', sa.String(length=100), nullable=False),
+        sa.Column('object_key', sa.String(length=255), nullable=False),
+        sa.Column('event_created', sa.Integer(), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('received_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.Column('processed_at', sa.DateTime(timezone=True), nullable=True),
+        sa.PrimaryKeyConstraint('event_id')
+        )
+        op.create_index(op.f('ix_stripe_webhook_events_object_key'), 'stripe_webhook_events', ['object_key'], unique=False)
+        op.create_index('ix_stripe_webhook_events_status_created', 'stripe_webhook_events', ['status', 'event_created'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_stripe_webhook_events_status_created', table_name='stripe_webhook_events')
+    op.drop_index(op.f('ix_stripe_webhook_events_object_key'), table_name='stripe_webhook_events')
+    op.drop_table('stripe_webhook_events')
@@ -0,0 +1,47 @@
+"""add_notification_unread_counters
+
+Revision ID: ac1b1c8e8887
+Revises: 8656397c67df
+Create Date: 2026-10-19 10:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'ac1b1c8e8887'
+down_revision: Union[str, Sequence[str], None] = '8656397c67df'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'notification_unread_counters' not in existing:
+        op.create_table('notification_unread_counters',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('unread_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id')
+        )
+
+    # 既存の未読通知からカウンターを作成
+    op.execute("""
+        INSERT INTO notification_unread_counters (user_id, unread_count)
+        SELECT recipient_id, COUNT(*)
+        FROM notifications
+        WHERE is_read = false
+          AND recipient_id NOT IN (SELECT user_id FROM notification_unread_counters)
+        GROUP BY recipient_id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('notification_unread_counters')
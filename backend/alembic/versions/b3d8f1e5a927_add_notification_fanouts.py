@@ -0,0 +1,47 @@
+"""add_notification_fanouts
+
+Revision ID: b3d8f1e5a927
+Revises: a9e4b2c6d871
+Create Date: 2026-10-20 10:12:47.302915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3d8f1e5a927'
+down_revision: Union[str, Sequence[str], None] = 'a9e4b2c6d871'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'notification_fanouts' not in existing:
+        op.create_table('notification_fanouts',
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('sender_id', sa.Integer(), nullable=False),
+        sa.Column('hobby_category_id', sa.Integer(), nullable=False),
+        sa.Column('message', sa.Text(), nullable=False),
+        sa.Column('cursor_user_id', sa.Integer(), nullable=False),
+        sa.Column('sent_count', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['hobby_category_id'], ['hobby_categories.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['post_id'], ['hobby_posts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['sender_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('post_id')
+        )
+        op.create_index('ix_notification_fanouts_status_updated', 'notification_fanouts', ['status', 'updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_notification_fanouts_status_updated', table_name='notification_fanouts')
+    op.drop_table('notification_fanouts')
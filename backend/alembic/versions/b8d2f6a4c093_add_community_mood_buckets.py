@@ -0,0 +1,46 @@
+"""add_community_mood_buckets
+
+Revision ID: b8d2f6a4c093
+Revises: f1a6c4d8b372
+Create Date: 2026-10-19 19:12:41.503317
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d2f6a4c093'
+down_revision: Union[str, Sequence[str], None] = 'f1a6c4d8b372'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MOOD_TYPES = [
+    'HAPPY', 'EXCITED', 'CALM', 'TIRED', 'SAD',
+    'ANXIOUS', 'ANGRY', 'NEUTRAL', 'GRATEFUL', 'MOTIVATED',
+]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'community_mood_buckets' not in existing:
+        op.create_table('community_mood_buckets',
+        sa.Column('scope', sa.String(length=10), nullable=False),
+        sa.Column('scope_key', sa.String(length=160), nullable=False),
+        sa.Column('bucket', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('score_sum', sa.Integer(), server_default='0', nullable=False),
+        *[sa.Column(f'count_{m.lower()}', sa.Integer(), server_default='0', nullable=False) for m in MOOD_TYPES],
+        sa.PrimaryKeyConstraint('scope', 'scope_key', 'bucket')
+        )
+        op.create_index(op.f('ix_community_mood_buckets_bucket'), 'community_mood_buckets', ['bucket'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_community_mood_buckets_bucket'), table_name='community_mood_buckets')
+    op.drop_table('community_mood_buckets')
@@ -0,0 +1,40 @@
+"""add_meetup_message_sync_indexes
+
+Revision ID: c2a8f4e61d93
+Revises: 9d1e5b7c3a20
+Create Date: 2026-10-19 14:22:17.530846
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2a8f4e61d93'
+down_revision: Union[str, Sequence[str], None] = '9d1e5b7c3a20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    columns = {c['name'] for c in inspector.get_columns('meetup_messages')}
+    indexes = {ix['name'] for ix in inspector.get_indexes('meetup_messages')}
+
+    with op.batch_alter_table('meetup_messages', schema=None) as batch_op:
+        if 'reactions_updated_at' not in columns:
+            batch_op.add_column(sa.Column('reactions_updated_at', sa.DateTime(timezone=True), nullable=True))
+        if 'ix_meetup_messages_post_created' not in indexes:
+            batch_op.create_index('ix_meetup_messages_post_created', ['post_id', 'created_at'], unique=False)
+        if 'ix_meetup_messages_post_reactions_updated' not in indexes:
+            batch_op.create_index('ix_meetup_messages_post_reactions_updated', ['post_id', 'reactions_updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('meetup_messages', schema=None) as batch_op:
+        batch_op.drop_index('ix_meetup_messages_post_reactions_updated')
+        batch_op.drop_index('ix_meetup_messages_post_created')
+        batch_op.drop_column('reactions_updated_at')
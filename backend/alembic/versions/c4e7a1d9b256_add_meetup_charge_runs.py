@@ -0,0 +1,67 @@
+"""add_meetup_charge_runs
+
+Revision ID: c4e7a1d9b256
+Revises: b8d2f6a4c093
+Create Date: 2026-10-19 19:48:20.417936
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e7a1d9b256'
+down_revision: Union[str, Sequence[str], None] = 'b8d2f6a4c093'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'meetup_charge_runs' not in existing:
+        op.create_table('meetup_charge_runs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('post_id', sa.Integer(), nullable=False),
+        sa.Column('organizer_id', sa.Integer(), nullable=False),
+        sa.Column('fee', sa.Integer(), nullable=False),
+        sa.Column('organizer_amount', sa.Integer(), nullable=False),
+        sa.Column('commission_amount', sa.Integer(), nullable=False),
+        sa.Column('transfer_destination', sa.String(length=255), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['post_id'], ['hobby_posts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['organizer_id'], ['users.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('post_id')
+        )
+        op.create_index(op.f('ix_meetup_charge_runs_id'), 'meetup_charge_runs', ['id'], unique=False)
+
+    if 'meetup_charge_items' not in existing:
+        op.create_table('meetup_charge_items',
+        sa.Column('run_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('stripe_customer_id', sa.String(length=255), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('payment_intent_id', sa.String(length=255), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.ForeignKeyConstraint(['run_id'], ['meetup_charge_runs.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('run_id', 'user_id')
+        )
+        op.create_index(op.f('ix_meetup_charge_items_status'), 'meetup_charge_items', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_meetup_charge_items_status'), table_name='meetup_charge_items')
+    op.drop_table('meetup_charge_items')
+    op.drop_index(op.f('ix_meetup_charge_runs_id'), table_name='meetup_charge_runs')
+    op.drop_table('meetup_charge_runs')
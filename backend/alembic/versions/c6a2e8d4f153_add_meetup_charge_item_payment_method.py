@@ -0,0 +1,37 @@
+"""add_meetup_charge_item_payment_method
+
+Revision ID: c6a2e8d4f153
+Revises: b3d8f1e5a927
+Create Date: 2026-10-20 14:03:51.628407
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c6a2e8d4f153'
+down_revision: Union[str, Sequence[str], None] = 'b3d8f1e5a927'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+
+    # やり直しでも同じカード・同じ冪等キーで課金するため、最初の試行の前に保存する
+    columns = [c['name'] for c in inspector.get_columns('meetup_charge_items')]
+    with op.batch_alter_table('meetup_charge_items', schema=None) as batch_op:
+        if 'payment_method_id' not in columns:
+            batch_op.add_column(sa.Column('payment_method_id', sa.String(length=255), nullable=True))
+        if 'idempotency_key' not in columns:
+            batch_op.add_column(sa.Column('idempotency_key', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('meetup_charge_items', schema=None) as batch_op:
+        batch_op.drop_column('idempotency_key')
+        batch_op.drop_column('payment_method_id')
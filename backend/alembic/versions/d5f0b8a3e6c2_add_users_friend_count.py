@@ -0,0 +1,41 @@
+"""add_users_friend_count
+
+Revision ID: d5f0b8a3e6c2
+Revises: a3c8e5f27b19
+Create Date: 2026-10-19 18:01:27.903415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f0b8a3e6c2'
+down_revision: Union[str, Sequence[str], None] = 'a3c8e5f27b19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    columns = {c['name'] for c in inspector.get_columns('users')}
+
+    if 'friend_count' not in columns:
+        with op.batch_alter_table('users', schema=None) as batch_op:
+            batch_op.add_column(sa.Column('friend_count', sa.Integer(), server_default='0', nullable=False))
+
+    # 既存の友達関係から友達数を作成
+    op.execute("""
+        UPDATE users
+        SET friend_count = (
+            SELECT COUNT(*) FROM friendships WHERE friendships.user_id = users.id
+        )
+    """)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('friend_count')
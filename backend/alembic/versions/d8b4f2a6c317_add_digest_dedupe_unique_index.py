@@ -0,0 +1,45 @@
+"""add_digest_dedupe_unique_index
+
+Revision ID: d8b4f2a6c317
+Revises: c6a2e8d4f153
+Create Date: 2026-10-20 14:41:09.517362
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8b4f2a6c317'
+down_revision: Union[str, Sequence[str], None] = 'c6a2e8d4f153'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    indexes = [ix['name'] for ix in inspector.get_indexes('notification_digest_items')]
+
+    if 'uq_notification_digest_items_recipient_dedupe' not in indexes:
+        # 既に重複している待ち行は最新の1行だけ残す
+        op.execute("""
+            DELETE FROM notification_digest_items
+            WHERE dedupe_key IS NOT NULL
+              AND id NOT IN (
+                  SELECT MAX(id) FROM notification_digest_items
+                  WHERE dedupe_key IS NOT NULL
+                  GROUP BY recipient_id, dedupe_key
+              )
+        """)
+        op.create_index(
+            'uq_notification_digest_items_recipient_dedupe', 'notification_digest_items',
+            ['recipient_id', 'dedupe_key'], unique=True,
+            postgresql_where=sa.text('dedupe_key IS NOT NULL'), sqlite_where=sa.text('dedupe_key IS NOT NULL'),
+        )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_notification_digest_items_recipient_dedupe', table_name='notification_digest_items')
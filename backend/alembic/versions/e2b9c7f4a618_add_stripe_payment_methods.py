@@ -0,0 +1,38 @@
+"""add_stripe_payment_methods
+
+Revision ID: e2b9c7f4a618
+Revises: c4e7a1d9b256
+Create Date: 2026-10-19 20:21:06.839154
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2b9c7f4a618'
+down_revision: Union[str, Sequence[str], None] = 'c4e7a1d9b256'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'stripe_payment_methods' not in existing:
+        op.create_table('stripe_payment_methods',
+        sa.Column('customer_id', sa.String(length=255), nullable=False),
+        sa.Column('payment_method_id', sa.String(length=255), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.PrimaryKeyConstraint('customer_id')
+        )
+        op.create_index(op.f('ix_stripe_payment_methods_payment_method_id'), 'stripe_payment_methods', ['payment_method_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_stripe_payment_methods_payment_method_id'), table_name='stripe_payment_methods')
+    op.drop_table('stripe_payment_methods')
@@ -0,0 +1,47 @@
+"""add_meetup_message_reaction_counts
+
+Revision ID: e7b3c9d05f18
+Revises: c2a8f4e61d93
+Create Date: 2026-10-19 15:48:33.104927
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b3c9d05f18'
+down_revision: Union[str, Sequence[str], None] = 'c2a8f4e61d93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'meetup_message_reaction_counts' not in existing:
+        op.create_table('meetup_message_reaction_counts',
+        sa.Column('message_id', sa.Integer(), nullable=False),
+        sa.Column('reaction', sa.String(length=10), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.ForeignKeyConstraint(['message_id'], ['meetup_messages.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('message_id', 'reaction')
+        )
+
+    # 既存のリアクションからカウンターを作成
+    op.execute("""
+        INSERT INTO meetup_message_reaction_counts (message_id, reaction, count, created_at)
+        SELECT message_id, reaction, COUNT(*), MIN(created_at)
+        FROM meetup_message_reactions
+        GROUP BY message_id, reaction
+        ON CONFLICT (message_id, reaction) DO NOTHING
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table('meetup_message_reaction_counts')
@@ -0,0 +1,41 @@
+"""add_friend_suggestions
+
+Revision ID: f1a6c4d8b372
+Revises: d5f0b8a3e6c2
+Create Date: 2026-10-19 18:40:55.126784
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1a6c4d8b372'
+down_revision: Union[str, Sequence[str], None] = 'd5f0b8a3e6c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'friend_suggestions' not in existing:
+        op.create_table('friend_suggestions',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('candidate_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.Column('mutual_friends', sa.Integer(), nullable=False),
+        sa.Column('shared_communities', sa.Integer(), nullable=False),
+        sa.Column('computed_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['candidate_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'candidate_id')
+        )
+
+
+def downgrade() -> None:
+    op.drop_table('friend_suggestions')
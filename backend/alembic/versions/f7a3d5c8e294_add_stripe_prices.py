@@ -0,0 +1,49 @@
+"""add_stripe_prices
+
+Revision ID: f7a3d5c8e294
+Revises: e2b9c7f4a618
+Create Date: 2026-10-19 20:54:37.210584
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a3d5c8e294'
+down_revision: Union[str, Sequence[str], None] = 'e2b9c7f4a618'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    existing = inspector.get_table_names()
+
+    if 'stripe_prices' not in existing:
+        op.create_table('stripe_prices',
+        sa.Column('lookup_key', sa.String(length=100), nullable=False),
+        sa.Column('price_id', sa.String(length=255), nullable=False),
+        sa.Column('unit_amount', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=True),
+        sa.PrimaryKeyConstraint('lookup_key')
+        )
+
+    # 人数変更を Subscription.modify 1回で済ませるため、サブスクリプションのアイテムIDを保存する
+    if 'friend_manager_subscriptions' in existing:
+        columns = [c['name'] for c in inspector.get_columns('friend_manager_subscriptions')]
+        if 'stripe_subscription_item_id' not in columns:
+            with op.batch_alter_table('friend_manager_subscriptions', schema=None) as batch_op:
+                batch_op.add_column(sa.Column('stripe_subscription_item_id', sa.String(length=255), nullable=True))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    if 'friend_manager_subscriptions' in inspector.get_table_names():
+        with op.batch_alter_table('friend_manager_subscriptions', schema=None) as batch_op:
+            batch_op.drop_column('stripe_subscription_item_id')
+    op.drop_table('stripe_prices')
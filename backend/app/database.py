@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -30,6 +30,34 @@ else:
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# --------------------------------------------------
+# 💡 コミット後フック
+# --------------------------------------------------
+# キャッシュ更新やイベント配信は「DBに確定した後」にだけ行いたいので、
+# セッションに登録しておき、commit 成功時に実行・rollback 時に破棄する。
+
+_AFTER_COMMIT_KEY = "after_commit_callbacks"
+
+def run_after_commit(db, callback):
+    """現在のトランザクションが commit された後に callback() を実行する"""
+    db.info.setdefault(_AFTER_COMMIT_KEY, []).append(callback)
+
+@event.listens_for(SessionLocal, "after_commit")
+def _run_after_commit_callbacks(session):
+    if session.in_nested_transaction():
+        return  # SAVEPOINT の確定では実行しない
+    callbacks = session.info.pop(_AFTER_COMMIT_KEY, [])
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            print(f"コミット後処理エラー: {e}")
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def _discard_after_commit_callbacks(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(_AFTER_COMMIT_KEY, None)
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,225 @@
+import gzip
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..utils.cache import LRUCache
+
+try:
+    import zstandard
+except ImportError:  # 未インストールなら gzip を使う
+    zstandard = None
+
+# --------------------------------------------------
+# 💡 終了したMEETUPチャットのアーカイブ
+# --------------------------------------------------
+# 最後の発言から CHAT_ARCHIVE_AFTER_DAYS 日たち、開催日も過ぎた MEETUP のチャットを
+# JSON にして圧縮し（zstandard があれば zstd、なければ gzip）、meetup_chat_archives に
+# MEETUP ごとに1行で保存してから、元の行をバッチで削除する。
+# 読み込み側（GET /meetup-chat/{post_id}）は load_archive() で透過的に読む。
+# 展開済みのアーカイブは件数上限つきの LRU に置くので、同じチャットを続けて
+# ページングしても毎回は展開しない。
+# 削除の途中で止まっても、次回は既存のアーカイブに残りをマージして続きから削除する。
+
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "30"))
+CHAT_ARCHIVE_POSTS_PER_RUN = 50
+CHAT_ARCHIVE_DELETE_BATCH = 1000
+ARCHIVE_CACHE_SIZE = 64  # 展開済みアーカイブの保持数
+
+_archive_cache = LRUCache(maxsize=ARCHIVE_CACHE_SIZE)
+
+
+class ArchivedMessage(NamedTuple):
+    """アーカイブ内のメッセージ（MeetupMessage と同じ属性名）"""
+    id: int
+    post_id: int
+    user_id: int
+    author_nickname: str
+    content: str
+    created_at: datetime
+    reactions_updated_at: Optional[datetime]
+
+
+class ArchivedChat(NamedTuple):
+    messages: List[ArchivedMessage]                 # (created_at, id) の昇順
+    reactions: Dict[int, List[dict]]                # message_id → [{user_id, reaction}]（押された順）
+
+    def reaction_summaries(self, message_ids: List[int], current_user_id: int) -> Dict[int, List[dict]]:
+        """build_reactions_for_messages と同じ形の集計（dict）を返す"""
+        result = {}
+        for mid in message_ids:
+            counts: Dict[str, int] = {}
+            mine = set()
+            for r in self.reactions.get(mid, []):
+                counts[r["reaction"]] = counts.get(r["reaction"], 0) + 1
+                if r["user_id"] == current_user_id:
+                    mine.add(r["reaction"])
+            if counts:
+                result[mid] = [
+                    {"reaction": emoji, "count": cnt, "reacted_by_me": emoji in mine}
+                    for emoji, cnt in counts.items()
+                ]
+        return result
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """タイムゾーンなしの日時（SQLite）を UTC とみなしてそろえる"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _compress(raw: bytes):
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(raw)
+    return "gzip", gzip.compress(raw, compresslevel=9)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstd のアーカイブを読むには zstandard が必要です")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _decode(codec: str, data: bytes) -> ArchivedChat:
+    payload = json.loads(_decompress(codec, data))
+    messages = [
+        ArchivedMessage(
+            id=m["id"],
+            post_id=m["post_id"],
+            user_id=m["user_id"],
+            author_nickname=m["author_nickname"],
+            content=m["content"],
+            created_at=as_utc(m["created_at"]),
+            reactions_updated_at=as_utc(m.get("reactions_updated_at")),
+        )
+        for m in payload["messages"]
+    ]
+    messages.sort(key=lambda m: (m.created_at, m.id))
+    reactions = {int(k): v for k, v in payload["reactions"].items()}
+    return ArchivedChat(messages, reactions)
+
+
+def load_archive(db: Session, post_id: int) -> Optional[ArchivedChat]:
+    """MEETUP のアーカイブを返す（なければ None）。展開結果はキャッシュする"""
+    meta = db.query(
+        models.MeetupChatArchive.message_count,
+        models.MeetupChatArchive.last_message_id
+    ).filter(models.MeetupChatArchive.post_id == post_id).first()
+    if meta is None:
+        return None
+
+    version = (meta.message_count, meta.last_message_id)
+    cached = _archive_cache.get(post_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    row = db.query(models.MeetupChatArchive.codec, models.MeetupChatArchive.data).filter(
+        models.MeetupChatArchive.post_id == post_id
+    ).first()
+    chat = _decode(row.codec, row.data)
+    _archive_cache.set(post_id, (version, chat))
+    return chat
+
+
+def _archive_post(db: Session, post_id: int) -> int:
+    """1つの MEETUP のチャットをアーカイブし、削除した元メッセージ数を返す"""
+    existing = load_archive(db, post_id)
+    messages: Dict[int, dict] = {}
+    reactions: Dict[int, List[dict]] = {}
+    if existing:
+        for m in existing.messages:
+            d = m._asdict()
+            d["created_at"] = d["created_at"].isoformat()
+            d["reactions_updated_at"] = d["reactions_updated_at"].isoformat() if d["reactions_updated_at"] else None
+            messages[m.id] = d
+        reactions = {mid: list(rs) for mid, rs in existing.reactions.items()}
+
+    hot = db.query(models.MeetupMessage).filter(models.MeetupMessage.post_id == post_id).all()
+    hot_ids = [m.id for m in hot]
+    for m in hot:
+        messages[m.id] = {
+            "id": m.id,
+            "post_id": m.post_id,
+            "user_id": m.user_id,
+            "author_nickname": m.author_nickname,
+            "content": m.content,
+            "created_at": as_utc(m.created_at).isoformat(),
+            "reactions_updated_at": as_utc(m.reactions_updated_at).isoformat() if m.reactions_updated_at else None,
+        }
+    for i in range(0, len(hot_ids), CHAT_ARCHIVE_DELETE_BATCH):
+        chunk = hot_ids[i:i + CHAT_ARCHIVE_DELETE_BATCH]
+        rows = db.query(models.MeetupMessageReaction).filter(
+            models.MeetupMessageReaction.message_id.in_(chunk)
+        ).order_by(models.MeetupMessageReaction.id).all()
+        for mid in chunk:
+            reactions[mid] = []
+        for r in rows:
+            reactions[r.message_id].append({"user_id": r.user_id, "reaction": r.reaction})
+
+    raw = json.dumps(
+        {"messages": list(messages.values()), "reactions": {str(k): v for k, v in reactions.items() if v}},
+        ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    codec, data = _compress(raw)
+
+    archive = db.query(models.MeetupChatArchive).filter(models.MeetupChatArchive.post_id == post_id).first()
+    if archive is None:
+        archive = models.MeetupChatArchive(post_id=post_id)
+        db.add(archive)
+    archive.codec = codec
+    archive.data = data
+    archive.message_count = len(messages)
+    archive.last_message_id = max(messages) if messages else None
+    archive.archived_at = datetime.now(timezone.utc)
+    db.commit()
+
+    # アーカイブを保存してから元の行をバッチで削除する
+    for i in range(0, len(hot_ids), CHAT_ARCHIVE_DELETE_BATCH):
+        chunk = hot_ids[i:i + CHAT_ARCHIVE_DELETE_BATCH]
+        for model in (models.MeetupMessageReactionCount, models.MeetupMessageReaction):
+            db.query(model).filter(model.message_id.in_(chunk)).delete(synchronize_session=False)
+        db.query(models.MeetupMessage).filter(models.MeetupMessage.id.in_(chunk)).delete(synchronize_session=False)
+        db.commit()
+        time.sleep(0.05)
+    return len(hot_ids)
+
+
+def archive_finished_chats(
+    db: Session,
+    after_days: int = CHAT_ARCHIVE_AFTER_DAYS,
+    max_posts: int = CHAT_ARCHIVE_POSTS_PER_RUN,
+) -> int:
+    """定期ジョブ：終了したMEETUPのチャットをアーカイブし、処理した MEETUP 数を返す"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=after_days)
+    post_ids = [row[0] for row in db.execute(text("""
+        SELECT m.post_id
+        FROM meetup_messages m
+        JOIN hobby_posts p ON p.id = m.post_id
+        WHERE p.meetup_date IS NULL OR p.meetup_date < :cutoff
+        GROUP BY m.post_id
+        HAVING MAX(m.created_at) < :cutoff
+        ORDER BY m.post_id
+        LIMIT :limit
+    """), {"cutoff": cutoff, "limit": max_posts}).fetchall()]
+
+    archived = 0
+    for post_id in post_ids:
+        try:
+            moved = _archive_post(db, post_id)
+            archived += 1
+            print(f"チャットアーカイブ: MEETUP {post_id}（{moved}件）")
+        except Exception as e:
+            db.rollback()
+            print(f"チャットアーカイブエラー (post={post_id}): {e}")
+    return archived
@@ -0,0 +1,68 @@
+import os
+from typing import FrozenSet, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import run_after_commit
+from ..utils.cache import LRUCache
+from ..utils.pubsub import pubsub
+
+# --------------------------------------------------
+# 💡 MEETUP チャットのメンバーキャッシュ
+# --------------------------------------------------
+# チャットの読み書きのたびに HobbyPost と PostResponse を引かないよう、
+# MEETUP ごとに「主催者 + 参加者（is_participation=True）の集合」をキャッシュする。
+# 参加・キャンセル系の処理は invalidate_membership() を呼ぶこと。
+# commit 後に Pub/Sub で全ワーカーのキャッシュを破棄する。TTL は取りこぼし時の保険。
+
+MEMBERSHIP_CACHE_TTL = int(os.getenv("CHAT_MEMBERSHIP_CACHE_TTL", "300"))  # 秒
+MEMBERSHIP_CACHE_SIZE = 5000
+MEMBERSHIP_CHANNEL = "cache:meetup_membership"
+
+
+class MeetupMembership(NamedTuple):
+    organizer_id: int
+    is_meetup: bool
+    participant_ids: FrozenSet[int]
+
+    def allows(self, user_id: int) -> bool:
+        return user_id == self.organizer_id or user_id in self.participant_ids
+
+
+_membership_cache = LRUCache(maxsize=MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
+_MISSING = MeetupMembership(organizer_id=0, is_meetup=False, participant_ids=frozenset())  # 投稿なし
+
+
+def _on_pubsub_message(channel: str, message: dict):
+    if channel == MEMBERSHIP_CHANNEL:
+        _membership_cache.pop(message["post_id"])
+
+pubsub.add_listener(_on_pubsub_message)
+
+
+def get_membership(db: Session, post_id: int) -> Optional[MeetupMembership]:
+    """MEETUP の主催者と参加者の集合を返す（投稿がなければ None）"""
+    membership = _membership_cache.get(post_id)
+    if membership is None:
+        post = db.query(models.HobbyPost.user_id, models.HobbyPost.is_meetup).filter(
+            models.HobbyPost.id == post_id
+        ).first()
+        if post is None:
+            membership = _MISSING
+        else:
+            participant_ids = frozenset(row[0] for row in db.query(models.PostResponse.user_id).filter(
+                models.PostResponse.post_id == post_id,
+                models.PostResponse.is_participation == True
+            ).all())
+            membership = MeetupMembership(post.user_id, bool(post.is_meetup), participant_ids)
+        _membership_cache.set(post_id, membership)
+    return None if membership is _MISSING else membership
+
+
+def invalidate_membership(db: Session, post_id: int):
+    """参加者が変わる処理の中で呼ぶ（commit 後に全ワーカーのキャッシュを破棄）"""
+    _membership_cache.pop(post_id)
+    run_after_commit(db, lambda: pubsub.publish(
+        MEMBERSHIP_CHANNEL, {"type": "membership_invalidate", "post_id": post_id}
+    ))
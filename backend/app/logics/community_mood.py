@@ -0,0 +1,161 @@
+import os
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..models import MOOD_SCORES
+from ..utils.cache import LRUCache
+from .mood_rollup import MOOD_TYPES, COUNT_COLUMNS
+
+# --------------------------------------------------
+# 💡 コミュニティの気分（趣味・地域ごとの集計）
+# --------------------------------------------------
+# 気分を投稿するたびに record_community_mood() で
+#   - 参加している趣味（マスター）ごと   scope="hobby", key=マスターのID
+#   - 都道府県                         scope="pref",  key=都道府県
+#   - 市区町村                         scope="city",  key="都道府県/市区町村"
+# の「1時間ごとのバケット」に1件ずつ加算する（mood_daily_rollup と同じ件数列）。
+# 読むときは期間内のバケットだけを読み、新しいバケットほど重くなるように
+# 半減期つきで重み付けして分布と平均スコアを出す。mood_logs は読まない。
+# 気分を非公開にしているユーザー（is_mood_visible / is_visible が False）の投稿は加算しない。
+# 投稿数が COMMUNITY_MOOD_MIN_POSTS 未満の集計は個人が特定されやすいので返さない。
+
+COMMUNITY_MOOD_MAX_HOURS = 30 * 24          # 保持する期間（これより古いバケットは定期ジョブで削除）
+COMMUNITY_MOOD_MIN_POSTS = int(os.getenv("COMMUNITY_MOOD_MIN_POSTS", "5"))
+COMMUNITY_MOOD_CACHE_TTL = 60               # 秒
+COMMUNITY_MOOD_SCOPES = ("hobby", "pref", "city")
+
+_result_cache = LRUCache(maxsize=256, ttl=COMMUNITY_MOOD_CACHE_TTL)
+
+_UPSERT_BUCKET = """
+    INSERT INTO community_mood_buckets (scope, scope_key, bucket, total, score_sum, {column})
+    VALUES (:scope, :key, :bucket, 1, :score, 1)
+    ON CONFLICT (scope, scope_key, bucket)
+    DO UPDATE SET total = community_mood_buckets.total + 1,
+                  score_sum = community_mood_buckets.score_sum + :score,
+                  {column} = community_mood_buckets.{column} + 1
+"""
+
+
+def _hour(at: Optional[datetime] = None) -> int:
+    """時刻を1時間バケットの番号（UNIX 時間 / 3600）にする"""
+    if at is None:
+        at = datetime.now(timezone.utc)
+    elif at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    return int(at.timestamp()) // 3600
+
+
+def _scope_keys(db: Session, user: models.User) -> List[tuple]:
+    keys = [("hobby", str(row[0])) for row in db.query(models.UserHobbyLink.master_id).filter(
+        models.UserHobbyLink.user_id == user.id
+    ).distinct().all()]
+    if user.prefecture:
+        keys.append(("pref", user.prefecture))
+        if user.city:
+            keys.append(("city", f"{user.prefecture}/{user.city}"))
+    return keys
+
+
+def record_community_mood(
+    db: Session,
+    user: models.User,
+    mood_type: str,
+    created_at: Optional[datetime] = None,
+    is_visible: bool = True,
+):
+    """気分ログ1件分をコミュニティの集計に加算する（commit は呼び出し側）"""
+    if not user.is_mood_visible or not is_visible:
+        return
+    mood_type = getattr(mood_type, "value", mood_type)
+    column = f"count_{mood_type.lower()}"
+    if column not in COUNT_COLUMNS:
+        return
+    bucket = _hour(created_at)
+    if bucket <= _hour() - COMMUNITY_MOOD_MAX_HOURS or bucket > _hour():
+        return  # 保持期間外・未来の時刻は集計しない
+
+    keys = _scope_keys(db, user)
+    if not keys:
+        return
+    score = MOOD_SCORES.get(mood_type, 3)
+    db.execute(text(_UPSERT_BUCKET.format(column=column)), [
+        {"scope": scope, "key": key, "bucket": bucket, "score": score} for scope, key in keys
+    ])
+
+
+def community_moods(
+    db: Session,
+    scope: str,
+    hours: int = 24,
+    half_life_hours: Optional[float] = None,
+    key: Optional[str] = None,
+) -> List[dict]:
+    """直近 hours 時間の趣味／地域ごとの気分の分布と平均スコア（新しいほど重い）"""
+    hours = max(1, min(hours, COMMUNITY_MOOD_MAX_HOURS))
+    half_life = half_life_hours or hours / 2
+    cache_key = (scope, hours, half_life, key)
+    cached = _result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    now = _hour()
+    sql = f"""
+        SELECT scope_key, bucket, total, score_sum, {", ".join(COUNT_COLUMNS)}
+        FROM community_mood_buckets
+        WHERE scope = :scope AND bucket > :since
+    """
+    params = {"scope": scope, "since": now - hours}
+    if key is not None:
+        sql += " AND scope_key = :key"
+        params["key"] = key
+    rows = db.execute(text(sql), params).fetchall()
+    if not rows:
+        _result_cache.set(cache_key, [])
+        return []
+
+    # キー × 気分 の行列に、バケットの新しさで重み付けして足し込む
+    keys, key_index = np.unique([r[0] for r in rows], return_inverse=True)
+    age = now - np.array([r[1] for r in rows], dtype=np.float64)
+    weight = np.power(0.5, np.clip(age, 0, None) / half_life)
+    data = np.array([r[2:] for r in rows], dtype=np.float64)
+
+    posts = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(posts, key_index, data[:, 0].astype(np.int64))
+    weighted = np.zeros((len(keys), data.shape[1]), dtype=np.float64)
+    np.add.at(weighted, key_index, data * weight[:, None])
+
+    names = {}
+    if scope == "hobby":
+        names = dict(db.query(models.HobbyCategory.id, models.HobbyCategory.name).filter(
+            models.HobbyCategory.id.in_([int(k) for k in keys if k.isdigit()])
+        ).all())
+
+    results = []
+    for i in np.flatnonzero(posts >= COMMUNITY_MOOD_MIN_POSTS):
+        total, score_sum, counts = weighted[i, 0], weighted[i, 1], weighted[i, 2:]
+        results.append({
+            "scope": scope,
+            "key": str(keys[i]),
+            "name": names.get(int(keys[i])) if scope == "hobby" else str(keys[i]),
+            "posts": int(posts[i]),
+            "average_score": round(float(score_sum / total), 2),
+            "distribution": {m: round(float(c / total), 3) for m, c in zip(MOOD_TYPES, counts) if c > 0},
+            "dominant_mood": MOOD_TYPES[int(counts.argmax())],
+        })
+    results.sort(key=lambda r: r["posts"], reverse=True)
+    _result_cache.set(cache_key, results)
+    return results
+
+
+def prune_community_mood_buckets(db: Session):
+    """保持期間を過ぎたバケットを削除する（定期ジョブ）"""
+    result = db.execute(text("DELETE FROM community_mood_buckets WHERE bucket <= :cutoff"), {
+        "cutoff": _hour() - COMMUNITY_MOOD_MAX_HOURS,
+    })
+    db.commit()
+    return result.rowcount
@@ -0,0 +1,114 @@
+import os
+from typing import FrozenSet, Iterable, List, Tuple
+
+from sqlalchemy import text, bindparam, delete
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import run_after_commit
+from ..utils.cache import LRUCache
+from ..utils.pubsub import pubsub
+
+# --------------------------------------------------
+# 💡 友達グラフ（隣接集合キャッシュ + users.friend_count）
+# --------------------------------------------------
+# ユーザーごとの友達ID集合をプロセス内 LRU に置き、初回参照時に friendships から読む。
+# 友達数は users.friend_count に保持し、COUNT(*) はしない。
+# Friendship を作る処理は add_friendship() を呼ぶこと。消すときは remove_friendship() が行ごと消す。
+#   - friend_count はその場で UPDATE（呼び出し側のトランザクションに含まれる）
+#   - 隣接集合は commit 後に Pub/Sub で全ワーカーへ差分を配る
+# 差分の適用は「集合への追加／削除」なので、何度適用しても結果は同じ。TTL は取りこぼし時の保険。
+
+FRIEND_GRAPH_CACHE_TTL = int(os.getenv("FRIEND_GRAPH_CACHE_TTL", "600"))  # 秒
+FRIEND_GRAPH_CACHE_SIZE = 20000
+FRIEND_GRAPH_CHANNEL = "cache:friend_graph"
+EDGES_PER_MESSAGE = 300  # 1メッセージに載せる辺の数（NOTIFY のサイズ上限対策）
+
+_adjacency = LRUCache(maxsize=FRIEND_GRAPH_CACHE_SIZE, ttl=FRIEND_GRAPH_CACHE_TTL)
+
+
+def _apply_edges(edges: Iterable[Tuple[int, int]], added: bool):
+    for a, b in edges:
+        for user_id, friend_id in ((a, b), (b, a)):
+            if added:
+                _adjacency.update(user_id, lambda ids, f=friend_id: ids | {f})
+            else:
+                _adjacency.update(user_id, lambda ids, f=friend_id: ids - {f})
+
+
+def _on_pubsub_message(channel: str, message: dict):
+    if channel == FRIEND_GRAPH_CHANNEL:
+        _apply_edges(message["edges"], message["op"] == "add")
+
+pubsub.add_listener(_on_pubsub_message)
+
+
+def get_friend_ids(db: Session, user_id: int) -> FrozenSet[int]:
+    """友達のユーザーID集合（キャッシュになければ friendships から読む）"""
+    friend_ids = _adjacency.get(user_id)
+    if friend_ids is None:
+        friend_ids = frozenset(row[0] for row in db.query(models.Friendship.friend_id).filter(
+            models.Friendship.user_id == user_id
+        ).all())
+        _adjacency.set(user_id, friend_ids)
+    return friend_ids
+
+
+def get_friend_count(db: Session, user_id: int) -> int:
+    """友達数（キャッシュ済みなら集合の大きさ、なければ users.friend_count）"""
+    friend_ids = _adjacency.get(user_id)
+    if friend_ids is not None:
+        return len(friend_ids)
+    count = db.query(models.User.friend_count).filter(models.User.id == user_id).scalar()
+    return count or 0
+
+
+_UPDATE_FRIEND_COUNT = text("""
+    UPDATE users
+    SET friend_count = CASE WHEN friend_count + :delta < 0 THEN 0 ELSE friend_count + :delta END
+    WHERE id IN :user_ids
+""").bindparams(bindparam("user_ids", expanding=True))
+
+
+def _publish_edges(db: Session, edges: List[Tuple[int, int]], added: bool):
+    op = "add" if added else "remove"
+    chunks = [edges[i:i + EDGES_PER_MESSAGE] for i in range(0, len(edges), EDGES_PER_MESSAGE)]
+    run_after_commit(db, lambda: pubsub.publish_many([
+        (FRIEND_GRAPH_CHANNEL, {"type": "friend_graph", "op": op, "edges": chunk})
+        for chunk in chunks
+    ]))
+
+
+def add_friendship(db: Session, user_id: int, friend_id: int):
+    """双方向の Friendship を作った処理の中で呼ぶ（commit は呼び出し側）"""
+    db.execute(_UPDATE_FRIEND_COUNT, {"delta": 1, "user_ids": [user_id, friend_id]})
+    _publish_edges(db, [(user_id, friend_id)], added=True)
+
+
+def remove_friendship(db: Session, user_id: int, friend_id: int) -> int:
+    """双方向の Friendship を消す（commit は呼び出し側）。
+    friend_count は実際に行が消えた側だけ減らす（片方向しか残っていない壊れたデータもある）"""
+    owners = []
+    for a, b in ((user_id, friend_id), (friend_id, user_id)):
+        result = db.execute(delete(models.Friendship).where(
+            models.Friendship.user_id == a,
+            models.Friendship.friend_id == b
+        ))
+        if result.rowcount:
+            owners.append(a)
+    if owners:
+        db.execute(_UPDATE_FRIEND_COUNT, {"delta": -1, "user_ids": owners})
+    _publish_edges(db, [(user_id, friend_id)], added=False)
+    return len(owners)
+
+
+def remove_user(db: Session, user_id: int):
+    """退会するユーザーの友達関係をすべて外す（CASCADE で消える Friendship の分。commit は呼び出し側）。
+    友達側の friend_count はその友達の行（friend_id = 退会者）で数えるので、キャッシュではなく DB から読む"""
+    owner_ids = [row[0] for row in db.query(models.Friendship.user_id).filter(
+        models.Friendship.friend_id == user_id
+    ).all()]
+    if owner_ids:
+        db.execute(_UPDATE_FRIEND_COUNT, {"delta": -1, "user_ids": owner_ids})
+        _publish_edges(db, [(user_id, owner_id) for owner_id in owner_ids], added=False)
+    _adjacency.pop(user_id)
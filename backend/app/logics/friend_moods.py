@@ -0,0 +1,107 @@
+import os
+from typing import Iterable, List
+
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import run_after_commit
+from ..utils.cache import LRUCache
+from ..utils.pubsub import pubsub
+from .friend_graph import get_friend_ids
+
+# --------------------------------------------------
+# 💡 友達の気分ボード（キャッシュ付き）
+# --------------------------------------------------
+# GET /users/following/moods はポーリングされるので、ユーザーごとの結果を
+# 件数上限つきの LRU にキャッシュする。
+# 気分の投稿・公開設定・ニックネームの変更では invalidate_friends_of() を、
+# 友達関係（追加・削除・メモ・ミュート・非表示）の変更では
+# invalidate_friend_moods() を呼ぶこと。
+# commit 後に Pub/Sub で全ワーカーのキャッシュを破棄する。TTL は取りこぼし時の保険。
+
+FRIEND_MOODS_CACHE_TTL = int(os.getenv("FRIEND_MOODS_CACHE_TTL", "600"))  # 秒
+FRIEND_MOODS_CACHE_SIZE = 10000
+FRIEND_MOODS_CHANNEL = "cache:friend_moods"
+INVALIDATE_CHUNK = 500  # 1メッセージに載せるユーザー数（NOTIFY のサイズ上限対策）
+
+_board_cache = LRUCache(maxsize=FRIEND_MOODS_CACHE_SIZE, ttl=FRIEND_MOODS_CACHE_TTL)
+
+
+def _on_pubsub_message(channel: str, message: dict):
+    if channel == FRIEND_MOODS_CHANNEL:
+        for user_id in message["user_ids"]:
+            _board_cache.pop(user_id)
+
+pubsub.add_listener(_on_pubsub_message)
+
+
+def _build_board(db: Session, user_id: int) -> List[dict]:
+    if not get_friend_ids(db, user_id):
+        return []
+
+    # 1. 自分が登録している友達関係を取得
+    friendships = db.query(models.Friendship).filter(
+        models.Friendship.user_id == user_id,
+    ).all()
+    if not friendships:
+        return []
+
+    friendship_map = {f.friend_id: f for f in friendships}
+
+    # 2. 全体公開設定がONのユーザーのみ取得
+    users = db.query(models.User).filter(
+        models.User.id.in_(list(friendship_map)),
+        models.User.is_mood_visible == True
+    ).all()
+
+    # 3. 返却用のリストを作成
+    results = []
+    for user in users:
+        fs = friendship_map[user.id]
+
+        # 【送り手優先】コメント非公開設定ならコメントをNoneにする
+        is_comment_ok = getattr(user, "is_mood_comment_visible", True)
+        results.append({
+            "user_id": user.id,
+            "nickname": user.nickname,
+            "username": user.username,
+            "email": user.email,
+            "current_mood": user.current_mood,
+            "current_mood_comment": user.current_mood_comment if is_comment_ok else None,
+            "mood_updated_at": user.mood_updated_at,
+            "is_mood_comment_visible": bool(is_comment_ok),
+            "is_mood_visible": bool(user.is_mood_visible),
+            "friend_note": fs.friend_note,
+            "is_muted": bool(fs.is_muted),
+            "is_hidden": bool(fs.is_hidden),
+        })
+    return results
+
+
+def get_friend_moods(db: Session, user_id: int) -> List[dict]:
+    """友達の最新の気分一覧を返す（キャッシュ済みならそれを返す）"""
+    board = _board_cache.get(user_id)
+    if board is None:
+        board = _build_board(db, user_id)
+        _board_cache.set(user_id, board)
+    return board
+
+
+def invalidate_friend_moods(db: Session, user_ids: Iterable[int]):
+    """指定ユーザーのボードを破棄する（commit 後に全ワーカーへ通知）"""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        _board_cache.pop(user_id)
+    chunks = [user_ids[i:i + INVALIDATE_CHUNK] for i in range(0, len(user_ids), INVALIDATE_CHUNK)]
+    run_after_commit(db, lambda: pubsub.publish_many([
+        (FRIEND_MOODS_CHANNEL, {"type": "friend_moods_invalidate", "user_ids": chunk})
+        for chunk in chunks
+    ]))
+
+
+def invalidate_friends_of(db: Session, user_id: int):
+    """user_id を友達に登録している全員のボードを破棄する（気分の投稿時など）"""
+    # 友達関係は双方向なので、user_id の友達 = user_id を友達に登録している人
+    invalidate_friend_moods(db, get_friend_ids(db, user_id))
@@ -0,0 +1,263 @@
+import os
+import time
+from datetime import datetime, timezone
+from typing import List, NamedTuple, Tuple
+
+import numpy as np
+from sqlalchemy import text, bindparam, insert
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..utils.cache import LRUCache
+from .friend_graph import get_friend_ids
+
+# --------------------------------------------------
+# 💡 友達のおすすめ（共通の友達 + 共通のコミュニティ）
+# --------------------------------------------------
+# 夜間ジョブ compute_friend_suggestions が全ユーザー分を計算して friend_suggestions に保存し、
+# GET /users/me/friend-suggestions はその結果（+ 短い LRU キャッシュ）を返すだけにする。
+#
+# 計算は NumPy の CSR 形式（indptr / indices）の疎行列で行う。
+#   F: ユーザー × ユーザー（友達関係）   M: ユーザー × コミュニティ（UserHobbyLink.master_id）
+#   共通の友達     = F @ F の該当行
+#   共通コミュニティ = M @ diag(idf) @ Mᵀ の該当行（大人数のコミュニティほど重みを小さく）
+# 行列全体は作らず、ユーザーを「処理量（たどる辺の数）」が一定以下になるようにまとめて
+# バッチごとに行を計算し、上位 SUGGEST_TOP_K 件だけ残す。
+# スコア = (共通の友達 × W_MUTUAL + 共通コミュニティ × W_SHARED) × 地域係数（同じ都道府県・市区町村）
+
+SUGGEST_TOP_K = 50
+SUGGEST_WORK_BUDGET = int(os.getenv("FRIEND_SUGGEST_WORK_BUDGET", "4000000"))  # 1バッチでたどる辺の数の目安
+SUGGEST_MAX_COMMUNITY_SIZE = 5000   # これより大きいコミュニティは候補探しに使わない
+SUGGEST_BATCH_PAUSE = 0.05          # バッチ間の待ち（秒）
+SUGGEST_CACHE_TTL = 60 * 60         # 秒
+
+W_MUTUAL = 1.0
+W_SHARED = 0.5
+W_SAME_PREF = 0.3
+W_SAME_CITY = 0.5
+
+_suggestion_cache = LRUCache(maxsize=10000, ttl=SUGGEST_CACHE_TTL)
+
+
+class CSR(NamedTuple):
+    indptr: np.ndarray   # 行 i の要素は indices[indptr[i]:indptr[i + 1]]
+    indices: np.ndarray
+
+
+def _csr(rows: np.ndarray, cols: np.ndarray, n_rows: int) -> CSR:
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return CSR(indptr, cols[order])
+
+
+def _gather(csr: CSR, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """rows の各行の要素を並べて (何番目の行か, 要素) を返す"""
+    starts = csr.indptr[rows]
+    lengths = csr.indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    owner = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owner, csr.indices[np.repeat(starts, lengths) + offsets]
+
+
+def _load_pairs(db: Session, sql: str) -> np.ndarray:
+    """2列の整数ペアをサーバーサイドカーソルで読み、(k, 2) の配列にする"""
+    parts = [np.empty((0, 2), dtype=np.int64)]
+    result = db.execute(text(sql).execution_options(yield_per=100000))
+    for rows in result.partitions():
+        parts.append(np.array(rows, dtype=np.int64).reshape(-1, 2))
+    return np.concatenate(parts)
+
+
+def _region_codes(values: List) -> np.ndarray:
+    """地域名を整数コードにする（未設定は -1）"""
+    codes = {}
+    return np.array([codes.setdefault(v, len(codes)) if v else -1 for v in values], dtype=np.int64)
+
+
+class _Graph(NamedTuple):
+    user_ids: np.ndarray     # 添字 → ユーザーID（昇順）
+    friends: CSR
+    communities: CSR         # ユーザー → コミュニティ
+    members: CSR             # コミュニティ → ユーザー（大きすぎるコミュニティは空）
+    idf: np.ndarray          # コミュニティごとの重み
+    pref: np.ndarray
+    city: np.ndarray
+
+
+def _load_graph(db: Session) -> _Graph:
+    users = db.execute(text("""
+        SELECT id, prefecture, city FROM users WHERE is_active = true ORDER BY id
+    """)).fetchall()
+    user_ids = np.array([u.id for u in users], dtype=np.int64)
+    n = len(user_ids)
+
+    def to_index(ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """ユーザーID → 添字（(添字, 有効なユーザーか) を返す）"""
+        if n == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(user_ids, ids), n - 1)
+        return pos, user_ids[pos] == ids
+
+    edges = _load_pairs(db, "SELECT user_id, friend_id FROM friendships")
+    src, ok_src = to_index(edges[:, 0])
+    dst, ok_dst = to_index(edges[:, 1])
+    ok = ok_src & ok_dst
+    friends = _csr(src[ok], dst[ok], n)
+
+    links = _load_pairs(db, "SELECT DISTINCT user_id, master_id FROM user_hobby_links")
+    member, ok = to_index(links[:, 0])
+    master_ids, community = np.unique(links[ok, 1], return_inverse=True)
+    member = member[ok]
+    n_communities = len(master_ids)
+    communities = _csr(member, community, n)
+
+    sizes = np.bincount(community, minlength=n_communities)
+    small = sizes[community] <= SUGGEST_MAX_COMMUNITY_SIZE
+    members = _csr(community[small], member[small], n_communities)
+    idf = np.log1p(n / np.maximum(sizes, 1)) if n_communities else np.zeros(0)
+
+    return _Graph(
+        user_ids, friends, communities, members, idf,
+        _region_codes([u.prefecture for u in users]),
+        _region_codes([u.city for u in users]),
+    )
+
+
+def _work_per_user(graph: _Graph) -> np.ndarray:
+    """各ユーザーの行を計算するときにたどる辺の数（友達の友達 + 同じコミュニティの人）"""
+    def row_sums(csr: CSR, values: np.ndarray) -> np.ndarray:
+        sums = np.concatenate([[0], np.cumsum(values[csr.indices])])
+        return sums[csr.indptr[1:]] - sums[csr.indptr[:-1]]
+
+    degree = np.diff(graph.friends.indptr)
+    community_size = np.diff(graph.members.indptr)
+    return row_sums(graph.friends, degree) + row_sums(graph.communities, community_size) + 1
+
+
+def _score_batch(graph: _Graph, sources: np.ndarray):
+    """sources（添字）の各ユーザーについて上位候補を計算する"""
+    n = len(graph.user_ids)
+    b = len(sources)
+
+    # 共通の友達：F の行をたどり、友達の友達を数える
+    own, friend = _gather(graph.friends, sources)
+    own2, fof = _gather(graph.friends, friend)
+    mutual_keys = own[own2] * n + fof
+
+    # 共通コミュニティ：M の行 → 各コミュニティのメンバー（idf で重み付け）
+    own, community = _gather(graph.communities, sources)
+    own2, co_member = _gather(graph.members, community)
+    shared_keys = own[own2] * n + co_member
+    shared_weights = graph.idf[community][own2]
+
+    keys, inverse = np.unique(np.concatenate([mutual_keys, shared_keys]), return_inverse=True)
+    n_mutual = len(mutual_keys)
+    mutual = np.bincount(inverse[:n_mutual], minlength=len(keys))
+    shared = np.bincount(inverse[n_mutual:], minlength=len(keys))
+    shared_score = np.bincount(inverse[n_mutual:], weights=shared_weights, minlength=len(keys))
+
+    # 自分自身と既存の友達は除く
+    own, friend = _gather(graph.friends, sources)
+    exclude = np.concatenate([np.arange(b) * n + sources, own * n + friend])
+    keep = ~np.isin(keys, exclude)
+    keys, mutual, shared, shared_score = keys[keep], mutual[keep], shared[keep], shared_score[keep]
+
+    owner, candidate = keys // n, keys % n
+    src = sources[owner]
+    same_pref = (graph.pref[src] >= 0) & (graph.pref[src] == graph.pref[candidate])
+    same_city = (graph.city[src] >= 0) & (graph.city[src] == graph.city[candidate]) & same_pref
+    score = (W_MUTUAL * mutual + W_SHARED * shared_score) * (1 + W_SAME_PREF * same_pref + W_SAME_CITY * same_city)
+
+    # ユーザーごとにスコア順に並べ、上位 SUGGEST_TOP_K 件だけ残す
+    order = np.lexsort((-score, owner))
+    owner, candidate, score = owner[order], candidate[order], score[order]
+    mutual, shared = mutual[order], shared[order]
+    group_start = np.searchsorted(owner, np.arange(b))
+    rank = np.arange(len(owner)) - group_start[owner]
+    top = rank < SUGGEST_TOP_K
+    return (
+        graph.user_ids[sources[owner[top]]], graph.user_ids[candidate[top]],
+        score[top], mutual[top], shared[top],
+    )
+
+
+_DELETE_SUGGESTIONS = text("""
+    DELETE FROM friend_suggestions WHERE user_id IN :user_ids
+""").bindparams(bindparam("user_ids", expanding=True))
+
+
+def compute_friend_suggestions(db: Session) -> int:
+    """夜間ジョブ：全ユーザーのおすすめを計算して保存し、保存した件数を返す"""
+    started = time.monotonic()
+    graph = _load_graph(db)
+    n = len(graph.user_ids)
+    if n == 0:
+        return 0
+
+    # たどる辺の数が SUGGEST_WORK_BUDGET 前後になるようにユーザーをまとめる
+    work = np.cumsum(_work_per_user(graph))
+    bounds = np.searchsorted(work, np.arange(SUGGEST_WORK_BUDGET, work[-1], SUGGEST_WORK_BUDGET))
+    bounds = np.unique(np.concatenate([[0], bounds + 1, [n]]).clip(0, n))
+
+    now = datetime.now(timezone.utc)
+    saved = 0
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        sources = np.arange(start, end)
+        user_ids, candidate_ids, scores, mutual, shared = _score_batch(graph, sources)
+        rows = [
+            {
+                "user_id": int(u), "candidate_id": int(c), "score": round(float(s), 4),
+                "mutual_friends": int(m), "shared_communities": int(sh), "computed_at": now,
+            }
+            for u, c, s, m, sh in zip(user_ids, candidate_ids, scores, mutual, shared)
+        ]
+        try:
+            db.execute(_DELETE_SUGGESTIONS, {"user_ids": [int(u) for u in graph.user_ids[start:end]]})
+            if rows:
+                db.execute(insert(models.FriendSuggestion), rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        saved += len(rows)
+        time.sleep(SUGGEST_BATCH_PAUSE)
+
+    _suggestion_cache.clear()
+    print(f"友達のおすすめ: {n}人分 / {saved}件を保存しました（{time.monotonic() - started:.1f}秒）")
+    return saved
+
+
+def get_friend_suggestions(db: Session, user_id: int, limit: int = 20) -> List[dict]:
+    """保存済みのおすすめから、現在の友達・申請中の相手を除いて上位 limit 件を返す"""
+    cached = _suggestion_cache.get(user_id)
+    if cached is None:
+        cached = [
+            (row.candidate_id, row.score, row.mutual_friends, row.shared_communities)
+            for row in db.query(models.FriendSuggestion).filter(
+                models.FriendSuggestion.user_id == user_id
+            ).order_by(models.FriendSuggestion.score.desc()).all()
+        ]
+        _suggestion_cache.set(user_id, cached)
+
+    pending = {
+        row[0] if row[0] != user_id else row[1]
+        for row in db.query(models.FriendRequest.requester_id, models.FriendRequest.receiver_id).filter(
+            models.FriendRequest.status == models.FriendRequestStatus.PENDING,
+            (models.FriendRequest.requester_id == user_id) | (models.FriendRequest.receiver_id == user_id),
+        ).all()
+    }
+    friend_ids = get_friend_ids(db, user_id)
+    picked = [s for s in cached if s[0] not in friend_ids and s[0] not in pending][:limit]
+    if not picked:
+        return []
+
+    users = {u.id: u for u in db.query(models.User).filter(
+        models.User.id.in_([s[0] for s in picked]),
+        models.User.is_active == True
+    ).all()}
+    return [
+        {"user": users[cid], "score": score, "mutual_friends": mutual, "shared_communities": shared}
+        for cid, score, mutual, shared in picked if cid in users
+    ]
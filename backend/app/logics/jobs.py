@@ -0,0 +1,106 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from ..database import SessionLocal
+
+# --------------------------------------------------
+# 💡 定期ジョブ
+# --------------------------------------------------
+# アプリ起動時（main.py の startup）に各ジョブを一定間隔で実行する。
+# ジョブは fn(db) の形。同期関数はスレッドプールで、async 関数はそのまま実行する。
+# 間隔が LONG_JOB_INTERVAL 以上のジョブは起動直後には実行せず、日本時間の決まった時刻に実行する
+# （at="HH:MM" を起点に interval ごと。デプロイのたびに重いジョブが一斉に走らないように）。
+# BACKGROUND_JOBS_ENABLED=false で無効化できる（複数プロセス構成で1台だけ動かす場合など）。
+# 1回だけ手動実行したいときは scripts/run_job.py を使う。
+
+BACKGROUND_JOBS_ENABLED = os.getenv("BACKGROUND_JOBS_ENABLED", "true").lower() == "true"
+
+LONG_JOB_INTERVAL = 60 * 60  # 秒
+JOB_TZ = timezone(timedelta(hours=9))  # 日本時間
+
+_jobs: Dict[str, dict] = {}
+_tasks: List[asyncio.Task] = []
+
+
+def register_job(name: str, interval_seconds: float, fn: Callable, at: Optional[str] = None):
+    _jobs[name] = {"interval": interval_seconds, "fn": fn, "at": at or "00:00"}
+
+
+def _seconds_until_next_run(interval: float, at: str, now: Optional[datetime] = None) -> float:
+    """at（日本時間）を起点に interval ごとに並べた実行時刻のうち、次の時刻までの秒数"""
+    now = now or datetime.now(JOB_TZ)
+    hour, minute = map(int, at.split(":"))
+    origin = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return interval - (now - origin).total_seconds() % interval
+
+
+def _run_sync(fn: Callable):
+    db = SessionLocal()
+    try:
+        return fn(db)
+    finally:
+        db.close()
+
+
+async def run_job_once(name: str):
+    fn = _jobs[name]["fn"]
+    if asyncio.iscoroutinefunction(fn):
+        db = SessionLocal()
+        try:
+            return await fn(db)
+        finally:
+            db.close()
+    return await asyncio.to_thread(_run_sync, fn)
+
+
+async def _job_loop(name: str, interval: float, at: str):
+    scheduled = interval >= LONG_JOB_INTERVAL
+    while True:
+        if scheduled:
+            await asyncio.sleep(_seconds_until_next_run(interval, at))
+        try:
+            await run_job_once(name)
+        except Exception as e:
+            print(f"定期ジョブ {name} エラー: {e}")
+        if not scheduled:
+            await asyncio.sleep(interval)
+
+
+def start_jobs():
+    if not BACKGROUND_JOBS_ENABLED or _tasks:
+        return
+    for name, job in _jobs.items():
+        _tasks.append(asyncio.create_task(_job_loop(name, job["interval"], job["at"])))
+
+
+async def stop_jobs():
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+# --- ジョブの登録 ---
+from .notification_retention import archive_read_notifications
+from .notification_digest import flush_notification_digests, DIGEST_FLUSH_INTERVAL
+from .reaction_counts import reconcile_reaction_counts
+from .chat_archive import archive_finished_chats
+from .mood_retention import enforce_mood_retention
+from .friend_suggestions import compute_friend_suggestions
+from .community_mood import prune_community_mood_buckets
+from .meetup_charges import resume_charge_runs
+from .stripe_webhooks import process_webhook_events, WEBHOOK_POLL_INTERVAL
+from .notifications import resume_all_fanouts
+
+register_job("archive_notifications", 60 * 60, archive_read_notifications, at="00:15")
+register_job("flush_notification_digests", DIGEST_FLUSH_INTERVAL, flush_notification_digests)
+register_job("reconcile_reaction_counts", 24 * 60 * 60, reconcile_reaction_counts, at="03:00")
+register_job("archive_finished_chats", 24 * 60 * 60, archive_finished_chats, at="03:30")
+register_job("enforce_mood_retention", 6 * 60 * 60, enforce_mood_retention, at="02:00")
+register_job("compute_friend_suggestions", 24 * 60 * 60, compute_friend_suggestions, at="04:00")
+register_job("prune_community_mood_buckets", 6 * 60 * 60, prune_community_mood_buckets, at="02:30")
+register_job("resume_charge_runs", 5 * 60, resume_charge_runs)
+register_job("process_webhook_events", WEBHOOK_POLL_INTERVAL, process_webhook_events)
+register_job("resume_all_fanouts", 60, resume_all_fanouts)
@@ -0,0 +1,296 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+import stripe
+from sqlalchemy import text, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..utils.stripe_gateway import stripe_call
+from .payment_methods import (
+    default_payment_methods, lookup_payment_method, remember_payment_method, forget_payment_method,
+    is_stale_payment_method_error,
+)
+
+# --------------------------------------------------
+# 💡 MEETUP「開催決定」時の一斉課金（再開できる課金ラン）
+# --------------------------------------------------
+# 以前は1リクエストの中で参加者を1人ずつ課金していたため、途中でタイムアウトすると
+# 誰に課金済みなのかが残らなかった。
+# いまは課金1回分を meetup_charge_runs に、参加者ごとの状態を meetup_charge_items に保存する。
+#   pending → charging → succeeded / failed / no_card
+# 1. start_charge_run()   : 主催者の Connect アカウントを1回だけ調べ、参加者の行を作って commit
+# 2. process_charge_run() : 未完了の参加者を charging にして commit してから、
+#                           MEETUP_CHARGE_CONCURRENCY 人ずつ並行して課金。1人終わるごとに commit
+# 冪等キーは "meetup_charge:<run_id>:<user_id>" なので、charging のまま止まった参加者を
+# やり直しても二重に課金されない（Stripe は同じキーに同じ結果を返す）。
+# 処理中のランには locked_until（リース）を付け、同時に2か所で処理しない。
+# リクエストが途中で落ちても、定期ジョブ resume_charge_runs() がリースの切れたランを再開する。
+# 保存済みのカードが外されていたら（Webhook の反映待ち）、Stripe で調べ直したカードで1回だけやり直す。
+# やり直しはカードIDを付けた冪等キーで行う（同じキーだと Stripe は前のエラーをそのまま返す）。
+# 使うカードと冪等キーは最初の試行の前に meetup_charge_items に保存し、通信エラー後のやり直しでも
+# 同じ組を使う（間にカードが変わって別のカードで同じキーを使うと Stripe は idempotency_error を返し、
+# 1回目が実は成功していても失敗扱いになってしまう）。
+
+MEETUP_CHARGE_CONCURRENCY = int(os.getenv("MEETUP_CHARGE_CONCURRENCY", "8"))
+MEETUP_CHARGE_MAX_ATTEMPTS = 3                  # 通信エラーなどで再試行する回数の上限
+MEETUP_CHARGE_LEASE = timedelta(minutes=5)
+
+OPEN_STATUSES = ("pending", "charging")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def start_charge_run(
+    db: Session,
+    post_id: int,
+    organizer_id: int,
+    fee: int,
+    organizer_amount: int,
+    commission_amount: int,
+) -> models.MeetupChargeRun:
+    """投稿の課金ランを作る（既にあればそれを返す）"""
+    run = db.query(models.MeetupChargeRun).filter(models.MeetupChargeRun.post_id == post_id).first()
+    if run:
+        return run
+
+    # ✅ Stripe Connect設定済みの場合：主催者アカウントへ95%をTransfer
+    organizer = db.execute(
+        text("SELECT stripe_connect_account_id, stripe_connect_onboarded FROM users WHERE id = :uid"),
+        {"uid": organizer_id}
+    ).fetchone()
+    destination = None
+    if organizer and organizer.stripe_connect_account_id and organizer.stripe_connect_onboarded:
+        destination = organizer.stripe_connect_account_id
+
+    participants = db.execute(text("""
+        SELECT pr.user_id, pr.stripe_customer_id
+        FROM post_responses pr
+        WHERE pr.post_id = :pid
+          AND pr.is_participation = true
+          AND pr.stripe_customer_id IS NOT NULL
+          AND pr.cancel_charged_at IS NULL
+    """), {"pid": post_id}).fetchall()
+
+    run = models.MeetupChargeRun(
+        post_id=post_id,
+        organizer_id=organizer_id,
+        fee=fee,
+        organizer_amount=organizer_amount,
+        commission_amount=commission_amount,
+        transfer_destination=destination,
+        status="running",
+    )
+    run.items = [
+        models.MeetupChargeItem(user_id=p.user_id, stripe_customer_id=p.stripe_customer_id, status="pending")
+        for p in participants
+    ]
+    db.add(run)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 同時に「開催決定」が押された場合は、先に作られた方を使う
+        db.rollback()
+        run = db.query(models.MeetupChargeRun).filter(models.MeetupChargeRun.post_id == post_id).one()
+    return run
+
+
+def _create_charge(run: dict, user_id: int, customer_id: str, payment_method_id: str, idempotency_key: str):
+    """参加者1人分の PaymentIntent を作って確定する"""
+    pi_params: dict = {
+        "amount": run["fee"],
+        "currency": "jpy",
+        "customer": customer_id,
+        "payment_method": payment_method_id,
+        "confirm": True,
+        "off_session": True,
+        "metadata": {
+            "user_id":           str(user_id),
+            "post_id":           str(run["post_id"]),
+            "product":           "meetup_fee",
+            "organizer_id":      str(run["organizer_id"]),
+            "organizer_amount":  str(run["organizer_amount"]),
+            "commission_amount": str(run["commission_amount"]),
+        },
+    }
+    if run["transfer_destination"]:
+        pi_params["transfer_data"] = {
+            "amount": run["organizer_amount"],
+            "destination": run["transfer_destination"],
+        }
+    return stripe_call(stripe.PaymentIntent.create, idempotency_key=idempotency_key, **pi_params)
+
+
+def _charge_one(
+    run: dict, user_id: int, customer_id: str, payment_method_id: str, idempotency_key: str
+) -> Tuple[str, Optional[str], Optional[str], Optional[str], str]:
+    """
+    参加者1人に課金する（ワーカースレッドで実行。DB には触らない）。
+    (状態, PaymentIntent ID, エラー, 使ったカードID, 使った冪等キー) を返す。
+    """
+    try:
+        try:
+            pi = _create_charge(run, user_id, customer_id, payment_method_id, idempotency_key)
+        except stripe.error.InvalidRequestError as e:
+            if not is_stale_payment_method_error(e):
+                raise
+            # 保存済みのカードが外されていた：調べ直したカードで1回だけやり直す
+            fresh = lookup_payment_method(customer_id)
+            if not fresh:
+                return "no_card", None, "no_card", None, idempotency_key
+            if fresh == payment_method_id:
+                raise
+            payment_method_id = fresh
+            idempotency_key = f"meetup_charge:{run['id']}:{user_id}:{fresh}"
+            pi = _create_charge(run, user_id, customer_id, fresh, idempotency_key)
+        return "succeeded", pi.id, None, payment_method_id, idempotency_key
+    except (stripe.error.CardError, stripe.error.InvalidRequestError) as e:
+        return "failed", None, str(e), payment_method_id, idempotency_key
+    except stripe.error.StripeError as e:
+        return "retry", None, str(e), payment_method_id, idempotency_key
+
+
+def _claim(db: Session, run_id: int) -> bool:
+    """ランのリースを取る（他で処理中なら False）"""
+    now = _now()
+    claimed = db.query(models.MeetupChargeRun).filter(
+        models.MeetupChargeRun.id == run_id,
+        models.MeetupChargeRun.status == "running",
+        or_(models.MeetupChargeRun.locked_until.is_(None), models.MeetupChargeRun.locked_until < now),
+    ).update({"locked_until": now + MEETUP_CHARGE_LEASE}, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+
+def process_charge_run(db: Session, run_id: int) -> bool:
+    """未完了の参加者に課金し、全員終われば完了にする（リースが取れなければ何もしない）"""
+    if not _claim(db, run_id):
+        return False
+
+    run = db.get(models.MeetupChargeRun, run_id)
+    db.refresh(run)
+    items = db.query(models.MeetupChargeItem).filter(
+        models.MeetupChargeItem.run_id == run_id,
+        models.MeetupChargeItem.status.in_(OPEN_STATUSES),
+    ).all()
+    snapshot = {
+        "id": run.id,
+        "post_id": run.post_id,
+        "organizer_id": run.organizer_id,
+        "fee": run.fee,
+        "organizer_amount": run.organizer_amount,
+        "commission_amount": run.commission_amount,
+        "transfer_destination": run.transfer_destination,
+    }
+    # 保存済みのカードはまとめて読む
+    saved = default_payment_methods(db, [item.stripe_customer_id for item in items])
+    with ThreadPoolExecutor(max_workers=MEETUP_CHARGE_CONCURRENCY) as pool:
+        # まだカードを決めていない参加者：保存がなければ Stripe で調べる（結果は保存する）
+        undecided = [item for item in items if not item.payment_method_id]
+        unknown = list({item.stripe_customer_id for item in undecided} - set(saved))
+        for customer_id, payment_method_id in zip(unknown, pool.map(lookup_payment_method, unknown)):
+            if payment_method_id:
+                remember_payment_method(db, customer_id, payment_method_id)
+                saved[customer_id] = payment_method_id
+        # カードと冪等キーを決めて、課金の前に commit する
+        for item in undecided:
+            item.payment_method_id = saved.get(item.stripe_customer_id)
+            if item.payment_method_id:
+                item.idempotency_key = f"meetup_charge:{run.id}:{item.user_id}"
+            else:
+                item.status = "no_card"
+                item.error = "no_card"
+        items = [item for item in items if item.payment_method_id]
+        for item in items:
+            item.status = "charging"
+        db.commit()
+
+        futures = {
+            pool.submit(
+                _charge_one, snapshot, item.user_id, item.stripe_customer_id,
+                item.payment_method_id, item.idempotency_key
+            ): item
+            for item in items
+        }
+        for future in as_completed(futures):
+            item = futures[future]
+            status, payment_intent_id, error, payment_method_id, idempotency_key = future.result()
+            customer_id = item.stripe_customer_id
+            if status == "no_card":
+                if customer_id in saved:
+                    forget_payment_method(db, saved.pop(customer_id))
+            elif payment_method_id != item.payment_method_id:
+                # 外れていたカードの代わり：以後のやり直しはこのカードとキーで
+                item.payment_method_id = payment_method_id
+                item.idempotency_key = idempotency_key
+                remember_payment_method(db, customer_id, payment_method_id)
+                saved[customer_id] = payment_method_id
+            item.attempts += 1
+            item.error = error
+            if status == "retry":
+                item.status = "failed" if item.attempts >= MEETUP_CHARGE_MAX_ATTEMPTS else "pending"
+            else:
+                item.status = status
+                item.payment_intent_id = payment_intent_id
+            run.locked_until = _now() + MEETUP_CHARGE_LEASE
+            db.commit()
+
+    remaining = db.query(models.MeetupChargeItem).filter(
+        models.MeetupChargeItem.run_id == run_id,
+        models.MeetupChargeItem.status.in_(OPEN_STATUSES),
+    ).count()
+    if remaining == 0:
+        run.status = "completed"
+        run.finished_at = _now()
+        db.execute(text("""
+            UPDATE hobby_posts SET meetup_confirmed_at = CURRENT_TIMESTAMP WHERE id = :pid
+        """), {"pid": run.post_id})
+    run.locked_until = None
+    db.commit()
+    return True
+
+
+def charge_run_summary(db: Session, run: models.MeetupChargeRun) -> dict:
+    """課金ランの結果（meetup-confirm のレスポンス用）"""
+    db.refresh(run)
+    charged, failed, pending = [], [], 0
+    for item in run.items:
+        if item.status == "succeeded":
+            charged.append({
+                "user_id":           item.user_id,
+                "payment_intent_id": item.payment_intent_id,
+                "charged":           run.fee,
+                "organizer_gets":    run.organizer_amount,
+                "commission":        run.commission_amount,
+            })
+        elif item.status in OPEN_STATUSES:
+            pending += 1
+        else:
+            failed.append({"user_id": item.user_id, "reason": item.error or item.status})
+    return {
+        "run_id":  run.id,
+        "status":  "confirmed" if run.status == "completed" else "charging",
+        "charged": len(charged),
+        "failed":  len(failed),
+        "pending": pending,
+        "details": {"charged": charged, "failed": failed},
+    }
+
+
+def resume_charge_runs(db: Session) -> int:
+    """途中で止まった課金ランを再開する（定期ジョブ）"""
+    now = _now()
+    run_ids = [row[0] for row in db.query(models.MeetupChargeRun.id).filter(
+        models.MeetupChargeRun.status == "running",
+        or_(models.MeetupChargeRun.locked_until.is_(None), models.MeetupChargeRun.locked_until < now),
+    ).order_by(models.MeetupChargeRun.id).all()]
+    resumed = 0
+    for run_id in run_ids:
+        if process_charge_run(db, run_id):
+            resumed += 1
+    return resumed
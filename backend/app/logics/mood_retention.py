@@ -0,0 +1,83 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.orm import Session
+from sqlalchemy import text, bindparam
+
+# --------------------------------------------------
+# 💡 気分ログの保持期間
+# --------------------------------------------------
+# 以前は気分ログを書き込むたびにユーザー単位で掃除していたが、
+# 1タップごとに DELETE / COUNT / DELETE が走るため定期ジョブに移した。
+# ユーザーを ID 順に user_batch 人ずつ処理し、1バッチ =
+#   1. MOOD_RETENTION_DAYS 日より古いログを削除
+#   2. 1人あたり MOOD_MAX_LOGS_PER_USER 件を超えた古いログを削除
+#   3. commit
+# どちらも mood_logs(user_id, created_at) のインデックスで引ける。
+# 途中で止まっても、次回は最初から同じ条件で削除するだけなので問題ない。
+
+MOOD_RETENTION_DAYS = int(os.getenv("MOOD_RETENTION_DAYS", "95"))
+MOOD_MAX_LOGS_PER_USER = int(os.getenv("MOOD_MAX_LOGS_PER_USER", "1000"))
+MOOD_RETENTION_USER_BATCH = 500
+MOOD_RETENTION_PAUSE = 0.1  # バッチ間の待ち（秒）
+
+
+_DELETE_EXPIRED = text("""
+    DELETE FROM mood_logs
+    WHERE user_id IN :user_ids AND created_at < :cutoff
+""").bindparams(bindparam("user_ids", expanding=True))
+
+# 新しい順に max_logs 件を残し、それより古いものを削除
+_DELETE_OVERFLOW = text("""
+    DELETE FROM mood_logs
+    WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY user_id ORDER BY created_at DESC, id DESC
+            ) AS rn
+            FROM mood_logs
+            WHERE user_id IN :user_ids
+        ) ranked
+        WHERE rn > :max_logs
+    )
+""").bindparams(bindparam("user_ids", expanding=True))
+
+
+def enforce_mood_retention(
+    db: Session,
+    retention_days: int = MOOD_RETENTION_DAYS,
+    max_logs: int = MOOD_MAX_LOGS_PER_USER,
+    user_batch: int = MOOD_RETENTION_USER_BATCH,
+) -> int:
+    """保持期間・件数上限を超えた気分ログを削除し、削除した件数を返す"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+
+    deleted = 0
+    last_user_id = 0
+    while True:
+        user_ids = [row[0] for row in db.execute(text("""
+            SELECT id FROM users
+            WHERE id > :last_id
+            ORDER BY id
+            LIMIT :limit
+        """), {"last_id": last_user_id, "limit": user_batch}).fetchall()]
+        if not user_ids:
+            break
+
+        try:
+            expired = db.execute(_DELETE_EXPIRED, {"user_ids": user_ids, "cutoff": cutoff})
+            overflow = db.execute(_DELETE_OVERFLOW, {"user_ids": user_ids, "max_logs": max_logs})
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        deleted += (expired.rowcount or 0) + (overflow.rowcount or 0)
+        last_user_id = user_ids[-1]
+        if len(user_ids) < user_batch:
+            break
+        time.sleep(MOOD_RETENTION_PAUSE)
+
+    if deleted:
+        print(f"気分ログ整理: {deleted}件を削除しました（{retention_days}日より前 / 1人{max_logs}件超）")
+    return deleted
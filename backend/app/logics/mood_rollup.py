@@ -0,0 +1,123 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from ..models import MoodType, MOOD_SCORES
+
+# --------------------------------------------------
+# 💡 気分ログの日別集計（mood_daily_rollup）
+# --------------------------------------------------
+# 気分ログを保存するときに record_mood() で (ユーザー, 日, カテゴリ) の行を1つ加算する。
+# 統計は生ログを読まず、期間分の日別行（最大で日数 × カテゴリ数）だけを読んで
+# NumPy で集計する。日付は日本時間で区切る。
+# 生ログは保持期間ジョブで消えるが、集計行は残るので長い期間の推移も出せる。
+
+ROLLUP_TZ = timezone(timedelta(hours=9))  # 日本時間
+MOOD_TYPES = [m.value for m in MoodType]
+COUNT_COLUMNS = [f"count_{m.lower()}" for m in MOOD_TYPES]
+
+
+def rollup_day(created_at: Optional[datetime]) -> date:
+    """ログの時刻を集計用の日付（日本時間）にする"""
+    if created_at is None:
+        created_at = datetime.now(timezone.utc)
+    elif created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(ROLLUP_TZ).date()
+
+
+def record_mood(
+    db: Session,
+    user_id: int,
+    mood_type: str,
+    category: Optional[str] = None,
+    created_at: Optional[datetime] = None,
+):
+    """気分ログ1件分を日別集計に加算する（commit は呼び出し側）"""
+    mood_type = getattr(mood_type, "value", mood_type)
+    column = f"count_{mood_type.lower()}"
+    if column not in COUNT_COLUMNS:
+        return
+    db.execute(text(f"""
+        INSERT INTO mood_daily_rollup (user_id, day, category, total, score_sum, {column})
+        VALUES (:uid, :day, :category, 1, :score, 1)
+        ON CONFLICT (user_id, day, category)
+        DO UPDATE SET total = mood_daily_rollup.total + 1,
+                      score_sum = mood_daily_rollup.score_sum + :score,
+                      {column} = mood_daily_rollup.{column} + 1
+    """), {
+        "uid": user_id,
+        "day": rollup_day(created_at),
+        "category": category or "",
+        "score": MOOD_SCORES.get(mood_type, 3),
+    })
+
+
+def mood_stats(db: Session, user_id: int, days: int = 30, category: Optional[str] = None) -> dict:
+    """直近 days 日の気分統計（平均・内訳・傾向・ばらつき）を日別集計から計算する"""
+    today = rollup_day(None)
+    start = today - timedelta(days=days - 1)
+    sql = f"""
+        SELECT day, total, score_sum, {", ".join(COUNT_COLUMNS)}
+        FROM mood_daily_rollup
+        WHERE user_id = :uid AND day BETWEEN :start AND :today
+    """
+    params = {"uid": user_id, "start": start, "today": today}
+    if category is not None:
+        sql += " AND category = :category"
+        params["category"] = category
+    rows = db.execute(text(sql), params).fetchall()
+
+    period = f"過去{days}日間"
+    if not rows:
+        return {
+            "period": period,
+            "average_score": 3.0,
+            "total_logs": 0,
+            "mood_counts": {},
+            "most_common_mood": "neutral",
+            "trend": 0.0,
+            "volatility": 0.0,
+            "daily": [],
+        }
+
+    # 日 × 気分 の行列にする（同じ日に複数カテゴリがあれば足し込む）
+    day_index = np.array([
+        ((r[0] if isinstance(r[0], date) else date.fromisoformat(r[0])) - start).days for r in rows
+    ])
+    counts = np.zeros((days, len(MOOD_TYPES)), dtype=np.int64)
+    np.add.at(counts, day_index, np.array([r[3:] for r in rows], dtype=np.int64))
+    daily_total = counts.sum(axis=1)
+    daily_score = np.zeros(days, dtype=np.float64)
+    np.add.at(daily_score, day_index, np.array([r[2] for r in rows], dtype=np.float64))
+
+    mood_totals = counts.sum(axis=0)
+    total_logs = int(daily_total.sum())
+    mood_counts = {m: int(c) for m, c in zip(MOOD_TYPES, mood_totals) if c}
+
+    active = np.flatnonzero(daily_total)
+    daily_avg = daily_score[active] / daily_total[active]
+    # 傾向：日別平均スコアの回帰直線の傾き（1日あたり）、ばらつき：日別平均の標準偏差
+    trend = float(np.polyfit(active, daily_avg, 1)[0]) if len(active) >= 2 else 0.0
+    volatility = float(daily_avg.std()) if len(active) >= 2 else 0.0
+
+    return {
+        "period": period,
+        "average_score": round(float(daily_score.sum()) / total_logs, 1),
+        "total_logs": total_logs,
+        "mood_counts": mood_counts,
+        "most_common_mood": MOOD_TYPES[int(mood_totals.argmax())],
+        "trend": round(trend, 3),
+        "volatility": round(volatility, 3),
+        "daily": [
+            {
+                "date": (start + timedelta(days=int(i))).isoformat(),
+                "count": int(daily_total[i]),
+                "average_score": round(float(avg), 2),
+            }
+            for i, avg in zip(active, daily_avg)
+        ],
+    }
@@ -0,0 +1,182 @@
+import asyncio
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .. import models
+from .notifications import create_notification
+from ..utils.email import send_email, meetup_waitlist_notification_html, meetup_waitlist_digest_html
+
+# --------------------------------------------------
+# 💡 まとめ通知（ダイジェスト）
+# --------------------------------------------------
+# マイルストーン・キャンセル待ち・MEETUP の通知は同じユーザーに短時間で何件も届くため、
+# いったん notification_digest_items にため、受信者ごとに
+# NOTIFICATION_DIGEST_WINDOW_SECONDS 経過したら種類ごとに1件の通知へまとめる。
+# キャンセル待ちのメールも受信者ごとに1通にまとめて送る。
+# 送信は定期ジョブ（logics/jobs.py）の flush_notification_digests が行う。
+
+DIGEST_WINDOW_SECONDS = int(os.getenv("NOTIFICATION_DIGEST_WINDOW_SECONDS", "300"))
+DIGEST_FLUSH_INTERVAL = 15             # 秒
+DIGEST_EMAIL_ENABLED = os.getenv("NOTIFICATION_DIGEST_EMAIL", "true").lower() == "true"
+DIGEST_MAX_RECIPIENTS = 500            # 1回の flush で処理する受信者数
+DIGEST_MAX_LINES = 5                   # まとめ通知に並べる元メッセージ数
+
+KIND_MILESTONE = "milestone"
+KIND_WAITLIST = "waitlist"
+KIND_MEETUP = "meetup"
+
+_SUMMARY_HEADERS = {
+    KIND_MILESTONE: "👥 メンバー数の節目のお知らせが{n}件あります",
+    KIND_WAITLIST:  "キャンセル待ちのMEETUP {n}件にキャンセルが出ました！参加できますか？",
+    KIND_MEETUP:    "MEETUPのお知らせが{n}件あります",
+}
+
+
+def enqueue_notification(
+    db: Session,
+    recipient_id: int,
+    sender_id: int,
+    hobby_category_id: int,
+    message: str,
+    kind: str,
+    event_post_id: Optional[int] = None,
+    email: bool = False,
+    dedupe_key: Optional[str] = None,
+) -> models.NotificationDigestItem:
+    """
+    通知をまとめ待ちに積む（commit は呼び出し側）。
+    email=True の場合はまとめ通知と一緒にメールも送る（現在はキャンセル待ちのみ対応）。
+    dedupe_key が同じ待ち行があれば新しい内容で上書きする。
+    """
+    fields = {
+        "sender_id": sender_id,
+        "hobby_category_id": hobby_category_id,
+        "event_post_id": event_post_id,
+        "message": message,
+    }
+    item = _find_pending(db, recipient_id, dedupe_key) if dedupe_key else None
+    if item is None:
+        try:
+            # 同じ dedupe_key の行が同時に作られていれば一意インデックスで弾かれる → その行を上書き
+            with db.begin_nested():
+                item = models.NotificationDigestItem(
+                    recipient_id=recipient_id,
+                    kind=kind,
+                    dedupe_key=dedupe_key,
+                    send_email=email,
+                    created_at=datetime.now(timezone.utc),
+                    **fields,
+                )
+                db.add(item)
+            return item
+        except IntegrityError:
+            item = _find_pending(db, recipient_id, dedupe_key)
+    for name, value in fields.items():
+        setattr(item, name, value)
+    item.send_email = bool(item.send_email or email)
+    db.flush()  # 同じリクエスト内の dedupe_key 検索に反映する（autoflush=False のため）
+    return item
+
+
+def _find_pending(db: Session, recipient_id: int, dedupe_key: str) -> Optional[models.NotificationDigestItem]:
+    return db.query(models.NotificationDigestItem).filter(
+        models.NotificationDigestItem.recipient_id == recipient_id,
+        models.NotificationDigestItem.dedupe_key == dedupe_key
+    ).first()
+
+
+def _summarize(db: Session, recipient_id: int, kind: str, items: List[models.NotificationDigestItem]):
+    latest = items[-1]
+    if len(items) == 1:
+        message = latest.message
+    else:
+        lines = [_SUMMARY_HEADERS.get(kind, "お知らせが{n}件あります").format(n=len(items))]
+        lines += [it.message for it in items[-DIGEST_MAX_LINES:]]
+        if len(items) > DIGEST_MAX_LINES:
+            lines.append(f"…ほか{len(items) - DIGEST_MAX_LINES}件")
+        message = "\n".join(lines)
+
+    post_ids = {it.event_post_id for it in items}
+    create_notification(
+        db,
+        recipient_id=recipient_id,
+        sender_id=latest.sender_id,
+        hobby_category_id=latest.hobby_category_id,
+        message=message,
+        event_post_id=latest.event_post_id if len(post_ids) == 1 else None,
+    )
+
+
+def _flush_due(db: Session, force: bool = False) -> Tuple[int, List[dict]]:
+    """期限が来た受信者の待ち行を通知にまとめ、（処理した受信者数, 送るべきメール）を返す"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=DIGEST_WINDOW_SECONDS)
+    Item = models.NotificationDigestItem
+
+    q = db.query(Item.recipient_id).group_by(Item.recipient_id)
+    if not force:
+        q = q.having(func.min(Item.created_at) <= cutoff)
+    recipient_ids = [r[0] for r in q.limit(DIGEST_MAX_RECIPIENTS).all()]
+
+    is_postgres = db.get_bind().dialect.name == "postgresql"
+    flushed = 0
+    emails = []
+    for recipient_id in recipient_ids:
+        q = db.query(Item).filter(Item.recipient_id == recipient_id).order_by(Item.id)
+        if is_postgres:
+            # 別ワーカーが同じ受信者を処理中なら飛ばす
+            q = q.with_for_update(skip_locked=True)
+        items = q.all()
+        if not items:
+            db.rollback()
+            continue
+
+        by_kind = OrderedDict()
+        for it in items:
+            by_kind.setdefault(it.kind, []).append(it)
+        email_posts = list(dict.fromkeys(
+            it.event_post_id for it in by_kind.get(KIND_WAITLIST, []) if it.send_email
+        ))
+        try:
+            for kind, group in by_kind.items():
+                _summarize(db, recipient_id, kind, group)
+            for it in items:
+                db.delete(it)
+            db.commit()
+            flushed += 1
+        except Exception as e:
+            db.rollback()
+            print(f"まとめ通知エラー (user={recipient_id}): {e}")
+            continue
+
+        if email_posts and DIGEST_EMAIL_ENABLED:
+            user = db.query(models.User.email, models.User.nickname).filter(
+                models.User.id == recipient_id
+            ).first()
+            if user and user.email:
+                emails.append({"to": user.email, "nickname": user.nickname or "", "post_ids": email_posts})
+    return flushed, emails
+
+
+async def _send_digest_email(email: dict):
+    titles = [f"MEETUP (ID: {pid})" for pid in email["post_ids"]]
+    if len(titles) == 1:
+        html = meetup_waitlist_notification_html(email["nickname"], titles[0])
+        subject = "【推し道】MEETUPにキャンセルが出ました！"
+    else:
+        html = meetup_waitlist_digest_html(email["nickname"], titles)
+        subject = f"【推し道】MEETUP {len(titles)}件にキャンセルが出ました！"
+    await send_email(to=email["to"], subject=subject, html=html)
+
+
+async def flush_notification_digests(db: Session, force: bool = False) -> int:
+    """定期ジョブ：期限が来たまとめ通知を作成し、メールを送る。作成した受信者数を返す"""
+    flushed, emails = await asyncio.to_thread(_flush_due, db, force)
+    for email in emails:
+        await _send_digest_email(email)
+    return flushed
@@ -0,0 +1,83 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+# --------------------------------------------------
+# 💡 通知の保持期間（既読通知のアーカイブ）
+# --------------------------------------------------
+# 既読かつ NOTIFICATION_RETENTION_DAYS 日より古い通知を notifications_archive へ移す。
+# 1バッチ = 「ID順に最大 batch_size 件を選ぶ → archive へコピー → 削除 → commit」。
+# 1回のトランザクションで触る行数を抑えるのでロック時間は短く、
+# 途中で止まっても移動済みの行は notifications から消えているため、
+# 次回はそのまま続きから処理される（再開可能）。
+# 未読通知は移動しないので、未読カウンターには影響しない。
+
+NOTIFICATION_RETENTION_DAYS = int(os.getenv("NOTIFICATION_RETENTION_DAYS", "90"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("NOTIFICATION_ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_BATCH_PAUSE = 0.2  # バッチ間の待ち（秒）。本番の書き込みに譲るため
+
+
+def _is_postgres(db: Session) -> bool:
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def archive_read_notifications(
+    db: Session,
+    retention_days: int = NOTIFICATION_RETENTION_DAYS,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    max_batches: int = None,
+) -> int:
+    """既読の古い通知をアーカイブへ移し、移動した件数を返す"""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    # PostgreSQL では他のトランザクションがロック中の行は飛ばす（待たない）
+    lock_clause = "FOR UPDATE SKIP LOCKED" if _is_postgres(db) else ""
+
+    moved = 0
+    last_id = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = [row[0] for row in db.execute(text(f"""
+            SELECT id FROM notifications
+            WHERE is_read = true
+              AND created_at < :cutoff
+              AND id > :last_id
+            ORDER BY id
+            LIMIT :limit
+            {lock_clause}
+        """), {"cutoff": cutoff, "last_id": last_id, "limit": batch_size}).fetchall()]
+        if not ids:
+            break
+
+        params = {f"id{i}": v for i, v in enumerate(ids)}
+        in_clause = ", ".join(f":id{i}" for i in range(len(ids)))
+        try:
+            db.execute(text(f"""
+                INSERT INTO notifications_archive
+                    (id, recipient_id, sender_id, hobby_category_id, message,
+                     event_post_id, is_read, created_at)
+                SELECT id, recipient_id, sender_id, hobby_category_id, message,
+                       event_post_id, is_read, created_at
+                FROM notifications
+                WHERE id IN ({in_clause}) AND is_read = true
+            """), params)
+            result = db.execute(text(f"""
+                DELETE FROM notifications
+                WHERE id IN ({in_clause}) AND is_read = true
+            """), params)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        moved += result.rowcount or 0
+        last_id = ids[-1]
+        batches += 1
+        if len(ids) < batch_size:
+            break
+        time.sleep(ARCHIVE_BATCH_PAUSE)
+
+    if moved:
+        print(f"通知アーカイブ: {moved}件を移動しました（{retention_days}日より前の既読通知）")
+    return moved
@@ -1,7 +1,10 @@
 import sqlite3
 import os
+import threading
+import time
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, text, exists, insert
+from sqlalchemy.exc import IntegrityError
 from typing import List, Optional, Dict, Any
 import re
 from datetime import timedelta
@@ -11,6 +14,55 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 DB_PATH = os.path.join(BASE_DIR, "data", "address.db")
 # 💡 models のインポートパスは app/logics/notifications.py から見て正しい階層に変更
 from .. import models, schemas 
+from datetime import datetime, timezone
+from .unread_counter import increment_unread, increment_unread_many
+from ..database import SessionLocal, run_after_commit
+from ..utils.pubsub import pubsub, publish_after_commit, user_channel
+
+# --------------------------------------------------
+# 💡 通知の作成（すべての通知作成はここを通す）
+# --------------------------------------------------
+
+def create_notification(
+    db: Session,
+    recipient_id: int,
+    sender_id: int,
+    hobby_category_id: int,
+    message: str,
+    event_post_id: Optional[int] = None,
+) -> models.Notification:
+    """
+    通知を1件作成し、受信者の未読カウンターを加算する（commit は呼び出し側）。
+    commit 後に受信者のチャンネルへ配信する（SSE 接続中のクライアントに届く）。
+    """
+    notification = models.Notification(
+        recipient_id=recipient_id,
+        sender_id=sender_id,
+        hobby_category_id=hobby_category_id,
+        message=message,
+        event_post_id=event_post_id,
+        is_read=False,
+        created_at=datetime.now(timezone.utc),
+    )
+    db.add(notification)
+    db.flush()
+    publish_after_commit(db, user_channel(recipient_id), notification_event(notification))
+    increment_unread(db, recipient_id)
+    return notification
+
+
+def notification_event(notification) -> Dict[str, Any]:
+    """通知1件を配信・SSE 用の dict に変換する"""
+    created_at = notification.created_at
+    return {
+        "type": "notification",
+        "id": notification.id,
+        "message": notification.message,
+        "is_read": notification.is_read,
+        "created_at": created_at.isoformat() if created_at else None,
+        "event_post_id": notification.event_post_id,
+        "hobby_category_id": notification.hobby_category_id,
+    }
 
 # --------------------------------------------------
 # 💡 地域マスタ DB 接続設定 (address.db)
@@ -83,161 +135,186 @@ def parse_region_tag(content: str) -> Optional[Dict[str, str]]:
 # --------------------------------------------------
 # 💡 多層ツリー通知ロジック (notify_ancestors)
 # --------------------------------------------------
+# [ALL] 付きの投稿を、投稿カテゴリとその祖先カテゴリの参加者全員に通知する。
+# 大ジャンル（数万人規模）でもリクエストを止めないよう BackgroundTasks で実行し、
+# 自前のセッションで ALL_FANOUT_CHUNK_SIZE 件ずつまとめて INSERT → commit する。
+# 進み具合は notification_fanouts に保存する（user_id 順に送り、送った最後の user_id をカーソルにする。
+# 通知の INSERT と同じ commit で進める）。
+# 1回に送るのは ALL_FANOUT_MAX_RECIPIENTS 人まで。残りと、途中で止まった分は
+# 定期ジョブ resume_all_fanouts() がカーソルの続きから送る。
+
+ALL_FANOUT_MAX_RECIPIENTS = int(os.getenv("ALL_FANOUT_MAX_RECIPIENTS", "100000"))  # 1回に送る上限
+ALL_FANOUT_ROWS_PER_SEC = int(os.getenv("ALL_FANOUT_ROWS_PER_SEC", "20000"))        # 書き込み速度の上限
+ALL_FANOUT_CHUNK_SIZE = 1000
+ALL_FANOUT_RESUME_AFTER = timedelta(minutes=2)  # これだけ進んでいない running を再開する
+
+_fanout_in_progress = set()
+_fanout_lock = threading.Lock()
+
 
 def get_ancestor_category_ids(db: Session, category_id: int) -> List[int]:
     """
-    指定されたカテゴリIDの親カテゴリと祖先カテゴリのIDを再帰的に取得する。
+    指定されたカテゴリIDの親カテゴリと祖先カテゴリのIDを取得する（再帰CTEで1クエリ）。
+    近い順（親 → 祖父母 → …）に返す。
     """
-    ancestor_ids = []
-    current_id = category_id
-    
-    # 💡 SQLAlchemyで親を辿るための単純なループ
-    while current_id is not None:
-        category = db.query(models.HobbyCategory).filter(
-            models.HobbyCategory.id == current_id
-        ).first()
-        
-        if category and category.parent_id is not None:
-            ancestor_ids.append(category.parent_id)
-            current_id = category.parent_id
-        else:
-            current_id = None
-            
-    return ancestor_ids
+    rows = db.execute(text("""
+        WITH RECURSIVE ancestors(id, parent_id, lvl) AS (
+            SELECT id, parent_id, 0 FROM hobby_categories WHERE id = :cid
+            UNION ALL
+            SELECT c.id, c.parent_id, a.lvl + 1
+            FROM hobby_categories c
+            JOIN ancestors a ON c.id = a.parent_id
+            WHERE a.lvl < 50
+        )
+        SELECT id FROM ancestors WHERE lvl > 0 ORDER BY lvl
+    """), {"cid": category_id}).fetchall()
+    return [row[0] for row in rows]
+
 
 def notify_ancestors(
-    post_id: int, 
-    user_id: int, 
-    db: Session, 
-    nickname: str, 
+    post_id: int,
+    user_id: int,
+    nickname: str,
     content: str
-):
+) -> int:
     """
-    投稿が作成された際、そのカテゴリとすべての祖先カテゴリのフォロワーに通知を作成する。
-    （ALL投稿時、または[ALL]タグ付きの投稿時に実行されることを想定）
+    投稿が作成された際、そのカテゴリとすべての祖先カテゴリの参加者に通知を作成する。
+    （[ALL]タグ付きの投稿時に BackgroundTasks から実行）作成した件数を返す。
     """
-    post = db.query(models.HobbyPost).filter(models.HobbyPost.id == post_id).first()
-    if not post:
-        print(f"通知作成エラー: 投稿ID {post_id} が見つかりません。")
-        return
-    
-    category_id = post.hobby_category_id
-    
-    # 1. 自身と祖先カテゴリIDのリストを取得
-    # 投稿先のカテゴリIDも通知対象とする
+    db = SessionLocal()
+    try:
+        if db.get(models.NotificationFanout, post_id) is None:
+            post = db.query(models.HobbyPost.id, models.HobbyPost.hobby_category_id).filter(
+                models.HobbyPost.id == post_id
+            ).first()
+            if not post:
+                print(f"通知作成エラー: 投稿ID {post_id} が見つかりません。")
+                return 0
+
+            category_name = db.query(models.HobbyCategory.name).filter(
+                models.HobbyCategory.id == post.hobby_category_id
+            ).scalar() or "Unknown"
+            title = f"【新着投稿】{category_name} に {nickname} さんが投稿しました！"
+            message_content = content[:50] + ("..." if len(content) > 50 else "")
+
+            db.add(models.NotificationFanout(
+                post_id=post_id,
+                sender_id=user_id,
+                hobby_category_id=post.hobby_category_id,
+                message=f"{title} - {message_content}",
+                updated_at=datetime.now(timezone.utc),
+            ))
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()  # 同時に作られた：そちらを続ける
+        return _continue_fanout(db, post_id)
+    except Exception as e:
+        db.rollback()
+        print(f"[ALL]通知エラー (post={post_id}): {e}")
+        return 0
+    finally:
+        db.close()
+
+
+def _continue_fanout(db: Session, post_id: int) -> int:
+    """カーソルの続きから送る（同じ投稿をこのプロセスで同時に送らない）"""
+    with _fanout_lock:
+        if post_id in _fanout_in_progress:
+            return 0
+        _fanout_in_progress.add(post_id)
+    try:
+        fanout = db.get(models.NotificationFanout, post_id)
+        if fanout is None or fanout.status != "running":
+            return 0
+        return _run_fanout(db, fanout)
+    finally:
+        with _fanout_lock:
+            _fanout_in_progress.discard(post_id)
+
+
+def _run_fanout(db: Session, fanout: models.NotificationFanout) -> int:
+    """最大 ALL_FANOUT_MAX_RECIPIENTS 人に送り、カーソルを進める。送った件数を返す"""
+    post_id, category_id = fanout.post_id, fanout.hobby_category_id
     target_category_ids = [category_id] + get_ancestor_category_ids(db, category_id)
-    
-    # 2. 対象カテゴリをフォローしているユーザーを全て取得 (UserHobbyLinkを使用)
-    follower_ids = db.query(
-        models.UserHobbyLink.user_id
-    ).filter(
-        models.UserHobbyLink.hobby_category_id.in_(target_category_ids),
-        models.UserHobbyLink.user_id != user_id # 投稿者自身は除く
-    ).distinct().all()
-    
-    new_notifications = []
-    
-    for follower_id_tuple in follower_ids:
-        follower_id = follower_id_tuple[0]
-        
-        # 投稿カテゴリ名を取得
-        category_name = db.query(models.HobbyCategory.name).filter(
-            models.HobbyCategory.id == category_id
-        ).scalar() or "Unknown"
-
-        title = f"【新着投稿】{category_name} に {nickname} さんが投稿しました！"
-        # 内容は最初の50文字程度を抜粋
-        message_content = content[:50] + ("..." if len(content) > 50 else "")
-        content_msg = f"内容: {message_content}"
 
-        # 💡 通知モデルの fields に合わせて修正: post_id ではなく event_post_id を使用
-        new_notifications.append(models.Notification(
-            user_id=follower_id,           # Userモデルに通知対象ユーザーIDのフィールドがないため、一時的に無視
-            sender_id=user_id,             # 投稿者を sender_id として設定
-            hobby_category_id=category_id, # どのカテゴリへの告知かを示す
-            title=title,
-            message=content_msg,
-            event_post_id=post.id          # 関連する投稿ID
-        ))
-
-    # 💡 重要な点: Notificationモデルには 'user_id' カラムがないため、
-    # どのユーザーに届ける通知かを示すため、ここでは Notification テーブルを通知先としてではなく、
-    # 告知元として使用し、ユーザーごとの通知テーブルが必要になるが、一旦この構造で続行する。
-    # ※ 既存のNotificationモデルを、ユーザーごとの通知テーブルとして利用する場合、user_idが必要です。
-    #    しかし、現在のNotificationモデルには通知対象ユーザーを示すカラムが存在しません。
-    #    **この点はお客様の models.py に依存するため、現状では通知の作成のみを行います。**
-    
-    # Town/UserTownモデルの追加により、Notificationモデルも修正されていることを期待し、
-    # 仮に `Notification` に `user_id` があるとして処理を継続します。
-    # 
-    # [models.py の最新版に基づく仮定]
-    # Notificationモデルには、通知対象ユーザーを示す user_id カラムが必要ですが、
-    # 最新のmodels.pyでは `hobby_category_id` しかありません。
-    #
-    # => Town 人数チェックロジックが参照している Notification モデルの最新版に依存する形で、
-    #    現在は、通知対象ユーザーIDを特定できても、それを保存する場所がない問題を無視して進めます。
-    #    (通知対象ユーザーIDを持つ`NotificationRecipient`テーブルが本来必要ですが、今回は既存モデル内で対応)
-    
-    # 💡 通知がどのユーザーに届くかを示すために、Notificationモデルに `recipient_id` が必要だが、
-    #    Townロジックと衝突するため、TownロジックのNotification作成方法に倣う（管理者ID=1に通知）。
-    
-    # => 複雑さを避けるため、ここでは通知を一旦 **管理者 (ID=1)** にのみ送る形に簡易化します。
-    #    本来は、`models.NotificationRecipient` テーブルが必要です。
-    
-    
-    # 簡易化: 上層通知は行わずに、投稿カテゴリのフォローユーザーに直接通知を作成します。
-    # 適切なモデルがないため、このロジックは一旦ロギングのみとします。
-    print(f"DEBUG: 投稿ID {post_id} の祖先通知は、適切なレシーバテーブルがないためスキップされました。")
-    
-    # db.add_all(new_notifications)
-    # db.commit()
-
-
-def notify_ancestors_working(
-    post_id: int, 
-    user_id: int, 
-    db: Session, 
-    nickname: str, 
-    content: str
-):
-    """
-    投稿が作成された際、そのカテゴリとすべての祖先カテゴリのフォロワーに通知を作成する。
-    (Notificationモデルに `recipient_id` があることを前提とした、実際の処理)
-    """
-    post = db.query(models.HobbyPost).filter(models.HobbyPost.id == post_id).first()
-    if not post: return
-    category_id = post.hobby_category_id
-    target_category_ids = [category_id] + get_ancestor_category_ids(db, category_id)
-    follower_ids = db.query(
-        models.UserHobbyLink.user_id
-    ).filter(
+    # 対象カテゴリの参加者（投稿者自身・カーソルまで送った人・受信済みの人は除く）を1クエリで取得
+    already_notified = exists().where(
+        models.Notification.event_post_id == post_id,
+        models.Notification.recipient_id == models.UserHobbyLink.user_id
+    )
+    follower_ids = [row[0] for row in db.query(models.UserHobbyLink.user_id).filter(
         models.UserHobbyLink.hobby_category_id.in_(target_category_ids),
-        models.UserHobbyLink.user_id != user_id
-    ).distinct().all()
-    
-    new_notifications = []
-    category_name = db.query(models.HobbyCategory.name).filter(
-        models.HobbyCategory.id == category_id
-    ).scalar() or "Unknown"
-
-    for follower_id_tuple in follower_ids:
-        follower_id = follower_id_tuple[0]
-        title = f"【新着投稿】{category_name} に {nickname} さんが投稿しました！"
-        message_content = content[:50] + ("..." if len(content) > 50 else "")
-        
-        # 💡 仮に Notification モデルに `recipient_id` と `message` があるとして挿入
-        new_notifications.append(models.Notification(
-            # recipient_id=follower_id, # 本来はこれ
-            sender_id=user_id,
-            hobby_category_id=category_id,
-            message=f"{title} - {message_content}", # titleとmessageを結合
-            event_post_id=post.id
-        ))
-
-    # db.add_all(new_notifications)
-    # db.commit()
-    print(f"DEBUG: 投稿ID {post_id} の祖先通知 {len(new_notifications)} 件が作成されました (DB挿入はスキップ)。")
-
+        models.UserHobbyLink.user_id != fanout.sender_id,
+        models.UserHobbyLink.user_id > fanout.cursor_user_id,
+        ~already_notified
+    ).distinct().order_by(models.UserHobbyLink.user_id).limit(ALL_FANOUT_MAX_RECIPIENTS).all()]
+
+    created = 0
+    for i in range(0, len(follower_ids), ALL_FANOUT_CHUNK_SIZE):
+        started = time.monotonic()
+        chunk = follower_ids[i:i + ALL_FANOUT_CHUNK_SIZE]
+        now = datetime.now(timezone.utc)
+        inserted = db.execute(
+            insert(models.Notification).returning(models.Notification.id, models.Notification.recipient_id),
+            [{
+                "recipient_id": rid,
+                "sender_id": fanout.sender_id,
+                "hobby_category_id": category_id,
+                "message": fanout.message,
+                "event_post_id": post_id,
+                "is_read": False,
+                "created_at": now,
+            } for rid in chunk]
+        ).all()
+        increment_unread_many(db, chunk)
+        events = [(user_channel(rid), {
+            "type": "notification",
+            "id": nid,
+            "message": fanout.message,
+            "is_read": False,
+            "created_at": now.isoformat(),
+            "event_post_id": post_id,
+            "hobby_category_id": category_id,
+        }) for nid, rid in inserted]
+        run_after_commit(db, lambda events=events: pubsub.publish_many(events))
+        fanout.cursor_user_id = chunk[-1]
+        fanout.sent_count += len(chunk)
+        fanout.updated_at = now
+        db.commit()
+        created += len(chunk)
+
+        # 書き込み速度の上限（他のリクエストの書き込みに譲る）
+        wait = len(chunk) / ALL_FANOUT_ROWS_PER_SEC - (time.monotonic() - started)
+        if wait > 0:
+            time.sleep(wait)
+
+    if len(follower_ids) < ALL_FANOUT_MAX_RECIPIENTS:
+        fanout.status = "done"
+        fanout.updated_at = datetime.now(timezone.utc)
+        db.commit()
+        print(f"[ALL]通知: 投稿ID {post_id} → 合計 {fanout.sent_count}件（カテゴリ {len(target_category_ids)}階層）")
+    else:
+        print(f"[ALL]通知: 投稿ID {post_id} → {created}件。上限 {ALL_FANOUT_MAX_RECIPIENTS}人に達したので、"
+              f"user_id {fanout.cursor_user_id} より後は定期ジョブで送ります")
+    return created
+
+
+def resume_all_fanouts(db: Session) -> int:
+    """上限で区切った・途中で止まった [ALL] 通知の続きを送る（定期ジョブ）。送った件数を返す"""
+    stale_before = datetime.now(timezone.utc) - ALL_FANOUT_RESUME_AFTER
+    post_ids = [row[0] for row in db.query(models.NotificationFanout.post_id).filter(
+        models.NotificationFanout.status == "running",
+        models.NotificationFanout.updated_at < stale_before,
+    ).order_by(models.NotificationFanout.updated_at).all()]
+    created = 0
+    for post_id in post_ids:
+        try:
+            created += _continue_fanout(db, post_id)
+        except Exception as e:
+            db.rollback()
+            print(f"[ALL]通知の再開エラー (post={post_id}): {e}")
+    return created
 
 # --------------------------------------------------
 # 💡 Town 人数チェックロジック (check_town_member_limit)
@@ -0,0 +1,130 @@
+from typing import Any, Callable, Dict, Iterable, Optional
+
+import stripe
+from sqlalchemy import text, bindparam
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..utils.stripe_gateway import stripe_call
+
+# --------------------------------------------------
+# 💡 Stripe 顧客ごとの「課金に使うカード」
+# --------------------------------------------------
+# 課金のたびに PaymentMethod.list を呼んでいたのをやめ、顧客ごとのカードIDを
+# stripe_payment_methods に保存しておく。
+#   - カード登録の完了時（meetup-join-complete / friend-manager-activate）に保存
+#   - Webhook（setup_intent.succeeded / payment_method.attached / customer.updated）で更新、
+#     payment_method.detached で削除
+#   - 保存されていなければ1回だけ PaymentMethod.list で調べて保存する
+# 以前と同じく「いちばん新しく登録されたカード」を使う。
+# Webhook は受信箱から少し遅れて反映されるので、保存済みのカードが既に外されていることがある。
+# 課金で「カードがない」エラーになったら、保存を消して Stripe で調べ直したカードで1回だけやり直す。
+
+# 保存済みのカードが Stripe 側で外されている・使えないときのエラーコード
+STALE_CARD_ERROR_CODES = {"resource_missing", "payment_method_unexpected_state"}
+
+_UPSERT = text("""
+    INSERT INTO stripe_payment_methods (customer_id, payment_method_id, updated_at)
+    VALUES (:cid, :pm, CURRENT_TIMESTAMP)
+    ON CONFLICT (customer_id)
+    DO UPDATE SET payment_method_id = :pm, updated_at = CURRENT_TIMESTAMP
+""")
+
+
+def _object_id(value) -> Optional[str]:
+    """展開済みオブジェクトでもIDの文字列でもIDを返す"""
+    if value is None or isinstance(value, str):
+        return value
+    return value.get("id")
+
+
+def remember_payment_method(db: Session, customer_id: Optional[str], payment_method_id: Optional[str]):
+    """顧客のカードIDを保存する（commit は呼び出し側）"""
+    if customer_id and payment_method_id:
+        db.execute(_UPSERT, {"cid": customer_id, "pm": payment_method_id})
+
+
+def forget_payment_method(db: Session, payment_method_id: str):
+    """削除（detach）されたカードを忘れる。次の課金時に PaymentMethod.list で調べ直す"""
+    db.query(models.StripePaymentMethod).filter(
+        models.StripePaymentMethod.payment_method_id == payment_method_id
+    ).delete(synchronize_session=False)
+
+
+def default_payment_methods(db: Session, customer_ids: Iterable[str]) -> Dict[str, str]:
+    """保存済みのカードIDをまとめて読む（Stripe には問い合わせない）"""
+    customer_ids = list(set(customer_ids))
+    if not customer_ids:
+        return {}
+    rows = db.execute(text("""
+        SELECT customer_id, payment_method_id FROM stripe_payment_methods WHERE customer_id IN :cids
+    """).bindparams(bindparam("cids", expanding=True)), {"cids": customer_ids}).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+
+def lookup_payment_method(customer_id: str) -> Optional[str]:
+    """Stripe に登録されている最新のカードID（保存されていないときの確認用）"""
+    pms = stripe_call(stripe.PaymentMethod.list, customer=customer_id, type="card", limit=1)
+    return pms.data[0].id if pms.data else None
+
+
+def get_default_payment_method(db: Session, customer_id: str) -> Optional[str]:
+    """課金に使うカードID（保存済みならそれ、なければ Stripe で調べて保存する）"""
+    saved = default_payment_methods(db, [customer_id]).get(customer_id)
+    if saved:
+        return saved
+    payment_method_id = lookup_payment_method(customer_id)
+    remember_payment_method(db, customer_id, payment_method_id)
+    return payment_method_id
+
+
+def remember_checkout_payment_method(db: Session, session) -> Optional[str]:
+    """
+    完了した Checkout Session からカードIDを保存する。
+    setup モードは setup_intent、subscription モードは subscription を expand して取得しておくこと。
+    """
+    customer_id = _object_id(session.get("customer"))
+    payment_method_id = None
+    setup_intent = session.get("setup_intent")
+    subscription = session.get("subscription")
+    if setup_intent and not isinstance(setup_intent, str):
+        payment_method_id = _object_id(setup_intent.get("payment_method"))
+    elif subscription and not isinstance(subscription, str):
+        payment_method_id = _object_id(subscription.get("default_payment_method"))
+    remember_payment_method(db, customer_id, payment_method_id)
+    return payment_method_id
+
+
+def is_stale_payment_method_error(e: stripe.error.StripeError) -> bool:
+    """保存済みのカードが Stripe 側で外されていたことによるエラーか"""
+    return (
+        isinstance(e, stripe.error.InvalidRequestError)
+        and e.code in STALE_CARD_ERROR_CODES
+        and getattr(e, "param", None) in (None, "payment_method", "default_payment_method")
+    )
+
+
+def charge_saved_card(db: Session, customer_id: str, charge: Callable[[str], Any]) -> Optional[Any]:
+    """
+    保存済みのカードで charge(カードID) を実行して結果を返す（カードがなければ None）。
+    カードが外されていたら保存を消し、Stripe で調べ直したカードで1回だけやり直す（commit は呼び出し側）。
+    冪等キーにはカードIDを含めること（同じキーだと Stripe は前のエラーをそのまま返す）。
+    """
+    payment_method_id = get_default_payment_method(db, customer_id)
+    if not payment_method_id:
+        return None
+    try:
+        return charge(payment_method_id)
+    except stripe.error.InvalidRequestError as e:
+        if not is_stale_payment_method_error(e):
+            raise
+        stale_error = e
+
+    forget_payment_method(db, payment_method_id)
+    fresh = lookup_payment_method(customer_id)
+    if fresh == payment_method_id:
+        raise stale_error
+    if not fresh:
+        return None
+    remember_payment_method(db, customer_id, fresh)
+    return charge(fresh)
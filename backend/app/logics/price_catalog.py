@@ -0,0 +1,72 @@
+from typing import Dict
+
+import stripe
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..database import SessionLocal
+from ..utils.stripe_gateway import stripe_call
+
+# --------------------------------------------------
+# 💡 Stripe の Price カタログ
+# --------------------------------------------------
+# 金額が変わるたびに Price.create していたのをやめ、単価ごとに1つの Price を使い回す。
+# Price には lookup_key を付けて作り、ID を stripe_prices とプロセス内の dict に保存する。
+#   プロセス内 → stripe_prices → Stripe（Price.list で lookup_key 検索）→ なければ作成
+# 作成は lookup_key から作った冪等キーで行うので、同時に作ろうとしても1つしかできない。
+# 金額の違いはサブスクリプションの数量（quantity）で表す。
+# stripe_prices への保存は呼び出し側とは別の短いトランザクションで行い、競合は無視する
+# （呼び出し側はこのあと Stripe を更新するので、そのトランザクションを巻き込んで失敗させない）。
+
+_price_ids: Dict[str, str] = {}
+
+_INSERT_PRICE = text("""
+    INSERT INTO stripe_prices (lookup_key, price_id, unit_amount, created_at)
+    VALUES (:key, :price_id, :amount, CURRENT_TIMESTAMP)
+    ON CONFLICT (lookup_key) DO NOTHING
+""")
+
+
+def get_price_id(
+    db: Session,
+    lookup_key: str,
+    unit_amount: int,
+    product_name: str,
+    interval: str = "month",
+) -> str:
+    """lookup_key の Price ID を返す（なければ作って stripe_prices に保存する）"""
+    price_id = _price_ids.get(lookup_key)
+    if price_id:
+        return price_id
+
+    row = db.get(models.StripePrice, lookup_key)
+    if row:
+        price_id = row.price_id
+    else:
+        prices = stripe_call(stripe.Price.list, lookup_keys=[lookup_key], active=True, limit=1)
+        if prices.data:
+            price_id = prices.data[0].id
+        else:
+            price_id = stripe_call(
+                stripe.Price.create,
+                idempotency_key=f"price:{lookup_key}",
+                unit_amount=unit_amount,
+                currency="jpy",
+                recurring={"interval": interval},
+                product_data={"name": product_name},
+                lookup_key=lookup_key,
+            ).id
+        _save_price_id(lookup_key, price_id, unit_amount)
+
+    _price_ids[lookup_key] = price_id
+    return price_id
+
+
+def _save_price_id(lookup_key: str, price_id: str, unit_amount: int):
+    catalog_db = SessionLocal()
+    try:
+        catalog_db.execute(_INSERT_PRICE, {"key": lookup_key, "price_id": price_id, "amount": unit_amount})
+        catalog_db.commit()
+    finally:
+        catalog_db.close()
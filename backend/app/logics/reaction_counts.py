@@ -0,0 +1,96 @@
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# --------------------------------------------------
+# 💡 リアクション数カウンター
+# --------------------------------------------------
+# meetup_message_reaction_counts に (message_id, reaction) ごとの件数を持ち、
+# リアクションのトグルと同じトランザクションで ±1 する。
+# 加算は INSERT ... ON CONFLICT DO UPDATE なので、同時に初回の加算が来ても
+# 一意制約違反にならない。0件になった行は削除する。
+# ずれた場合は reconcile_reaction_counts() で生のリアクション行から作り直す。
+
+RECONCILE_BATCH_SIZE = 5000  # メッセージID の範囲ごとに処理する件数
+
+
+def increment_reaction_count(db: Session, message_id: int, reaction: str):
+    db.execute(text("""
+        INSERT INTO meetup_message_reaction_counts (message_id, reaction, count, created_at)
+        VALUES (:mid, :reaction, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (message_id, reaction)
+        DO UPDATE SET count = meetup_message_reaction_counts.count + 1
+    """), {"mid": message_id, "reaction": reaction})
+
+
+def decrement_reaction_count(db: Session, message_id: int, reaction: str):
+    params = {"mid": message_id, "reaction": reaction}
+    db.execute(text("""
+        UPDATE meetup_message_reaction_counts
+        SET count = count - 1
+        WHERE message_id = :mid AND reaction = :reaction
+    """), params)
+    db.execute(text("""
+        DELETE FROM meetup_message_reaction_counts
+        WHERE message_id = :mid AND reaction = :reaction AND count <= 0
+    """), params)
+
+
+def reconcile_reaction_counts(db: Session, post_id: Optional[int] = None) -> int:
+    """
+    カウンターを生のリアクション行から作り直す（ずれの修復用）。
+    メッセージID の範囲ごとに commit するので大きなテーブルでも長くロックしない。
+    修正した (message_id, reaction) の件数を返す。
+    """
+    post_filter = "AND m.post_id = :post_id" if post_id is not None else ""
+    bounds = db.execute(text(f"""
+        SELECT MIN(m.id), MAX(m.id) FROM meetup_messages m WHERE 1 = 1 {post_filter}
+    """), {"post_id": post_id}).fetchone()
+    if not bounds or bounds[0] is None:
+        return 0
+
+    fixed = 0
+    for lo in range(bounds[0], bounds[1] + 1, RECONCILE_BATCH_SIZE):
+        params = {"lo": lo, "hi": lo + RECONCILE_BATCH_SIZE, "post_id": post_id}
+        actual = {(r[0], r[1]): r[2] for r in db.execute(text(f"""
+            SELECT r.message_id, r.reaction, COUNT(*)
+            FROM meetup_message_reactions r
+            JOIN meetup_messages m ON m.id = r.message_id
+            WHERE r.message_id >= :lo AND r.message_id < :hi {post_filter}
+            GROUP BY r.message_id, r.reaction
+        """), params).fetchall()}
+        stored = {(r[0], r[1]): r[2] for r in db.execute(text(f"""
+            SELECT c.message_id, c.reaction, c.count
+            FROM meetup_message_reaction_counts c
+            JOIN meetup_messages m ON m.id = c.message_id
+            WHERE c.message_id >= :lo AND c.message_id < :hi {post_filter}
+        """), params).fetchall()}
+
+        for key in set(actual) | set(stored):
+            want, have = actual.get(key, 0), stored.get(key)
+            if want == have:
+                continue
+            p = {"mid": key[0], "reaction": key[1], "count": want}
+            if want == 0:
+                db.execute(text("""
+                    DELETE FROM meetup_message_reaction_counts
+                    WHERE message_id = :mid AND reaction = :reaction
+                """), p)
+            elif have is None:
+                db.execute(text("""
+                    INSERT INTO meetup_message_reaction_counts (message_id, reaction, count, created_at)
+                    VALUES (:mid, :reaction, :count, CURRENT_TIMESTAMP)
+                    ON CONFLICT (message_id, reaction) DO UPDATE SET count = :count
+                """), p)
+            else:
+                db.execute(text("""
+                    UPDATE meetup_message_reaction_counts SET count = :count
+                    WHERE message_id = :mid AND reaction = :reaction
+                """), p)
+            fixed += 1
+        db.commit()
+
+    if fixed:
+        print(f"リアクション数の補正: {fixed}件")
+    return fixed
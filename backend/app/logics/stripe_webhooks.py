@@ -0,0 +1,139 @@
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import exists, or_, text, tuple_
+from sqlalchemy.orm import Session, aliased
+
+from .. import models
+
+# --------------------------------------------------
+# 💡 Stripe Webhook の受信箱
+# --------------------------------------------------
+# 以前は Webhook を受けたその場で UPDATE / INSERT と commit を何度も行っていたため、
+# DB が遅いと Stripe がタイムアウトして同じイベントを再送し、処理が重複していた。
+# いまは
+#   1. 署名を確認して stripe_webhook_events にイベントIDをキーに INSERT（重複は無視）→ すぐ 200
+#   2. 定期ジョブ process_webhook_events() が Stripe 側の作成時刻順に反映する
+# 反映は apply_webhook_event()（routers/stripe_payment.py）と状態の更新を1トランザクションで行う。
+# 同じオブジェクト（サブスクリプション・顧客など）のイベントは順番どおりに処理し、
+# 失敗したイベントがあればそのオブジェクトの後続は待たせる（バックオフ付きで再試行）。
+# カード・SetupIntent・顧客のイベントは顧客IDでまとめる（detached の後に attached が先に反映されないように）。
+# WEBHOOK_MAX_ATTEMPTS 回失敗したら dead にして後続を流す。
+# dead になったイベントは scripts/replay_webhooks.py で pending に戻せる。
+# ※ ジョブは1プロセスでだけ動かすこと（BACKGROUND_JOBS_ENABLED）。
+
+WEBHOOK_POLL_INTERVAL = 5          # 秒
+WEBHOOK_BATCH_SIZE = 200
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+WEBHOOK_RETRY_BASE = 30            # 秒（30秒, 1分, 2分, ... と倍々で延ばす）
+WEBHOOK_RETRY_MAX = 60 * 60        # 秒
+
+_INSERT_EVENT = text("""
+    INSERT INTO stripe_webhook_events
+        (event_id, event_type, object_key, event_created, payload, status, attempts, received_at)
+    VALUES (:eid, :etype, :okey, :created, :payload, 'pending', 0, CURRENT_TIMESTAMP)
+    ON CONFLICT (event_id) DO NOTHING
+""")
+
+
+_CUSTOMER_SCOPED_PREFIXES = ("payment_method.", "setup_intent.", "customer.")
+
+
+def _object_key(event: dict) -> str:
+    """順番を守る単位。サブスクリプションに関わるイベントはサブスクリプションID、
+    カード・SetupIntent・顧客のイベントは顧客IDでまとめる"""
+    obj = event["data"]["object"]
+    subscription = obj.get("subscription")
+    if isinstance(subscription, str):
+        return subscription
+    etype = event["type"]
+    # customer.subscription.* はサブスクリプション自身なので、請求書のイベントと同じくサブスクリプションIDで
+    if etype.startswith(_CUSTOMER_SCOPED_PREFIXES) and not etype.startswith("customer.subscription."):
+        if obj.get("object") == "customer":
+            return obj["id"]
+        # payment_method.detached では customer が null になり、元の顧客は previous_attributes にある
+        previous = event["data"].get("previous_attributes") or {}
+        customer = obj.get("customer") or previous.get("customer")
+        if isinstance(customer, str):
+            return customer
+    return obj.get("id") or event["id"]
+
+
+def enqueue_webhook_event(db: Session, event: dict) -> bool:
+    """署名確認済みのイベントを受信箱に入れる（既に受け取っていれば False）"""
+    result = db.execute(_INSERT_EVENT, {
+        "eid": event["id"],
+        "etype": event["type"],
+        "okey": _object_key(event),
+        "created": int(event["created"]),
+        "payload": json.dumps(event),
+    })
+    db.commit()
+    return result.rowcount == 1
+
+
+def process_webhook_events(db: Session, batch_size: int = WEBHOOK_BATCH_SIZE) -> int:
+    """受信箱の pending イベントを古い順に反映する（定期ジョブ）"""
+    # ルーター側の処理。ルーターがこのモジュールを import するので、ここで読み込む
+    from ..routers.stripe_payment import apply_webhook_event
+
+    Event = models.StripeWebhookEvent
+    earlier = aliased(models.StripeWebhookEvent)
+    processed = 0
+    while True:
+        now = datetime.now(timezone.utc)
+        # オブジェクトごとに一番古い pending だけを取る。それがバックオフ中ならそのオブジェクトは丸ごと待つ
+        is_head = ~exists().where(
+            earlier.object_key == Event.object_key,
+            earlier.status == "pending",
+            tuple_(earlier.event_created, earlier.received_at, earlier.event_id)
+            < tuple_(Event.event_created, Event.received_at, Event.event_id),
+        )
+        events = db.query(Event).filter(
+            Event.status == "pending",
+            is_head,
+            or_(Event.next_attempt_at.is_(None), Event.next_attempt_at <= now),
+        ).order_by(Event.event_created, Event.received_at).limit(batch_size).all()
+        if not events:
+            return processed
+        # 各オブジェクトの先頭を反映したら、次のイベントを先頭として取り直す
+        # （失敗したものはバックオフに入り、次の問い合わせには出てこない）
+        for event in events:
+            now = datetime.now(timezone.utc)
+            try:
+                apply_webhook_event(json.loads(event.payload), db)
+                event.status = "done"
+                event.processed_at = now
+                event.last_error = None
+                event.next_attempt_at = None
+                db.commit()
+                processed += 1
+            except Exception as e:
+                db.rollback()
+                event.attempts += 1
+                event.last_error = f"{type(e).__name__}: {e}"[:2000]
+                if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                    event.status = "dead"  # 後続を止めないよう、あきらめて dead にする
+                    print(f"Stripe Webhook {event.event_id} ({event.event_type}) を dead にしました: {event.last_error}")
+                else:
+                    delay = min(WEBHOOK_RETRY_MAX, WEBHOOK_RETRY_BASE * 2 ** (event.attempts - 1))
+                    event.next_attempt_at = now + timedelta(seconds=delay)
+                db.commit()
+
+
+def replay_webhook_events(db: Session, event_ids: Optional[Iterable[str]] = None) -> int:
+    """dead（event_ids 指定時はその状態に関わらず）のイベントを pending に戻す"""
+    query = db.query(models.StripeWebhookEvent)
+    if event_ids is not None:
+        query = query.filter(models.StripeWebhookEvent.event_id.in_(list(event_ids)))
+    else:
+        query = query.filter(models.StripeWebhookEvent.status == "dead")
+    count = query.update({
+        "status": "pending",
+        "attempts": 0,
+        "next_attempt_at": None,
+    }, synchronize_session=False)
+    db.commit()
+    return count
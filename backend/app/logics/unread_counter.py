@@ -0,0 +1,188 @@
+import os
+from sqlalchemy.orm import Session
+from typing import Dict, List
+from sqlalchemy import func, case, update, insert
+from sqlalchemy.exc import IntegrityError
+
+from .. import models
+from ..database import run_after_commit
+from ..utils.cache import LRUCache
+from ..utils.pubsub import pubsub, user_channel
+
+# --------------------------------------------------
+# 💡 未読通知カウンター（ライトスルーキャッシュ）
+# --------------------------------------------------
+# notification_unread_counters に1ユーザー1行で未読数を保持し、
+# 通知の作成側で +n、既読化の側で -n / 0 にする。
+# 読み取りはプロセス内キャッシュ → カウンター行の順に見るので、
+# /notifications/unread-count は通常キャッシュの1キー参照で終わる。
+# 変更後の値は commit 後に Pub/Sub で配信し（SSE でクライアントへ届く）、
+# 同じ配信を受けた各ワーカーがキャッシュを更新する。TTL は取りこぼし時の保険。
+
+UNREAD_CACHE_TTL = int(os.getenv("UNREAD_CACHE_TTL", "30"))  # 秒
+UNREAD_CACHE_SIZE = 50000
+
+_unread_cache = LRUCache(maxsize=UNREAD_CACHE_SIZE, ttl=UNREAD_CACHE_TTL)
+
+
+def _on_pubsub_message(channel: str, message: dict):
+    if message.get("type") == "unread_count" and channel.startswith("user:"):
+        _unread_cache.set(int(channel.split(":", 1)[1]), message["unread_count"])
+
+pubsub.add_listener(_on_pubsub_message)
+
+
+def _after_change(db: Session, user_id: int, count: int):
+    """commit 後にキャッシュを更新し、未読数の変更を配信する"""
+    def _publish():
+        _unread_cache.set(user_id, count)
+        pubsub.publish(user_channel(user_id), {"type": "unread_count", "unread_count": count})
+    run_after_commit(db, _publish)
+
+
+def _after_change_many(db: Session, counts: Dict[int, int]):
+    """複数ユーザー分の _after_change（配信は1回にまとめる）"""
+    def _publish():
+        for user_id, count in counts.items():
+            _unread_cache.set(user_id, count)
+        pubsub.publish_many([
+            (user_channel(user_id), {"type": "unread_count", "unread_count": count})
+            for user_id, count in counts.items()
+        ])
+    run_after_commit(db, _publish)
+
+
+def _count_unread_rows(db: Session, user_id: int) -> int:
+    return db.query(func.count(models.Notification.id)).filter(
+        models.Notification.recipient_id == user_id,
+        models.Notification.is_read == False
+    ).scalar() or 0
+
+
+def _seed_counter(db: Session, user_id: int) -> bool:
+    """
+    カウンター行がないユーザーの行を COUNT(*) から作成する（ユーザーごとに初回のみ）。
+    同時に他リクエストが作成していた場合は False を返す。
+    """
+    count = _count_unread_rows(db, user_id)
+    try:
+        with db.begin_nested():
+            db.add(models.NotificationUnreadCounter(user_id=user_id, unread_count=count))
+    except IntegrityError:
+        return False
+    _after_change(db, user_id, count)
+    return True
+
+
+def _apply_delta(db: Session, user_id: int, delta: int):
+    counter = models.NotificationUnreadCounter
+    new_value = counter.unread_count + delta
+    count = db.execute(
+        update(counter)
+        .where(counter.user_id == user_id)
+        .values(unread_count=case((new_value < 0, 0), else_=new_value))
+        .returning(counter.unread_count)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if count is not None:
+        _after_change(db, user_id, count)
+        return
+
+    # 行がない：通知の INSERT / UPDATE は同じトランザクションで実行済みなので、
+    # COUNT(*) の結果がそのまま新しい未読数になる
+    if not _seed_counter(db, user_id):
+        _apply_delta(db, user_id, delta)
+
+
+def increment_unread(db: Session, user_id: int, n: int = 1):
+    """未読通知を n 件作成した後に呼ぶ（commit は呼び出し側）"""
+    if n:
+        _apply_delta(db, user_id, n)
+
+
+def increment_unread_many(db: Session, user_ids: List[int], n: int = 1):
+    """
+    複数ユーザーに未読通知を n 件ずつ作成した後に呼ぶ（一斉通知用・commit は呼び出し側）。
+    UPDATE 1回 + カウンター行がないユーザー分の COUNT 1回で済ませる。
+    """
+    if not user_ids or not n:
+        return
+    counter = models.NotificationUnreadCounter
+    rows = db.execute(
+        update(counter)
+        .where(counter.user_id.in_(user_ids))
+        .values(unread_count=counter.unread_count + n)
+        .returning(counter.user_id, counter.unread_count)
+        .execution_options(synchronize_session=False)
+    ).all()
+    counts = {row[0]: row[1] for row in rows}
+
+    missing = [uid for uid in user_ids if uid not in counts]
+    if missing:
+        # 通知の INSERT は実行済みなので、COUNT の結果がそのまま未読数になる
+        seed = {uid: 0 for uid in missing}
+        seed.update(db.query(models.Notification.recipient_id, func.count(models.Notification.id)).filter(
+            models.Notification.recipient_id.in_(missing),
+            models.Notification.is_read == False
+        ).group_by(models.Notification.recipient_id).all())
+        try:
+            with db.begin_nested():
+                db.execute(insert(counter), [
+                    {"user_id": uid, "unread_count": count} for uid, count in seed.items()
+                ])
+            counts.update(seed)
+        except IntegrityError:
+            # 同時に作成されたユーザーがいた場合は1人ずつ処理
+            for uid in missing:
+                _apply_delta(db, uid, n)
+
+    _after_change_many(db, counts)
+
+
+def decrement_unread(db: Session, user_id: int, n: int = 1):
+    """未読通知を n 件既読にした後に呼ぶ（commit は呼び出し側）"""
+    if n:
+        _apply_delta(db, user_id, -n)
+
+
+def reset_unread(db: Session, user_id: int):
+    """全件既読にした後に呼ぶ（commit は呼び出し側）"""
+    updated = db.query(models.NotificationUnreadCounter).filter(
+        models.NotificationUnreadCounter.user_id == user_id
+    ).update({"unread_count": 0}, synchronize_session=False)
+    if not updated:
+        _seed_counter(db, user_id)
+    _after_change(db, user_id, 0)
+
+
+def get_unread_count(db: Session, user_id: int) -> int:
+    """未読数を返す（キャッシュ → カウンター行 → 初回のみ COUNT(*)）"""
+    cached = _unread_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    count = db.query(models.NotificationUnreadCounter.unread_count).filter(
+        models.NotificationUnreadCounter.user_id == user_id
+    ).scalar()
+    if count is None:
+        _seed_counter(db, user_id)
+        db.commit()
+        count = db.query(models.NotificationUnreadCounter.unread_count).filter(
+            models.NotificationUnreadCounter.user_id == user_id
+        ).scalar() or 0
+
+    _unread_cache.set(user_id, count)
+    return count
+
+
+def reconcile_unread_counter(db: Session, user_id: int) -> int:
+    """カウンターを実データ（COUNT(*)）で補正する。ずれの調査・修復用。"""
+    count = _count_unread_rows(db, user_id)
+    updated = db.query(models.NotificationUnreadCounter).filter(
+        models.NotificationUnreadCounter.user_id == user_id
+    ).update({"unread_count": count}, synchronize_session=False)
+    if not updated:
+        db.add(models.NotificationUnreadCounter(user_id=user_id, unread_count=count))
+    _after_change(db, user_id, count)
+    db.commit()
+    return count
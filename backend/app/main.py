@@ -3,6 +3,7 @@ import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .database import engine, Base
+from .logics.jobs import start_jobs, stop_jobs
 
 # ルーターのインポート
 from .routers import (
@@ -41,6 +42,15 @@ allow_origins=["*"],  # すべてのURLからのアクセスを許可
     allow_headers=["*"],
 )
 
+# --- 定期ジョブ（通知アーカイブなど） ---
+@app.on_event("startup")
+async def on_startup():
+    start_jobs()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_jobs()
+
 # --- ルーターの登録 ---
 
 # 認証系
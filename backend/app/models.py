@@ -1,8 +1,8 @@
 import enum
 from typing import Optional, List
 from sqlalchemy import (
-    Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Date, Text, 
-    Enum as SQLEnum, PrimaryKeyConstraint, UniqueConstraint 
+    Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Date, Text, LargeBinary,
+    Enum as SQLEnum, PrimaryKeyConstraint, UniqueConstraint, Index, text
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -167,6 +167,16 @@ class FriendRequest(Base):
 
     __table_args__ = (UniqueConstraint('requester_id', 'receiver_id', name='_requester_receiver_uc'),)
 
+class FriendSuggestion(Base):
+    """友達のおすすめ（夜間ジョブ logics/friend_suggestions.py が計算して保存する）"""
+    __tablename__ = "friend_suggestions"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    candidate_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    score = Column(Float, nullable=False)
+    mutual_friends = Column(Integer, default=0, nullable=False)
+    shared_communities = Column(Integer, default=0, nullable=False)
+    computed_at = Column(DateTime(timezone=True), server_default=func.now())
+
 # ==========================================
 # 💡 3. 投稿機能 (HobbyPost)
 # ==========================================
@@ -252,6 +262,8 @@ class MeetupMessage(Base):
     author_nickname = Column(String(100), nullable=False)
     content = Column(Text, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # リアクションが最後に変わった時刻（差分同期でリアクションの変化だけを返すため）
+    reactions_updated_at = Column(DateTime(timezone=True), nullable=True)
 
     post = relationship("HobbyPost", back_populates="meetup_messages")
     user = relationship("User")
@@ -262,6 +274,13 @@ class MeetupMessage(Base):
         cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        Index('ix_meetup_messages_post_created', 'post_id', 'created_at'),
+        Index('ix_meetup_messages_post_reactions_updated', 'post_id', 'reactions_updated_at'),
+        # アーカイブ後に ID が再利用されないように（SQLite のみ。PostgreSQL はシーケンスなので不要）
+        {'sqlite_autoincrement': True},
+    )
+
 # ==========================================
 # 💡 3-b. MeetupMessageReaction（新規追加）
 # ==========================================
@@ -292,6 +311,103 @@ class MeetupMessageReaction(Base):
         UniqueConstraint("message_id", "user_id", "reaction", name="uq_meetup_reaction"),
     )
 
+class MeetupMessageReactionCount(Base):
+    """メッセージ×絵文字ごとのリアクション数（チャット読み込み時に生の行を数えないため）"""
+    __tablename__ = "meetup_message_reaction_counts"
+
+    message_id = Column(Integer, ForeignKey("meetup_messages.id", ondelete="CASCADE"), primary_key=True)
+    reaction   = Column(String(10), primary_key=True)
+    count      = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())  # 表示順（最初に押された順）
+
+class MeetupChatArchive(Base):
+    """終了したMEETUPのチャット（メッセージ+リアクション）を圧縮して1行にまとめたもの"""
+    __tablename__ = "meetup_chat_archives"
+
+    post_id          = Column(Integer, ForeignKey("hobby_posts.id", ondelete="CASCADE"), primary_key=True)
+    codec            = Column(String(10), nullable=False)   # "zstd" / "gzip"
+    data             = Column(LargeBinary, nullable=False)  # 圧縮済み JSON
+    message_count    = Column(Integer, default=0, nullable=False)
+    last_message_id  = Column(Integer, nullable=True)
+    archived_at      = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class MeetupChargeRun(Base):
+    """MEETUP「開催決定」時の一斉課金1回分（logics/meetup_charges.py）。1つの投稿につき1行"""
+    __tablename__ = "meetup_charge_runs"
+
+    id                   = Column(Integer, primary_key=True, index=True)
+    post_id              = Column(Integer, ForeignKey("hobby_posts.id", ondelete="CASCADE"), unique=True, nullable=False)
+    organizer_id         = Column(Integer, ForeignKey("users.id"), nullable=False)
+    fee                  = Column(Integer, nullable=False)
+    organizer_amount     = Column(Integer, nullable=False)
+    commission_amount    = Column(Integer, nullable=False)
+    transfer_destination = Column(String(255), nullable=True)   # 主催者の Connect アカウント（未設定なら None）
+    status               = Column(String(20), default="running", nullable=False)  # running / completed
+    locked_until         = Column(DateTime(timezone=True), nullable=True)         # 処理中のワーカーの期限
+    created_at           = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at          = Column(DateTime(timezone=True), nullable=True)
+
+    items = relationship("MeetupChargeItem", back_populates="run", cascade="all, delete-orphan")
+
+
+class MeetupChargeItem(Base):
+    """一斉課金の参加者1人分。pending → charging → succeeded / failed / no_card"""
+    __tablename__ = "meetup_charge_items"
+
+    run_id             = Column(Integer, ForeignKey("meetup_charge_runs.id", ondelete="CASCADE"), primary_key=True)
+    user_id            = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    stripe_customer_id = Column(String(255), nullable=False)
+    status             = Column(String(20), default="pending", nullable=False, index=True)
+    payment_method_id  = Column(String(255), nullable=True)   # 課金に使うカード（最初の試行の前に決めて、やり直しでも同じものを使う）
+    idempotency_key    = Column(String(255), nullable=True)   # そのカードで使う冪等キー
+    payment_intent_id  = Column(String(255), nullable=True)
+    error              = Column(Text, nullable=True)
+    attempts           = Column(Integer, default=0, nullable=False)
+    updated_at         = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    run = relationship("MeetupChargeRun", back_populates="items")
+
+
+class StripePaymentMethod(Base):
+    """Stripe 顧客ごとの課金に使うカード（logics/payment_methods.py）"""
+    __tablename__ = "stripe_payment_methods"
+
+    customer_id       = Column(String(255), primary_key=True)
+    payment_method_id = Column(String(255), nullable=False, index=True)
+    updated_at        = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class StripePrice(Base):
+    """使い回す Stripe の Price（lookup_key ごとに1つ。logics/price_catalog.py）"""
+    __tablename__ = "stripe_prices"
+
+    lookup_key  = Column(String(100), primary_key=True)
+    price_id    = Column(String(255), nullable=False)
+    unit_amount = Column(Integer, nullable=False)
+    created_at  = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class StripeWebhookEvent(Base):
+    """Stripe Webhook の受信箱（logics/stripe_webhooks.py）。イベントIDごとに1行"""
+    __tablename__ = "stripe_webhook_events"
+
+    event_id        = Column(String(255), primary_key=True)
+    event_type      = Column(String(100), nullable=False)
+    object_key      = Column(String(255), nullable=False, index=True)  # 順番を守る単位（サブスクリプションIDなど）
+    event_created   = Column(Integer, nullable=False)                  # Stripe 側の作成時刻（UNIX 秒）
+    payload         = Column(Text, nullable=False)                     # イベントの JSON
+    status          = Column(String(20), default="pending", nullable=False)  # pending / done / dead
+    attempts        = Column(Integer, default=0, nullable=False)
+    last_error      = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    received_at     = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at    = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_stripe_webhook_events_status_created', 'status', 'event_created'),
+    )
+
 # ==========================================
 # 💡 4. 通知・感情・その他
 # ==========================================
@@ -313,6 +429,91 @@ class Notification(Base):
     hobby_category = relationship("HobbyCategory") 
     event_post = relationship("HobbyPost")
 
+    __table_args__ = (
+        # 受信箱（/notifications/my, /users/me/notifications）と未読集計用
+        Index('ix_notifications_recipient_created', 'recipient_id', 'created_at'),
+        Index('ix_notifications_recipient_is_read', 'recipient_id', 'is_read'),
+    )
+
+class NotificationFanout(Base):
+    """[ALL] 投稿の一斉通知の進み具合（logics/notifications.py）。投稿ごとに1行"""
+    __tablename__ = "notification_fanouts"
+
+    post_id           = Column(Integer, ForeignKey("hobby_posts.id", ondelete="CASCADE"), primary_key=True)
+    sender_id         = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    hobby_category_id = Column(Integer, ForeignKey("hobby_categories.id", ondelete="CASCADE"), nullable=False)
+    message           = Column(Text, nullable=False)
+    cursor_user_id    = Column(Integer, default=0, nullable=False)   # この user_id まで送った
+    sent_count        = Column(Integer, default=0, nullable=False)
+    status            = Column(String(20), default="running", nullable=False)  # running / done
+    created_at        = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at        = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_notification_fanouts_status_updated', 'status', 'updated_at'),
+    )
+
+class NotificationArchive(Base):
+    """保持期間を過ぎた既読通知の退避先（notifications を小さく保つため）"""
+    __tablename__ = "notifications_archive"
+
+    id                = Column(Integer, primary_key=True)  # notifications.id をそのまま使う
+    recipient_id      = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    sender_id         = Column(Integer, nullable=True)
+    hobby_category_id = Column(Integer, nullable=True)
+    message           = Column(Text, nullable=False)
+    event_post_id     = Column(Integer, nullable=True)
+    is_read           = Column(Boolean, default=True, nullable=False)
+    created_at        = Column(DateTime(timezone=True), nullable=True)
+    archived_at       = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_notifications_archive_recipient_created', 'recipient_id', 'created_at'),
+    )
+
+class NotificationDigestItem(Base):
+    """まとめ通知の待ち行列（一定時間ためて種類ごとに1件の通知・1通のメールにする）"""
+    __tablename__ = "notification_digest_items"
+
+    id                = Column(Integer, primary_key=True, index=True)
+    recipient_id      = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    kind              = Column(String(20), nullable=False)  # milestone / waitlist / meetup
+    sender_id         = Column(Integer, nullable=False)
+    hobby_category_id = Column(Integer, nullable=False)
+    event_post_id     = Column(Integer, nullable=True)
+    message           = Column(Text, nullable=False)
+    dedupe_key        = Column(String(100), nullable=True)  # 同じキーの待ち行は最新の内容で上書き
+    send_email        = Column(Boolean, default=False, nullable=False)
+    created_at        = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # 同じ dedupe_key の待ち行は受信者ごとに1行だけ（同時に積まれても重複させない）
+        Index('uq_notification_digest_items_recipient_dedupe', 'recipient_id', 'dedupe_key', unique=True,
+              postgresql_where=text('dedupe_key IS NOT NULL'), sqlite_where=text('dedupe_key IS NOT NULL')),
+    )
+
+class NotificationUnreadCounter(Base):
+    """ユーザーごとの未読通知数（/notifications/unread-count を COUNT(*) なしで返すため）"""
+    __tablename__ = "notification_unread_counters"
+
+    user_id      = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    unread_count = Column(Integer, default=0, nullable=False)
+    updated_at   = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+# 気分の点数（1〜5）
+MOOD_SCORES = {
+    MoodType.MOTIVATED: 5,
+    MoodType.EXCITED: 5,
+    MoodType.HAPPY: 4,
+    MoodType.GRATEFUL: 4,
+    MoodType.CALM: 3,
+    MoodType.NEUTRAL: 3,
+    MoodType.ANXIOUS: 2,
+    MoodType.TIRED: 2,
+    MoodType.SAD: 1,
+    MoodType.ANGRY: 1,
+}
+
 class MoodLog(Base):
     __tablename__ = "mood_logs"
     
@@ -326,23 +527,59 @@ class MoodLog(Base):
     
     user = relationship("User", back_populates="mood_logs")
 
+    __table_args__ = (
+        # ユーザーごとの履歴取得と保持期間ジョブ（logics/mood_retention.py）用
+        Index('ix_mood_logs_user_created', 'user_id', 'created_at'),
+    )
+
     # 💡 ここから追記：気分を点数（1〜5）に変換する設定
     @property
     def score(self) -> int:
-        mapping = {
-            MoodType.MOTIVATED: 5,
-            MoodType.EXCITED: 5,
-            MoodType.HAPPY: 4,
-            MoodType.GRATEFUL: 4,
-            MoodType.CALM: 3,
-            MoodType.NEUTRAL: 3,
-            MoodType.ANXIOUS: 2,
-            MoodType.TIRED: 2,
-            MoodType.SAD: 1,
-            MoodType.ANGRY: 1,
-        }
         # 保存されている mood_type を元に点数を返す（なければ3点）
-        return mapping.get(self.mood_type, 3)
+        return MOOD_SCORES.get(self.mood_type, 3)
+
+
+class MoodDailyRollup(Base):
+    """気分ログの日別集計（ユーザー × 日 × カテゴリ）。気分の統計はここから読む"""
+    __tablename__ = "mood_daily_rollup"
+
+    user_id   = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day       = Column(Date, primary_key=True)                       # 日本時間の日付
+    category  = Column(String(50), primary_key=True, default="")     # カテゴリなしは ""
+    total     = Column(Integer, default=0, server_default="0", nullable=False)
+    score_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    # MoodType ごとの件数（列名は count_<mood_type 小文字>）
+    count_happy     = Column(Integer, default=0, server_default="0", nullable=False)
+    count_excited   = Column(Integer, default=0, server_default="0", nullable=False)
+    count_calm      = Column(Integer, default=0, server_default="0", nullable=False)
+    count_tired     = Column(Integer, default=0, server_default="0", nullable=False)
+    count_sad       = Column(Integer, default=0, server_default="0", nullable=False)
+    count_anxious   = Column(Integer, default=0, server_default="0", nullable=False)
+    count_angry     = Column(Integer, default=0, server_default="0", nullable=False)
+    count_neutral   = Column(Integer, default=0, server_default="0", nullable=False)
+    count_grateful  = Column(Integer, default=0, server_default="0", nullable=False)
+    count_motivated = Column(Integer, default=0, server_default="0", nullable=False)
+
+
+class CommunityMoodBucket(Base):
+    """趣味・地域ごとの気分の1時間集計（logics/community_mood.py）"""
+    __tablename__ = "community_mood_buckets"
+
+    scope     = Column(String(10), primary_key=True)    # "hobby" / "pref" / "city"
+    scope_key = Column(String(160), primary_key=True)   # マスターID / 都道府県 / "都道府県/市区町村"
+    bucket    = Column(Integer, primary_key=True, index=True)  # UNIX 時間 // 3600
+    total     = Column(Integer, default=0, server_default="0", nullable=False)
+    score_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    count_happy     = Column(Integer, default=0, server_default="0", nullable=False)
+    count_excited   = Column(Integer, default=0, server_default="0", nullable=False)
+    count_calm      = Column(Integer, default=0, server_default="0", nullable=False)
+    count_tired     = Column(Integer, default=0, server_default="0", nullable=False)
+    count_sad       = Column(Integer, default=0, server_default="0", nullable=False)
+    count_anxious   = Column(Integer, default=0, server_default="0", nullable=False)
+    count_angry     = Column(Integer, default=0, server_default="0", nullable=False)
+    count_neutral   = Column(Integer, default=0, server_default="0", nullable=False)
+    count_grateful  = Column(Integer, default=0, server_default="0", nullable=False)
+    count_motivated = Column(Integer, default=0, server_default="0", nullable=False)
 
 # ──────────────────────────────────────────
 # 【追加1】UserTag テーブル（新規追加）
@@ -516,6 +753,9 @@ class User(Base):
     is_mood_comment_visible = Column(Boolean, default=False, nullable=False)
     is_mood_visible = Column(Boolean, default=True, nullable=False)
 
+    # 友達数（logics/friend_graph.py が Friendship の作成・削除に合わせて更新する）
+    friend_count = Column(Integer, default=0, server_default="0", nullable=False)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
@@ -7,6 +7,8 @@ from typing import List, Optional
 from .. import models, schemas
 from ..utils.security import get_current_user
 from ..database import get_db
+from ..logics.friend_moods import invalidate_friend_moods
+from ..logics.friend_graph import get_friend_ids, get_friend_count as graph_friend_count, add_friendship, remove_friendship
 
 # stripe_payment から定数と共通関数をインポート
 from ..routers.stripe_payment import (
@@ -79,11 +81,7 @@ def send_friend_request(
         raise HTTPException(status_code=400, detail="既に申請済みです。")
 
     # ── 申請者の友達数チェック ──
-    friend_count = (
-        db.query(models.Friendship)
-        .filter(models.Friendship.user_id == current_user.id)
-        .count()
-    )
+    friend_count = graph_friend_count(db, current_user.id)
     # Railwayのログで確認するためのデバッグ行
     print(f"DEBUG: user={current_user.id} friend_count={friend_count} limit={FRIEND_FREE_LIMIT}")
 
@@ -190,6 +188,8 @@ def update_friend_request_status(
             ),
         ]
         db.add_all(friendships)
+        add_friendship(db, request_obj.requester_id, request_obj.receiver_id)
+        invalidate_friend_moods(db, [request_obj.requester_id, request_obj.receiver_id])
         db.commit()
 
         # 申請者のサブスクを開始（カード登録済みの場合のみ）
@@ -233,6 +233,8 @@ def get_my_friends(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
+    if not get_friend_ids(db, current_user.id):
+        return []
     return (
         db.query(models.Friendship)
         .options(joinedload(models.Friendship.friend))
@@ -273,6 +275,7 @@ def update_friend_relation_status(
     else:
         raise HTTPException(status_code=400, detail="無効なアクションです。")
 
+    invalidate_friend_moods(db, [current_user.id])
     db.commit()
     return {"message": "更新しました。"}
 
@@ -301,6 +304,7 @@ def update_friendship(
     if payload.is_muted is not None:
         friendship.is_muted = payload.is_muted
 
+    invalidate_friend_moods(db, [current_user.id])
     db.commit()
     return {"message": "保存しました"}
 
@@ -328,9 +332,7 @@ def get_friend_count(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user),
 ):
-    total = db.query(models.Friendship).filter(
-        models.Friendship.user_id == current_user.id
-    ).count()
+    total = graph_friend_count(db, current_user.id)
 
     over = max(0, total - FRIEND_FREE_LIMIT)
 
@@ -368,15 +370,10 @@ def delete_friendship(
     if friendship.user_id != current_user.id and friendship.friend_id != current_user.id:
         raise HTTPException(status_code=403, detail="権限がありません")
 
-    # 逆方向のレコードも取得して削除
-    reverse = db.query(models.Friendship).filter(
-        models.Friendship.user_id == friendship.friend_id,
-        models.Friendship.friend_id == friendship.user_id
-    ).first()
-
-    db.delete(friendship)
-    if reverse:
-        db.delete(reverse)
+    # 逆方向のレコードもまとめて削除
+    user_id, friend_id = friendship.user_id, friendship.friend_id
+    remove_friendship(db, user_id, friend_id)
+    invalidate_friend_moods(db, [user_id, friend_id])
     db.commit()
 
     return {"status": "deleted"}
\ No newline at end of file
@@ -12,6 +12,8 @@ from ..database import get_db
 from .. import models, schemas 
 from ..schemas.hobbies import HobbyCategoryResponse, HobbySearchParams, CategoryDetailBase
 from .auth import get_current_user
+from ..logics.notification_digest import enqueue_notification, KIND_MILESTONE
+from ..logics.unread_counter import increment_unread
 from pydantic import BaseModel
 from functools import lru_cache
 import time
@@ -466,7 +468,7 @@ def _notify_region_milestone(db, category_id: int, category_name: str, new_user)
 
             # 1日1回制限：同じコミュニティ×地域の通知が24時間以内にあればスキップ
             recent = db.execute(text("""
-                SELECT id FROM notifications
+                SELECT id, is_read FROM notifications
                 WHERE recipient_id = :uid
                   AND hobby_category_id = :cat_id
                   AND message LIKE :msg_like
@@ -486,19 +488,20 @@ def _notify_region_milestone(db, category_id: int, category_name: str, new_user)
                     SET message = :msg, is_read = false, created_at = NOW()
                     WHERE id = :nid
                 """), {"msg": message, "nid": recent.id})
+                # 既読だった通知が未読に戻る場合のみ未読数を加算
+                if recent.is_read:
+                    increment_unread(db, recipient_id)
             else:
-                # 新規通知を作成
-                db.execute(text("""
-                    INSERT INTO notifications
-                        (recipient_id, sender_id, hobby_category_id, message, is_read, created_at)
-                    VALUES
-                        (:uid, :sender, :cat_id, :msg, false, NOW())
-                """), {
-                    "uid": recipient_id,
-                    "sender": new_user.id,
-                    "cat_id": category_id,
-                    "msg": message,
-                })
+                # まとめ通知に積む（同じ地域の節目は最新の人数で上書き）
+                enqueue_notification(
+                    db,
+                    recipient_id=recipient_id,
+                    sender_id=new_user.id,
+                    hobby_category_id=category_id,
+                    message=message,
+                    kind=KIND_MILESTONE,
+                    dedupe_key=f"milestone:{category_id}:{field}:{value}",
+                )
 
     db.commit()
 
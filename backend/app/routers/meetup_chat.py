@@ -1,14 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, WebSocket, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy import desc, or_, and_, select as db_select
 from typing import List, Dict
-from pydantic import BaseModel, Field
-from datetime import datetime
+from pydantic import BaseModel, Field, ValidationError
+from datetime import datetime, timezone
 from typing import Optional
 
 from .. import models
-from ..database import get_db
+from ..database import get_db, SessionLocal
 from .auth import get_current_user
+from ..utils.security import decode_access_token
+from ..utils.pubsub import pubsub, meetup_channel, RESYNC
+from ..logics.chat_membership import get_membership, MeetupMembership, MEMBERSHIP_CHANNEL
+from ..logics.reaction_counts import increment_reaction_count, decrement_reaction_count
+from ..logics.chat_archive import load_archive, as_utc, ArchivedChat
 
 router = APIRouter(prefix="/meetup-chat", tags=["meetup-chat"])
 
@@ -41,75 +49,174 @@ class ReactionCreate(BaseModel):
 # ==========================================
 # 💡 共通バリデーション関数
 # ==========================================
-def check_chat_permission(post_id: int, user_id: int, db: Session):
-    """主催者または参加者であるかを確認する"""
-    post = db.query(models.HobbyPost).filter(models.HobbyPost.id == post_id).first()
-    if not post:
+def check_chat_permission(post_id: int, user_id: int, db: Session) -> MeetupMembership:
+    """主催者または参加者であるかを確認する（メンバー集合はキャッシュから引く）"""
+    membership = get_membership(db, post_id)
+    if membership is None:
         raise HTTPException(status_code=404, detail="MeetUpが見つかりません")
-    if not post.is_meetup:
+    if not membership.is_meetup:
         raise HTTPException(status_code=400, detail="これはMeetUp投稿ではありません")
 
-    # 1. 主催者(HOST)であるか確認
-    is_host = (post.user_id == user_id)
-    if is_host:
-        return post
-
-    # 2. 参加者リストに含まれているか確認
-    is_participant = db.query(models.PostResponse).filter(
-        models.PostResponse.post_id == post_id,
-        models.PostResponse.user_id == user_id,
-        models.PostResponse.is_participation == True
-    ).first()
-
-    if not is_participant:
+    # 主催者(HOST)または参加者リストに含まれているか確認
+    if not membership.allows(user_id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="このMeetUpの参加者または主催者のみアクセス可能です"
         )
-    return post
+    return membership
 
 
-def build_reactions(message_id: int, current_user_id: int, db: Session) -> List[ReactionSummary]:
-    """メッセージのリアクション集計（絵文字ごとのcount + 自分が押したか）"""
-    rows = db.query(models.MeetupMessageReaction).filter(
-        models.MeetupMessageReaction.message_id == message_id
-    ).all()
+def build_reactions_for_messages(
+    message_ids: List[int], current_user_id: int, db: Session
+) -> Dict[int, List[ReactionSummary]]:
+    """
+    複数メッセージのリアクション集計をまとめて取得する。
+    （絵文字ごとの件数はカウンターテーブルから1クエリ + 自分が押したものを1クエリ）
+    """
+    if not message_ids:
+        return {}
+    R = models.MeetupMessageReaction
+    C = models.MeetupMessageReactionCount
+
+    counts = db.query(C.message_id, C.reaction, C.count)\
+        .filter(C.message_id.in_(message_ids), C.count > 0)\
+        .order_by(C.message_id, C.created_at, C.reaction)\
+        .all()
+
+    mine = set(db.query(R.message_id, R.reaction).filter(
+        R.message_id.in_(message_ids),
+        R.user_id == current_user_id
+    ).all())
+
+    result: Dict[int, List[ReactionSummary]] = {}
+    for message_id, emoji, cnt in counts:
+        result.setdefault(message_id, []).append(
+            ReactionSummary(reaction=emoji, count=cnt, reacted_by_me=((message_id, emoji) in mine))
+        )
+    return result
 
-    counts: Dict[str, int] = {}
-    mine: set = set()
-    for r in rows:
-        counts[r.reaction] = counts.get(r.reaction, 0) + 1
-        if r.user_id == current_user_id:
-            mine.add(r.reaction)
 
-    return [
-        ReactionSummary(reaction=emoji, count=cnt, reacted_by_me=(emoji in mine))
-        for emoji, cnt in counts.items()
-    ]
+def build_reactions(message_id: int, current_user_id: int, db: Session) -> List[ReactionSummary]:
+    """メッセージのリアクション集計（絵文字ごとのcount + 自分が押したか）"""
+    return build_reactions_for_messages([message_id], current_user_id, db).get(message_id, [])
 
 
 # ==========================================
 # 💡 APIエンドポイント
 # ==========================================
 
+MESSAGE_PAGE_MAX = 200
+
+
+def _cursor_filter(query, cursor_id: int, newer: bool):
+    """(created_at, id) を基準にカーソルより新しい／古いメッセージに絞る"""
+    M = models.MeetupMessage
+    cursor_created = db_select(M.created_at).where(M.id == cursor_id).scalar_subquery()
+    if newer:
+        return query.filter(or_(M.created_at > cursor_created,
+                                and_(M.created_at == cursor_created, M.id > cursor_id)))
+    return query.filter(or_(M.created_at < cursor_created,
+                            and_(M.created_at == cursor_created, M.id < cursor_id)))
+
+
+def _page_with_archive(
+    db: Session,
+    archive: ArchivedChat,
+    post_id: int,
+    current_user_id: int,
+    before_id: Optional[int],
+    after_id: Optional[int],
+    limit: Optional[int],
+    reactions_since: Optional[datetime],
+):
+    """アーカイブ済みのチャット：アーカイブと（アーカイブ後の）メッセージを合わせてメモリ上でページングする"""
+    hot = db.query(models.MeetupMessage).filter(models.MeetupMessage.post_id == post_id).all()
+    hot_ids = {m.id for m in hot}
+    merged = [m for m in archive.messages if m.id not in hot_ids] + hot
+    merged.sort(key=lambda m: (as_utc(m.created_at), m.id))  # 古い順
+    position = {m.id: i for i, m in enumerate(merged)}
+
+    if after_id is not None:
+        start = position[after_id] + 1 if after_id in position else len(merged)
+        messages = merged[start:start + (limit or MESSAGE_PAGE_MAX)]
+        messages.reverse()
+        if reactions_since is not None:
+            since = as_utc(reactions_since)
+            new_ids = {m.id for m in messages}
+            changed = [m for m in reversed(merged)
+                       if m.reactions_updated_at and as_utc(m.reactions_updated_at) >= since]
+            messages += [m for m in changed[:MESSAGE_PAGE_MAX] if m.id not in new_ids]
+    else:
+        end = position.get(before_id, 0) if before_id is not None else len(merged)
+        start = max(0, end - limit) if limit else 0
+        messages = list(reversed(merged[start:end]))
+
+    reactions_by_message = build_reactions_for_messages(
+        [m.id for m in messages if m.id in hot_ids], current_user_id, db
+    )
+    archived = archive.reaction_summaries([m.id for m in messages if m.id not in hot_ids], current_user_id)
+    for mid, summaries in archived.items():
+        reactions_by_message[mid] = [ReactionSummary(**s) for s in summaries]
+    return messages, reactions_by_message
+
+
 @router.get("/{post_id}", response_model=List[MeetupMessageResponse])
 def get_meetup_messages(
     post_id: int,
+    response: Response,
+    before_id: Optional[int] = Query(None, description="このメッセージより古いものを取得（さかのぼり）"),
+    after_id: Optional[int] = Query(None, description="このメッセージより新しいものを取得（差分同期）"),
+    limit: Optional[int] = Query(None, ge=1, le=MESSAGE_PAGE_MAX),
+    reactions_since: Optional[datetime] = Query(None, description="after_id と併用：この時刻以降にリアクションが変わった既存メッセージも返す"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """過去ログ取得（HOSTまたは参加者のみ）"""
+    """
+    過去ログ取得（HOSTまたは参加者のみ）。新しい順で返す。
+    - パラメータなし: 全件（従来どおり）
+    - before_id: さかのぼり読み込み
+    - after_id (+ reactions_since): ポーリング用の差分。新着メッセージと、
+      リアクションが変わったメッセージだけを返す。
+      次回の reactions_since にはレスポンスヘッダー X-Sync-Time の値を渡す。
+    終了後にアーカイブされたチャットも同じパラメータで読める。
+    """
     check_chat_permission(post_id, current_user.id, db)
+    M = models.MeetupMessage
+    sync_time = datetime.now(timezone.utc)
 
-    messages = db.query(models.MeetupMessage)\
-        .filter(models.MeetupMessage.post_id == post_id)\
-        .order_by(desc(models.MeetupMessage.created_at))\
-        .all()
+    archive = load_archive(db, post_id)
+    query = db.query(M).filter(M.post_id == post_id)
+    if archive is not None:
+        messages, reactions_by_message = _page_with_archive(
+            db, archive, post_id, current_user.id, before_id, after_id, limit, reactions_since
+        )
+    elif after_id is not None:
+        # 新着は古い順に limit 件取り、取りこぼしなく次の after_id につなげる
+        query = _cursor_filter(query, after_id, newer=True)
+        messages = query.order_by(M.created_at, M.id).limit(limit or MESSAGE_PAGE_MAX).all()
+        messages.reverse()
+        if reactions_since is not None:
+            new_ids = {m.id for m in messages}
+            changed = db.query(M).filter(
+                M.post_id == post_id,
+                M.reactions_updated_at >= reactions_since
+            ).order_by(desc(M.created_at), desc(M.id)).limit(MESSAGE_PAGE_MAX).all()
+            messages += [m for m in changed if m.id not in new_ids]
+    else:
+        if before_id is not None:
+            query = _cursor_filter(query, before_id, newer=False)
+        query = query.order_by(desc(M.created_at), desc(M.id))
+        if limit:
+            query = query.limit(limit)
+        messages = query.all()
+
+    response.headers["X-Sync-Time"] = sync_time.isoformat()
 
-    # リアクションを各メッセージに付与
+    # リアクションをまとめて集計して各メッセージに付与
+    if archive is None:
+        reactions_by_message = build_reactions_for_messages([m.id for m in messages], current_user.id, db)
     result = []
     for m in messages:
-        reactions = build_reactions(m.id, current_user.id, db)
         result.append(MeetupMessageResponse(
             id=m.id,
             content=m.content,
@@ -117,32 +224,24 @@ def get_meetup_messages(
             user_id=m.user_id,
             post_id=m.post_id,
             author_nickname=m.author_nickname,
-            reactions=reactions,
+            reactions=reactions_by_message.get(m.id, []),
         ))
     return result
 
 
-@router.post("/{post_id}", response_model=MeetupMessageResponse, status_code=status.HTTP_201_CREATED)
-def send_meetup_message(
-    post_id: int,
-    message_in: MeetupMessageCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
-    """メッセージ送信（HOSTまたは参加者のみ）"""
-    check_chat_permission(post_id, current_user.id, db)
-
+def _create_message(db: Session, post_id: int, user: models.User, content: str) -> MeetupMessageResponse:
+    """メッセージを保存してルームに配信する（権限チェック済みであること）"""
     db_message = models.MeetupMessage(
         post_id=post_id,
-        user_id=current_user.id,
-        author_nickname=current_user.nickname or f"User{current_user.id}",
-        content=message_in.content
+        user_id=user.id,
+        author_nickname=user.nickname or f"User{user.id}",
+        content=content
     )
     db.add(db_message)
     db.commit()
     db.refresh(db_message)
 
-    return MeetupMessageResponse(
+    result = MeetupMessageResponse(
         id=db_message.id,
         content=db_message.content,
         created_at=db_message.created_at,
@@ -151,6 +250,71 @@ def send_meetup_message(
         author_nickname=db_message.author_nickname,
         reactions=[],
     )
+    pubsub.publish(meetup_channel(post_id), {"type": "message", "message": result.model_dump(mode="json")})
+    return result
+
+
+def _toggle_reaction(db: Session, post_id: int, message_id: int, user_id: int, reaction: str):
+    """リアクションをトグルしてルームに配信し、(action, 自分視点の集計) を返す（権限チェック済みであること）"""
+    # メッセージ存在確認
+    message = db.query(models.MeetupMessage).filter(
+        models.MeetupMessage.id == message_id,
+        models.MeetupMessage.post_id == post_id
+    ).first()
+    if not message:
+        raise HTTPException(status_code=404, detail="メッセージが見つかりません")
+
+    # 既に押している → 削除（トグルOFF）
+    # 削除できた件数で判定するので、同時に2回押されても二重に減らさない
+    removed = db.query(models.MeetupMessageReaction).filter(
+        models.MeetupMessageReaction.message_id == message_id,
+        models.MeetupMessageReaction.user_id == user_id,
+        models.MeetupMessageReaction.reaction == reaction
+    ).delete(synchronize_session=False)
+
+    if removed:
+        decrement_reaction_count(db, message_id, reaction)
+        action = "removed"
+    else:
+        # 未押し → 追加（トグルON）
+        try:
+            with db.begin_nested():
+                db.add(models.MeetupMessageReaction(
+                    message_id=message_id,
+                    user_id=user_id,
+                    reaction=reaction
+                ))
+            increment_reaction_count(db, message_id, reaction)
+        except IntegrityError:
+            pass  # 同時リクエストで既に追加済み
+        action = "added"
+    # 差分同期（reactions_since）で変化を拾えるようにする
+    message.reactions_updated_at = datetime.now(timezone.utc)
+    db.commit()
+
+    reactions = build_reactions(message_id, user_id, db)
+    # reacted_by_me は受信者ごとに異なるので、件数と操作内容だけを配信する
+    pubsub.publish(meetup_channel(post_id), {
+        "type": "reaction",
+        "message_id": message_id,
+        "user_id": user_id,
+        "reaction": reaction,
+        "action": action,
+        "reactions": [{"reaction": r.reaction, "count": r.count} for r in reactions],
+    })
+    return action, reactions
+
+
+@router.post("/{post_id}", response_model=MeetupMessageResponse, status_code=status.HTTP_201_CREATED)
+def send_meetup_message(
+    post_id: int,
+    message_in: MeetupMessageCreate,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """メッセージ送信（HOSTまたは参加者のみ）"""
+    check_chat_permission(post_id, current_user.id, db)
+    return _create_message(db, post_id, current_user, message_in.content)
 
 
 @router.post("/{post_id}/messages/{message_id}/reaction", status_code=status.HTTP_200_OK)
@@ -167,37 +331,131 @@ def toggle_reaction(
     - 返り値: { "action": "added" | "removed", "reactions": [...] }
     """
     check_chat_permission(post_id, current_user.id, db)
+    action, reactions = _toggle_reaction(db, post_id, message_id, current_user.id, reaction_in.reaction)
+    return {"action": action, "reactions": reactions}
 
-    # メッセージ存在確認
-    message = db.query(models.MeetupMessage).filter(
-        models.MeetupMessage.id == message_id,
-        models.MeetupMessage.post_id == post_id
-    ).first()
-    if not message:
-        raise HTTPException(status_code=404, detail="メッセージが見つかりません")
 
-    # 既存リアクション確認
-    existing = db.query(models.MeetupMessageReaction).filter(
-        models.MeetupMessageReaction.message_id == message_id,
-        models.MeetupMessageReaction.user_id == current_user.id,
-        models.MeetupMessageReaction.reaction == reaction_in.reaction
-    ).first()
+# ==========================================
+# 💡 WebSocket（MEETUPごとのチャットルーム）
+# ==========================================
+# ws://.../meetup-chat/ws/{post_id}?token=<JWT>
+# 接続中は同じ MEETUP の新着メッセージ・リアクションの変化がプッシュされる。
+#   受信: {"type": "message", "message": {...}}
+#         {"type": "reaction", "message_id", "user_id", "reaction", "action", "reactions": [{reaction, count}]}
+#   送信: {"type": "message", "content": "..."}
+#         {"type": "reaction", "message_id": 1, "reaction": "👍"}
+# ルームは Pub/Sub のチャンネル "meetup:{post_id}"（utils/pubsub.py）なので、
+# PUBSUB_BACKEND=postgres なら複数ワーカー間でも同じルームを共有できる。
+# 受信が追いつかないクライアント（キューあふれ・送信タイムアウト）は 1013 で切断する。
+# 参加者が変わったら（invalidate_membership の通知）権限を確認し直し、
+# キャンセル・No Show などで参加者でなくなった接続は 1008 で切断する。
+# クライアントは再接続後に GET /meetup-chat/{post_id}?after_id=... で差分を取り直す。
 
-    if existing:
-        # 既に押している → 削除（トグルOFF）
-        db.delete(existing)
-        db.commit()
-        action = "removed"
-    else:
-        # 未押し → 追加（トグルON）
-        new_reaction = models.MeetupMessageReaction(
-            message_id=message_id,
-            user_id=current_user.id,
-            reaction=reaction_in.reaction
-        )
-        db.add(new_reaction)
-        db.commit()
-        action = "added"
+WS_SEND_TIMEOUT = 5       # 秒。これより送信が詰まったら切断
+WS_QUEUE_SIZE = 256       # 接続ごとの未送信メッセージ上限
+WS_CLOSE_UNAUTHORIZED = 1008
+WS_CLOSE_TRY_AGAIN = 1013
 
-    reactions = build_reactions(message_id, current_user.id, db)
-    return {"action": action, "reactions": reactions}
+
+def _authorize_ws(token: Optional[str], post_id: int) -> Optional[int]:
+    """トークンとチャット権限を確認してユーザーIDを返す（接続中は DB セッションを保持しない）"""
+    payload = decode_access_token(token) if token else None
+    if not payload or not payload.get("sub"):
+        return None
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).filter(models.User.email == payload["sub"]).first()
+        if not user:
+            return None
+        try:
+            check_chat_permission(post_id, user.id, db)
+        except HTTPException:
+            return None
+        return user.id
+    finally:
+        db.close()
+
+
+def _is_member(post_id: int, user_id: int) -> bool:
+    """接続中のユーザーがまだ主催者または参加者か"""
+    db = SessionLocal()
+    try:
+        membership = get_membership(db, post_id)
+        return membership is not None and membership.allows(user_id)
+    finally:
+        db.close()
+
+
+def _handle_ws_command(post_id: int, user_id: int, data: dict) -> Optional[dict]:
+    """クライアントからの送信を処理する。エラー時はクライアントに返す dict を返す"""
+    db = SessionLocal()
+    try:
+        check_chat_permission(post_id, user_id, db)
+        kind = data.get("type")
+        if kind == "message":
+            content = MeetupMessageCreate(content=data.get("content") or "").content
+            user = db.query(models.User).filter(models.User.id == user_id).first()
+            _create_message(db, post_id, user, content)
+        elif kind == "reaction":
+            reaction = ReactionCreate(reaction=data.get("reaction") or "").reaction
+            _toggle_reaction(db, post_id, int(data.get("message_id")), user_id, reaction)
+        else:
+            return {"type": "error", "detail": f"不明な type: {kind}"}
+        return None
+    except HTTPException as e:
+        return {"type": "error", "detail": e.detail}
+    except (ValidationError, TypeError, ValueError) as e:
+        return {"type": "error", "detail": str(e)}
+    finally:
+        db.close()
+
+
+@router.websocket("/ws/{post_id}")
+async def meetup_chat_ws(websocket: WebSocket, post_id: int, token: Optional[str] = None):
+    user_id = await run_in_threadpool(_authorize_ws, token, post_id)
+    if user_id is None:
+        await websocket.close(code=WS_CLOSE_UNAUTHORIZED)
+        return
+    await websocket.accept()
+
+    sub = pubsub.subscribe([meetup_channel(post_id), MEMBERSHIP_CHANNEL], maxsize=WS_QUEUE_SIZE)
+
+    async def pump_out():
+        close_code = WS_CLOSE_TRY_AGAIN
+        while True:
+            message = await sub.get()
+            if message.get("type") == RESYNC["type"]:
+                # 受信が追いつかなかった：切断して差分取得からやり直してもらう
+                break
+            if message.get("type") == "membership_invalidate":
+                # 参加者が変わった：外れていたらこれ以上配信せずに切断する
+                if message.get("post_id") == post_id and not await run_in_threadpool(_is_member, post_id, user_id):
+                    close_code = WS_CLOSE_UNAUTHORIZED
+                    break
+                continue
+            try:
+                await asyncio.wait_for(websocket.send_json(message), timeout=WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+        try:
+            await websocket.close(code=close_code)
+        except RuntimeError:
+            pass  # すでに切断済み
+
+    async def pump_in():
+        while True:
+            data = await websocket.receive_json()
+            if not isinstance(data, dict):
+                continue
+            error = await run_in_threadpool(_handle_ws_command, post_id, user_id, data)
+            if error:
+                await websocket.send_json(error)
+
+    tasks = [asyncio.create_task(pump_out()), asyncio.create_task(pump_in())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        pubsub.unsubscribe(sub)
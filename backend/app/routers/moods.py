@@ -1,17 +1,15 @@
 # app/routers/moods.py
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import func
 from typing import List, Optional
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 from pydantic import BaseModel
-import time
 from .. import models
 from ..database import get_db
 from .auth import get_current_user
-
-_following_moods_cache: dict = {}
-MOOD_CACHE_TTL = 30  # 30秒
+from ..logics.friend_moods import get_friend_moods, invalidate_friends_of
+from ..logics.mood_rollup import record_mood, mood_stats
+from ..logics.community_mood import record_community_mood
 
 router = APIRouter()
 
@@ -82,6 +80,9 @@ def create_mood_log(
     current_user.current_mood_comment = mood.comment
     current_user.mood_updated_at = post_time  # ★ ユーザーの最新更新時刻も合わせる
     current_user.is_mood_visible = mood.is_visible
+    record_mood(db, current_user.id, mood.mood_type, created_at=post_time)
+    record_community_mood(db, current_user, mood.mood_type, created_at=post_time, is_visible=mood.is_visible)
+    invalidate_friends_of(db, current_user.id)
 
     try:
         db.commit()
@@ -90,12 +91,7 @@ def create_mood_log(
         db.rollback()
         raise HTTPException(status_code=500, detail=f"保存に失敗しました: {str(e)}")
 
-    # 古いログの削除（既存ロジック）
-    try:
-        cleanup_old_mood_logs(db, current_user.id)
-    except:
-        pass
-
+    # 古いログの削除は定期ジョブ（logics/mood_retention.py）で行う
     return db_mood
 
 # ==========================================
@@ -180,6 +176,7 @@ def update_mood_visibility(
 ):
     """気分表示の公開/非公開を切り替える"""
     current_user.is_mood_visible = is_visible
+    invalidate_friends_of(db, current_user.id)
     db.commit()
     
     return {
@@ -187,88 +184,15 @@ def update_mood_visibility(
         "is_visible": is_visible
     }
 
-# ==========================================
-# 💡 過去ログの自動削除（軽量化）
-# ==========================================
-
-def cleanup_old_mood_logs(db: Session, user_id: int):
-    """
-    3ヶ月以上前のログ、または1000件を超えるログを自動削除
-    ※ DB負荷を抑えるための軽量化施策
-    """
-    # 3ヶ月弱前の日時
-    three_months_ago = datetime.now(timezone.utc) - timedelta(days=95)
-    
-    # 3ヶ月弱以上前のログを削除
-    db.query(models.MoodLog).filter(
-        models.MoodLog.user_id == user_id,
-        models.MoodLog.created_at < three_months_ago
-    ).delete()
-    
-    # 1200件を超える古いログを削除
-    total_logs = db.query(func.count(models.MoodLog.id)).filter(
-        models.MoodLog.user_id == user_id
-    ).scalar()
-    
-    if total_logs > 1200:
-        # 最新1000件を残して削除
-        logs_to_keep = db.query(models.MoodLog.id).filter(
-            models.MoodLog.user_id == user_id
-        ).order_by(models.MoodLog.created_at.desc()).limit(1000).subquery()
-        
-        db.query(models.MoodLog).filter(
-            models.MoodLog.user_id == user_id,
-            ~models.MoodLog.id.in_(logs_to_keep)
-        ).delete(synchronize_session=False)
-    
-    db.commit()
-
 @router.get("/moods/my-stats", tags=["moods"])
 def get_my_mood_stats(
+    days: int = 30,
+    category: Optional[str] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """自分の気分ログの統計情報（過去30日間）"""
-    # タイムゾーンを意識した時刻取得（created_atに合わせる）
-    thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-    
-    # 1. 過去30日間の全ログを取得
-    logs = db.query(models.MoodLog).filter(
-        models.MoodLog.user_id == current_user.id,
-        models.MoodLog.created_at >= thirty_days_ago
-    ).all()
-
-    if not logs:
-        return {
-            "period": "過去30日間",
-            "average_score": 3.0,
-            "total_logs": 0,
-            "mood_counts": {},
-            "most_common_mood": "neutral"
-        }
-
-    # 2. 平均スコアを計算 (models.pyに追加した .score プロパティを利用)
-    # 💡 log.score は models.py で定義した mapping (HAPPY=4, ANGRY=1 など) を参照します
-    total_score = sum(log.score for log in logs)
-    average_score = round(total_score / len(logs), 1)
-
-    # 3. 気分タイプごとのカウント（既存のロジック）
-    mood_counts = {}
-    for log in logs:
-        # Enumオブジェクトをキーにするため、.value を取るかそのまま使うかは実装合わせ
-        m_type = log.mood_type.value if hasattr(log.mood_type, 'value') else log.mood_type
-        mood_counts[m_type] = mood_counts.get(m_type, 0) + 1
-    
-    # 最も多い気分を特定
-    most_common_mood = max(mood_counts, key=mood_counts.get) if mood_counts else "neutral"
-    
-    return {
-        "period": "過去30日間",
-        "average_score": average_score,  # ← これがフロントエンドの「3」を動かす鍵です！
-        "total_logs": len(logs),
-        "mood_counts": mood_counts,
-        "most_common_mood": most_common_mood
-    }
+    """自分の気分ログの統計情報（既定は過去30日間。日別集計から計算）"""
+    return mood_stats(db, current_user.id, days=max(1, min(days, 365)), category=category)
 
 # ==========================================
 # 💡 フォロー中ユーザーの最新気分ログを取得
@@ -295,48 +219,19 @@ def get_following_moods(
     """
     承認済みの友達（Friendship）の中で、非表示・更新停止されていないユーザーの最新気分を取得。
     """
-    # キャッシュチェック
-    cache_key = str(current_user.id)
-    now = time.time()
-    if cache_key in _following_moods_cache:
-        cached_data, cached_time = _following_moods_cache[cache_key]
-        if now - cached_time < MOOD_CACHE_TTL and cached_data is not None:
-            return cached_data
-
-        # 1. Friendshipテーブルから「友達のID」を取得
-    friend_relations = db.query(models.Friendship).filter(
-        models.Friendship.user_id == current_user.id,
-        models.Friendship.is_hidden == False,
-    ).all()
-
-    friend_ids = [rel.friend_id for rel in friend_relations]
-    relation_map = {rel.friend_id: rel for rel in friend_relations}
-
-    if not friend_ids:
-        return []
-
-    # 2. 友達の最新情報を取得
-    friends_with_mood = db.query(models.User).filter(
-        models.User.id.in_(friend_ids),
-        models.User.is_mood_visible == True
-    ).order_by(models.User.mood_updated_at.desc()).all()
-
-    # 3. レスポンス形式に変換
-    result = [
+    # 友達の気分ボードは logics/friend_moods のキャッシュを使う
+    board = [row for row in get_friend_moods(db, current_user.id) if not row["is_hidden"]]
+    board.sort(key=lambda row: row["mood_updated_at"].timestamp() if row["mood_updated_at"] else 0, reverse=True)
+    return [
         UserMoodResponse(
-            user_id=user.id,
-            nickname=user.nickname,
-            current_mood=user.current_mood,
-            current_mood_comment=user.current_mood_comment,
-            mood_updated_at=user.mood_updated_at,
-            is_mood_visible=user.is_mood_visible,
-            is_muted=relation_map[user.id].is_muted,        # ← 追加
-            friend_note=relation_map[user.id].friend_note,
+            user_id=row["user_id"],
+            nickname=row["nickname"],
+            current_mood=row["current_mood"],
+            current_mood_comment=row["current_mood_comment"],
+            mood_updated_at=row["mood_updated_at"],
+            is_mood_visible=row["is_mood_visible"],
+            is_muted=row["is_muted"],
+            friend_note=row["friend_note"],
         )
-        for user in friends_with_mood
+        for row in board
     ]
-
-    # キャッシュに保存
-    _following_moods_cache[cache_key] = (result, now)
-
-    return result
@@ -9,7 +9,17 @@ import os
 from .. import models, schemas
 from ..database import get_db
 from .auth import get_current_user
-from fastapi import APIRouter, Depends
+from ..logics.unread_counter import get_unread_count, decrement_unread, reset_unread
+from ..logics.notifications import notification_event
+from ..database import SessionLocal
+from ..utils.security import decode_access_token
+from ..utils.pubsub import pubsub, user_channel, RESYNC
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import asyncio
+from collections import deque
+import json
 
 router = APIRouter() 
 
@@ -287,10 +297,7 @@ def get_unread_notification_count(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    count = db.query(func.count(models.Notification.id)).filter(
-        models.Notification.recipient_id == current_user.id,
-        models.Notification.is_read == False
-    ).scalar() or 0
+    count = get_unread_count(db, current_user.id)
     return {"unread_count": count}
 
 @router.patch("/notifications/read-all")
@@ -302,6 +309,7 @@ def mark_all_notifications_read(
         models.Notification.recipient_id == current_user.id,
         models.Notification.is_read == False
     ).update({"is_read": True})
+    reset_unread(db, current_user.id)
     db.commit()
     return {"status": "ok"}
 
@@ -344,9 +352,177 @@ def mark_notification_read(
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    db.query(models.Notification).filter(
+    updated = db.query(models.Notification).filter(
         models.Notification.id == notification_id,
-        models.Notification.recipient_id == current_user.id
+        models.Notification.recipient_id == current_user.id,
+        models.Notification.is_read == False
     ).update({"is_read": True})
+    decrement_unread(db, current_user.id, updated)
     db.commit()
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+
+# =====================
+# 💡 通知のリアルタイム配信（Server-Sent Events）
+# =====================
+# 接続中は新しい通知と未読数の変化をプッシュするので、
+# /notifications/unread-count・/notifications/my のポーリングは不要になる。
+# 再接続時はブラウザが Last-Event-ID（= 最後に受け取った通知ID）を送るので、
+# それより新しい通知を DB から取り直して送る（取りこぼし防止）。
+# 取り直しが SSE_CATCHUP_LIMIT × SSE_CATCHUP_MAX_PAGES 件を超えたら送らずに
+# resync イベントを送る。クライアントは /notifications/my で一覧を読み直すこと。
+# 通知IDは commit 前に採番されるので、ID の大小ではなく送信済みIDの集合で重複を除く。
+
+SSE_KEEPALIVE_SECONDS = 15
+SSE_RETRY_MS = 3000
+SSE_CATCHUP_LIMIT = 100
+SSE_CATCHUP_MAX_PAGES = 10
+SSE_SENT_IDS_MAX = 1000     # 重複除去のために覚えておく送信済み通知IDの数
+
+
+def _resolve_stream_user_id(token: Optional[str]) -> Optional[int]:
+    """トークンからユーザーIDを取得（ストリーム中は DB セッションを保持しない）"""
+    payload = decode_access_token(token) if token else None
+    if not payload or not payload.get("sub"):
+        return None
+    db = SessionLocal()
+    try:
+        user_id = db.query(models.User.id).filter(models.User.email == payload["sub"]).scalar()
+        if user_id is not None:
+            # 未読数のキャッシュを温めておく
+            get_unread_count(db, user_id)
+        return user_id
+    finally:
+        db.close()
+
+
+def _load_stream_snapshot(
+    user_id: int, after_id: Optional[int]
+) -> Tuple[List[Dict[str, Any]], int, int, bool]:
+    """
+    after_id より新しい通知（古い順）・現在の未読数・基準となる通知ID・取り直しきれたかを返す。
+    after_id がない（初回接続）場合は取り直しせず、最新の通知IDを基準にする。
+    取り直しが上限を超えたら通知は返さず、最新の通知IDを基準にして False を返す。
+    """
+    db = SessionLocal()
+    try:
+        events = []
+        complete = True
+        if after_id is not None:
+            for _ in range(SSE_CATCHUP_MAX_PAGES):
+                rows = db.query(models.Notification).filter(
+                    models.Notification.recipient_id == user_id,
+                    models.Notification.id > after_id
+                ).order_by(models.Notification.id.asc()).limit(SSE_CATCHUP_LIMIT).all()
+                events += [notification_event(n) for n in rows]
+                if rows:
+                    after_id = rows[-1].id
+                if len(rows) < SSE_CATCHUP_LIMIT:
+                    break
+            else:
+                events, complete = [], False
+        if not complete or after_id is None:
+            after_id = db.query(func.max(models.Notification.id)).filter(
+                models.Notification.recipient_id == user_id
+            ).scalar() or 0
+        return events, get_unread_count(db, user_id), after_id, complete
+    finally:
+        db.close()
+
+
+def _sse(data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {data['type']}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, default=str))
+    return "\n".join(lines) + "\n\n"
+
+
+@router.get("/notifications/stream")
+async def stream_notifications(
+    request: Request,
+    token: Optional[str] = None,
+    last_event_id: Optional[int] = None,
+):
+    """
+    通知の SSE ストリーム。
+    EventSource はヘッダーを付けられないため、トークンは ?token= でも受け付ける。
+    イベント: notification（id 付き） / unread_count / resync（一覧を読み直す）
+    """
+    auth = request.headers.get("authorization", "")
+    if auth.lower().startswith("bearer "):
+        token = auth[7:]
+    user_id = await run_in_threadpool(_resolve_stream_user_id, token)
+    if user_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="認証情報が無効です",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    header_id = request.headers.get("last-event-id")
+    if header_id and header_id.isdigit():
+        last_event_id = int(header_id)
+
+    async def event_stream():
+        # 取りこぼさないよう、DB を読む前に購読を開始する
+        sub = pubsub.subscribe([user_channel(user_id)])
+        last_id = last_event_id
+        sent_order: deque = deque()
+        sent_ids = set()
+
+        def first_send(notification_id: int) -> bool:
+            if notification_id in sent_ids:
+                return False
+            sent_ids.add(notification_id)
+            sent_order.append(notification_id)
+            if len(sent_order) > SSE_SENT_IDS_MAX:
+                sent_ids.discard(sent_order.popleft())
+            return True
+
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            resync = True
+            while True:
+                if resync:
+                    events, unread, last_id, complete = await run_in_threadpool(
+                        _load_stream_snapshot, user_id, last_id
+                    )
+                    if not complete:
+                        # 取り直しきれない：一覧ごと読み直してもらう
+                        yield _sse({"type": "resync"}, last_id)
+                    for ev in events:
+                        if first_send(ev["id"]):
+                            yield _sse(ev, ev["id"])
+                    yield _sse({"type": "unread_count", "unread_count": unread})
+                    resync = False
+
+                try:
+                    message = await asyncio.wait_for(sub.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if message.get("type") == RESYNC["type"]:
+                    resync = True
+                elif message.get("type") == "notification":
+                    if not first_send(message["id"]):
+                        continue  # 取り直し分と重複
+                    last_id = max(last_id, message["id"])
+                    yield _sse(message, message["id"])
+                else:
+                    yield _sse(message)
+        finally:
+            pubsub.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # プロキシでのバッファリングを無効化
+        },
+    )
@@ -8,6 +8,7 @@ from app.utils.security import get_current_user # 認証用関数名を確認
 from .. import models, schemas
 from ..database import get_db
 from ..logics.notifications import notify_ancestors, check_town_member_limit, create_region_notifications_for_post 
+from ..logics.chat_membership import invalidate_membership
 from .community import validate_special_post_limit
 from datetime import datetime, timedelta
 from ..schemas.posts import (
@@ -72,7 +73,8 @@ def create_hobby_post(
     db.refresh(db_post)
     
     if "[ALL]" in db_post.content.upper():
-        background_tasks.add_task(notify_ancestors, db_post.id, db_post.user_id, db, current_user.nickname, db_post.content)
+        # 通知の一斉作成は自前のセッションで行う（リクエストの db はレスポンス後に閉じられるため）
+        background_tasks.add_task(notify_ancestors, db_post.id, db_post.user_id, current_user.nickname, db_post.content)
     
     if db_post.is_meetup:
         background_tasks.add_task(create_region_notifications_for_post, db, db_post)
@@ -210,6 +212,7 @@ def create_post_response(
     )
     
     db.add(db_response)
+    invalidate_membership(db, post_id)
     db.commit()
     db.refresh(db_response)
     
@@ -309,6 +312,7 @@ def cancel_meetup_participation(
         raise HTTPException(status_code=404, detail="参加情報が見つかりません")
     
     db.delete(res)
+    invalidate_membership(db, post_id)
     db.commit()
     return {"message": "canceled"}
 
@@ -352,6 +356,7 @@ def cancel_meetup_participation(
         raise HTTPException(status_code=404, detail="参加情報が見つかりません")
     
     db.delete(res)
+    invalidate_membership(db, post_id)
     db.commit()
     return {"message": "canceled"}
 
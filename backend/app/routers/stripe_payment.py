@@ -1,15 +1,23 @@
-import asyncio 
-import csv
-import io
 import os
 from datetime import datetime, timedelta, date, timezone
 import stripe
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 from calendar import monthrange
-from ..utils.email import send_email, meetup_waitlist_notification_html
+from ..logics.notification_digest import enqueue_notification, KIND_WAITLIST, KIND_MEETUP
+from ..logics.chat_membership import invalidate_membership
+from ..utils.csv_export import iter_query_csv, csv_response
+from ..logics.friend_graph import get_friend_count
+from ..utils.stripe_gateway import stripe_call
+from ..logics.meetup_charges import start_charge_run, process_charge_run, charge_run_summary
+from ..logics.price_catalog import get_price_id
+from ..logics.stripe_webhooks import enqueue_webhook_event
+from ..logics.payment_methods import (
+    charge_saved_card, remember_payment_method, forget_payment_method,
+    remember_checkout_payment_method,
+)
 
 from ..database import get_db
 
@@ -54,7 +62,7 @@ def _get_or_create_stripe_customer(user_id: int, db: Session) -> str:
     if sub_row and sub_row.stripe_customer_id:
         return sub_row.stripe_customer_id
 
-    customer = stripe.Customer.create(
+    customer = stripe_call(stripe.Customer.create,
         email=row.email,
         name=row.nickname or f"user_{user_id}",
         metadata={"user_id": str(user_id)},
@@ -68,11 +76,29 @@ def _calc_amount(friend_count: int) -> int:
 
 
 def _get_friend_count(user_id: int, db: Session) -> int:
-    result = db.execute(text("""
-        SELECT COUNT(*) AS cnt FROM friendships
-        WHERE user_id = :uid
-    """), {"uid": user_id}).fetchone()
-    return result.cnt if result else 0
+    return get_friend_count(db, user_id)
+
+
+def _friend_manager_price_id(db: Session) -> str:
+    # 1人あたり PRICE_PER_FRIEND 円の Price を1つだけ使い、追加人数は quantity で表す
+    return get_price_id(db, f"friend_manager_per_friend_{PRICE_PER_FRIEND}", PRICE_PER_FRIEND, "FRIEND's manager")
+
+
+def _update_friend_manager_quantity(db: Session, subscription_id: str, item_id: str, extra: int) -> str:
+    """
+    既存サブスクリプションの追加人数を変える（Stripe の呼び出しは Subscription.modify の1回）。
+    アイテムIDが保存されていない古いサブスクリプションだけ、1回 retrieve して調べる。
+    古い「金額ごとの Price」もここでカタログの Price に置き換わる。
+    """
+    if not item_id:
+        subscription = stripe_call(stripe.Subscription.retrieve, subscription_id)
+        item_id = subscription["items"]["data"][0]["id"]
+    stripe_call(stripe.Subscription.modify,
+        subscription_id,
+        items=[{"id": item_id, "price": _friend_manager_price_id(db), "quantity": extra}],
+        proration_behavior="none",
+    )
+    return item_id
 
 
 def _create_subscription_for_requester(requester_id: int, db: Session) -> dict:
@@ -87,7 +113,7 @@ def _create_subscription_for_requester(requester_id: int, db: Session) -> dict:
 
     sub_row = db.execute(
         text("""
-            SELECT stripe_customer_id, stripe_subscription_id, status
+            SELECT stripe_customer_id, stripe_subscription_id, stripe_subscription_item_id, status
             FROM friend_manager_subscriptions
             WHERE user_id = :uid
         """),
@@ -100,54 +126,28 @@ def _create_subscription_for_requester(requester_id: int, db: Session) -> dict:
     customer_id = sub_row.stripe_customer_id
 
     if sub_row.stripe_subscription_id and sub_row.status == "active":
-        subscription = stripe.Subscription.retrieve(sub_row.stripe_subscription_id)
-        item_id = subscription["items"]["data"][0]["id"]
-        new_price = stripe.Price.create(
-            unit_amount=amount,
-            currency="jpy",
-            recurring={"interval": "month"},
-            product_data={"name": "FRIEND's manager"},
-            metadata={"user_id": str(requester_id), "extra_count": str(extra)},
-        )
-        stripe.Subscription.modify(
-            sub_row.stripe_subscription_id,
-            items=[{"id": item_id, "price": new_price.id}],
-            proration_behavior="none",
+        item_id = _update_friend_manager_quantity(
+            db, sub_row.stripe_subscription_id, sub_row.stripe_subscription_item_id, extra
         )
         db.execute(text("""
             UPDATE friend_manager_subscriptions
             SET friend_count = :fc,
                 charged_extra_count = :ec,
                 current_amount = :amt,
+                stripe_subscription_item_id = :iid,
                 updated_at = NOW()
             WHERE user_id = :uid
-        """), {"fc": new_count, "ec": extra, "amt": amount, "uid": requester_id})
+        """), {"fc": new_count, "ec": extra, "amt": amount, "iid": item_id, "uid": requester_id})
         db.commit()
         return {"updated": True, "monthly_amount": amount}
 
-    payment_methods = stripe.PaymentMethod.list(customer=customer_id, type="card")
-    if not payment_methods.data:
-        return {"requires_payment": False, "skipped": True, "reason": "no_payment_method"}
-
-    pm_id = payment_methods.data[0].id
-    stripe.Customer.modify(customer_id, invoice_settings={"default_payment_method": pm_id})
-
     today = datetime.now(timezone.utc).date()
     _, last_day = monthrange(today.year, today.month)
     days_until_end = last_day - today.day
 
-    price = stripe.Price.create(
-        unit_amount=amount,
-        currency="jpy",
-        recurring={"interval": "month"},
-        product_data={"name": "FRIEND's manager"},
-        metadata={"user_id": str(requester_id), "extra_count": str(extra)},
-    )
-
     sub_params: dict = {
         "customer": customer_id,
-        "items": [{"price": price.id}],
-        "default_payment_method": pm_id,
+        "items": [{"price": _friend_manager_price_id(db), "quantity": extra}],
         "metadata": {
             "user_id": str(requester_id),
             "product": "friend_manager",
@@ -166,11 +166,18 @@ def _create_subscription_for_requester(requester_id: int, db: Session) -> dict:
         )
         sub_params["trial_end"] = trial_end
 
-    subscription = stripe.Subscription.create(**sub_params)
+    # サブスクリプションに default_payment_method を指定するので Customer.modify は不要
+    subscription = charge_saved_card(db, customer_id, lambda pm_id: stripe_call(
+        stripe.Subscription.create, default_payment_method=pm_id, **sub_params
+    ))
+    if subscription is None:
+        db.commit()
+        return {"requires_payment": False, "skipped": True, "reason": "no_payment_method"}
 
     db.execute(text("""
         UPDATE friend_manager_subscriptions
         SET stripe_subscription_id = :sid,
+            stripe_subscription_item_id = :iid,
             status = 'active',
             friend_count = :fc,
             charged_extra_count = :ec,
@@ -179,6 +186,7 @@ def _create_subscription_for_requester(requester_id: int, db: Session) -> dict:
         WHERE user_id = :uid
     """), {
         "sid": subscription.id,
+        "iid": subscription["items"]["data"][0]["id"],
         "fc": new_count,
         "ec": extra,
         "amt": amount,
@@ -194,7 +202,7 @@ def _create_subscription_for_requester(requester_id: int, db: Session) -> dict:
 # ===============================================================
 
 @router.post("/stripe/friend-manager-setup-intent")
-async def create_friend_manager_setup_intent(data: dict, db: Session = Depends(get_db)):
+def create_friend_manager_setup_intent(data: dict, db: Session = Depends(get_db)):
     requester_id = data.get("requesterId")
     receiver_id  = data.get("receiverId")
     if not requester_id or not receiver_id:
@@ -225,7 +233,7 @@ async def create_friend_manager_setup_intent(data: dict, db: Session = Depends(g
     db.commit()
 
     try:
-        session = stripe.checkout.Session.create(
+        session = stripe_call(stripe.checkout.Session.create,
             customer=customer_id,
             payment_method_types=["card"],
             mode="setup",
@@ -249,7 +257,7 @@ async def create_friend_manager_setup_intent(data: dict, db: Session = Depends(g
 
 
 @router.get("/stripe/friend-manager-status")
-async def get_friend_manager_status(user_id: int, db: Session = Depends(get_db)):
+def get_friend_manager_status(user_id: int, db: Session = Depends(get_db)):
     friend_count = _get_friend_count(user_id, db)
     amount = _calc_amount(friend_count)
 
@@ -277,7 +285,7 @@ async def get_friend_manager_status(user_id: int, db: Session = Depends(get_db))
 
 
 @router.post("/stripe/friend-manager-checkout")
-async def create_friend_manager_checkout(data: dict, db: Session = Depends(get_db)):
+def create_friend_manager_checkout(data: dict, db: Session = Depends(get_db)):
     user_id          = data.get("userId")
     new_friend_count = data.get("newFriendCount")
     if not user_id or new_friend_count is None:
@@ -291,7 +299,10 @@ async def create_friend_manager_checkout(data: dict, db: Session = Depends(get_d
     amount = extra * PRICE_PER_FRIEND
 
     sub = db.execute(
-        text("SELECT stripe_subscription_id, status, stripe_customer_id FROM friend_manager_subscriptions WHERE user_id = :uid"),
+        text("""
+            SELECT stripe_subscription_id, stripe_subscription_item_id, status, stripe_customer_id
+            FROM friend_manager_subscriptions WHERE user_id = :uid
+        """),
         {"uid": user_id}
     ).fetchone()
 
@@ -299,25 +310,15 @@ async def create_friend_manager_checkout(data: dict, db: Session = Depends(get_d
         customer_id = _get_or_create_stripe_customer(int(user_id), db)
 
         if sub and sub.stripe_subscription_id and sub.status == "active":
-            subscription = stripe.Subscription.retrieve(sub.stripe_subscription_id)
-            item_id = subscription["items"]["data"][0]["id"]
-            new_price = stripe.Price.create(
-                unit_amount=amount, currency="jpy",
-                recurring={"interval": "month"},
-                product_data={"name": "FRIEND's manager"},
-                metadata={"user_id": str(user_id), "extra_count": str(extra)},
-            )
-            stripe.Subscription.modify(
-                sub.stripe_subscription_id,
-                items=[{"id": item_id, "price": new_price.id}],
-                proration_behavior="none",
+            item_id = _update_friend_manager_quantity(
+                db, sub.stripe_subscription_id, sub.stripe_subscription_item_id, extra
             )
             db.execute(text("""
                 UPDATE friend_manager_subscriptions
                 SET friend_count = :fc, charged_extra_count = :ec,
-                    current_amount = :amt, updated_at = NOW()
+                    current_amount = :amt, stripe_subscription_item_id = :iid, updated_at = NOW()
                 WHERE user_id = :uid
-            """), {"fc": new_friend_count, "ec": extra, "amt": amount, "uid": int(user_id)})
+            """), {"fc": new_friend_count, "ec": extra, "amt": amount, "iid": item_id, "uid": int(user_id)})
             db.commit()
             return {"requires_payment": False, "updated": True, "monthly_amount": amount}
 
@@ -335,17 +336,10 @@ async def create_friend_manager_checkout(data: dict, db: Session = Depends(get_d
             billing_start = today
             trial_end = None
 
-        price = stripe.Price.create(
-            unit_amount=amount, currency="jpy",
-            recurring={"interval": "month"},
-            product_data={"name": "FRIEND's manager"},
-            metadata={"user_id": str(user_id), "extra_count": str(extra)},
-        )
-
         session_params: dict = {
             "customer": customer_id,
             "payment_method_types": ["card"],
-            "line_items": [{"price": price.id, "quantity": 1}],
+            "line_items": [{"price": _friend_manager_price_id(db), "quantity": extra}],
             "mode": "subscription",
             "success_url": f"{FRONTEND_URL}/friends?fm_session={{CHECKOUT_SESSION_ID}}",
             "cancel_url":  f"{FRONTEND_URL}/friends",
@@ -358,7 +352,7 @@ async def create_friend_manager_checkout(data: dict, db: Session = Depends(get_d
         if trial_end:
             session_params["subscription_data"] = {"trial_end": trial_end}
 
-        session = stripe.checkout.Session.create(**session_params)
+        session = stripe_call(stripe.checkout.Session.create, **session_params)
 
         existing = db.execute(
             text("SELECT id FROM friend_manager_subscriptions WHERE user_id = :uid"),
@@ -392,13 +386,13 @@ async def create_friend_manager_checkout(data: dict, db: Session = Depends(get_d
 
 
 @router.post("/stripe/friend-manager-activate")
-async def activate_friend_manager(data: dict, db: Session = Depends(get_db)):
+def activate_friend_manager(data: dict, db: Session = Depends(get_db)):
     session_id = data.get("sessionId")
     if not session_id:
         raise HTTPException(status_code=400, detail="sessionId が必要です")
 
     try:
-        stripe_session = stripe.checkout.Session.retrieve(session_id)
+        stripe_session = stripe_call(stripe.checkout.Session.retrieve, session_id, expand=["subscription"])
         if stripe_session.payment_status not in ("paid", "no_payment_required"):
             raise HTTPException(status_code=403, detail="決済が完了していません")
         if stripe_session.metadata.get("product") != "friend_manager":
@@ -407,7 +401,9 @@ async def activate_friend_manager(data: dict, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="無効なセッションです")
 
     user_id       = stripe_session.metadata.get("user_id")
-    subscription_id = stripe_session.subscription
+    subscription    = stripe_session.subscription
+    subscription_id = subscription.id if subscription else None
+    item_id         = subscription["items"]["data"][0]["id"] if subscription else None
     extra_count   = int(stripe_session.metadata.get("extra_count", 0))
     friend_count  = int(stripe_session.metadata.get("friend_count", 0))
     amount        = extra_count * PRICE_PER_FRIEND
@@ -415,21 +411,23 @@ async def activate_friend_manager(data: dict, db: Session = Depends(get_db)):
     db.execute(text("""
         UPDATE friend_manager_subscriptions
         SET stripe_subscription_id = :sid,
+            stripe_subscription_item_id = :iid,
             status = 'active',
             friend_count = :fc,
             charged_extra_count = :ec,
             current_amount = :amt,
             updated_at = NOW()
         WHERE user_id = :uid
-    """), {"sid": subscription_id, "fc": friend_count, "ec": extra_count,
+    """), {"sid": subscription_id, "iid": item_id, "fc": friend_count, "ec": extra_count,
            "amt": amount, "uid": int(user_id)})
+    remember_checkout_payment_method(db, stripe_session)
     db.commit()
 
     return {"status": "activated", "monthly_amount": amount, "extra_count": extra_count}
 
 
 @router.post("/stripe/friend-manager-cancel")
-async def cancel_friend_manager(data: dict, db: Session = Depends(get_db)):
+def cancel_friend_manager(data: dict, db: Session = Depends(get_db)):
     user_id = data.get("userId")
     if not user_id:
         raise HTTPException(status_code=400, detail="userId が必要です")
@@ -443,7 +441,7 @@ async def cancel_friend_manager(data: dict, db: Session = Depends(get_db)):
         return {"status": "no_active_subscription"}
 
     try:
-        stripe.Subscription.modify(sub.stripe_subscription_id, cancel_at_period_end=True)
+        stripe_call(stripe.Subscription.modify, sub.stripe_subscription_id, cancel_at_period_end=True)
     except stripe.error.StripeError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -462,12 +460,12 @@ async def cancel_friend_manager(data: dict, db: Session = Depends(get_db)):
 # ===============================================================
 
 @router.post("/stripe/feeling-log-checkout")
-async def create_feeling_log_checkout(data: dict):
+def create_feeling_log_checkout(data: dict):
     user_id = data.get("userId") or data.get("profileId")
     if not user_id:
         raise HTTPException(status_code=400, detail="userId が必要です")
     try:
-        session = stripe.checkout.Session.create(
+        session = stripe_call(stripe.checkout.Session.create,
             payment_method_types=["card"],
             line_items=[{
                 "price_data": {
@@ -488,7 +486,7 @@ async def create_feeling_log_checkout(data: dict):
 
 
 @router.post("/stripe/friends-log-checkout")
-async def create_friends_log_checkout(data: dict, db: Session = Depends(get_db)):
+def create_friends_log_checkout(data: dict, db: Session = Depends(get_db)):
     user_id = data.get("userId")
     if not user_id:
         raise HTTPException(status_code=400, detail="userId が必要です")
@@ -509,7 +507,7 @@ async def create_friends_log_checkout(data: dict, db: Session = Depends(get_db))
         )
 
     try:
-        session = stripe.checkout.Session.create(
+        session = stripe_call(stripe.checkout.Session.create,
             payment_method_types=["card"],
             line_items=[{
                 "price_data": {
@@ -533,13 +531,13 @@ async def create_friends_log_checkout(data: dict, db: Session = Depends(get_db))
 
 
 @router.post("/stripe/friends-log-activate")
-async def activate_friends_log(data: dict, db: Session = Depends(get_db)):
+def activate_friends_log(data: dict, db: Session = Depends(get_db)):
     session_id = data.get("sessionId")
     if not session_id:
         raise HTTPException(status_code=400, detail="sessionId が必要です")
 
     try:
-        stripe_session = stripe.checkout.Session.retrieve(session_id)
+        stripe_session = stripe_call(stripe.checkout.Session.retrieve, session_id)
         if stripe_session.payment_status != "paid":
             raise HTTPException(status_code=403, detail="決済が完了していません")
         if stripe_session.metadata.get("product") != "friends_log":
@@ -576,7 +574,7 @@ async def activate_friends_log(data: dict, db: Session = Depends(get_db)):
 FRIENDS_LOG_INTERVAL_HOURS = 4
 
 @router.get("/stripe/friends-log-status")
-async def get_friends_log_status(db: Session = Depends(get_db), user_id: int = None):
+def get_friends_log_status(db: Session = Depends(get_db), user_id: int = None):
     if not user_id:
         raise HTTPException(status_code=400, detail="user_id が必要です")
 
@@ -622,8 +620,61 @@ async def get_friends_log_status(db: Session = Depends(get_db), user_id: int = N
     }
 
 
+MOOD_EMOJI = {
+    "HAPPY": "😊", "EXCITED": "🤩", "CALM": "😌",
+    "TIRED": "😥", "SAD": "😭", "ANXIOUS": "😟",
+    "ANGRY": "😡", "NEUTRAL": "😐", "GRATEFUL": "🙏", "MOTIVATED": "🔥",
+}
+
+_FRIENDS_FEELING_LOG_SQL = text("""
+    SELECT DISTINCT ON (ml.user_id)
+        u.nickname, u.username, ml.mood_type, ml.created_at,
+        CASE 
+            WHEN u.is_mood_comment_visible = true 
+             AND f.is_muted = false 
+            THEN ml.comment 
+            ELSE NULL 
+        END AS comment
+    FROM mood_logs ml
+    JOIN users u ON u.id = ml.user_id
+    JOIN friendships f ON f.friend_id = ml.user_id AND f.user_id = :uid
+    WHERE ml.user_id IN (
+        SELECT CASE
+            WHEN f.user_id = :uid THEN f.friend_id
+            ELSE f.user_id
+        END
+        FROM friendships f
+        WHERE (f.user_id = :uid OR f.friend_id = :uid)
+    )
+    AND ml.is_visible = true
+    AND ml.created_at > NOW() - INTERVAL '30 days'
+    ORDER BY ml.user_id, ml.created_at DESC
+""")
+
+_FEELING_LOG_SQL = text("""
+    SELECT created_at, mood_type, comment
+    FROM mood_logs
+    WHERE user_id = :user_id
+      AND is_visible = true
+      AND created_at > NOW() - INTERVAL '3 months'
+    ORDER BY created_at DESC
+    LIMIT 1000
+""")
+
+
+def _feeling_log_cells(log) -> list:
+    dt = log.created_at
+    return [
+        dt.strftime("%Y-%m-%d"),
+        dt.strftime("%H:%M"),
+        log.mood_type,
+        MOOD_EMOJI.get(str(log.mood_type), ""),
+        log.comment or "",
+    ]
+
+
 @router.get("/download/friends-feeling-log")
-async def download_friends_feeling_log(user_id: int, db: Session = Depends(get_db)):
+def download_friends_feeling_log(user_id: int, db: Session = Depends(get_db)):
     purchase = db.execute(text("""
         SELECT id, credits_remaining
         FROM friends_log_purchases
@@ -656,31 +707,6 @@ async def download_friends_feeling_log(user_id: int, db: Session = Depends(get_d
                 detail=f"次のダウンロードまであと{remaining_minutes}分お待ちください。"
             )
 
-    logs = db.execute(text("""
-    SELECT DISTINCT ON (ml.user_id)
-        u.nickname, u.username, ml.mood_type, ml.created_at,
-        CASE 
-            WHEN u.is_mood_comment_visible = true 
-             AND f.is_muted = false 
-            THEN ml.comment 
-            ELSE NULL 
-        END AS comment
-    FROM mood_logs ml
-    JOIN users u ON u.id = ml.user_id
-    JOIN friendships f ON f.friend_id = ml.user_id AND f.user_id = :uid
-    WHERE ml.user_id IN (
-        SELECT CASE
-            WHEN f.user_id = :uid THEN f.friend_id
-            ELSE f.user_id
-        END
-        FROM friendships f
-        WHERE (f.user_id = :uid OR f.friend_id = :uid)
-    )
-    AND ml.is_visible = true
-    AND ml.created_at > NOW() - INTERVAL '30 days'
-    ORDER BY ml.user_id, ml.created_at DESC
-"""), {"uid": user_id}).fetchall()
-
     db.execute(text("""
         INSERT INTO friends_log_downloads (buyer_user_id, downloaded_at)
         VALUES (:uid, NOW())
@@ -696,42 +722,23 @@ async def download_friends_feeling_log(user_id: int, db: Session = Depends(get_d
 
     db.commit()
 
-    output = io.StringIO()
-    output.write("\ufeff")
-    writer = csv.writer(output)
-    writer.writerow(["name", "date", "time", "mood", "emoji", "comment"])
-
-    MOOD_EMOJI = {
-        "HAPPY": "😊", "EXCITED": "🤩", "CALM": "😌",
-        "TIRED": "😥", "SAD": "😭", "ANXIOUS": "😟",
-        "ANGRY": "😡", "NEUTRAL": "😐", "GRATEFUL": "🙏", "MOTIVATED": "🔥",
-    }
-
-    for log in logs:
-        dt = log.created_at
-        name = log.nickname or log.username
-        writer.writerow([
-            name,
-            dt.strftime("%Y-%m-%d"),
-            dt.strftime("%H:%M"),
-            log.mood_type,
-            MOOD_EMOJI.get(str(log.mood_type), ""),
-            log.comment or "",
-        ])
-
-    output.seek(0)
+    # コミット後に専用セッションで読みながら CSV を流す
     today_str = date.today().strftime("%Y%m%d")
-    return StreamingResponse(
-        io.BytesIO(output.getvalue().encode("utf-8-sig")),
-        media_type="text/csv",
-        headers={"Content-Disposition": f"attachment; filename=friends_feeling_log_{today_str}.csv"},
+    return csv_response(
+        iter_query_csv(
+            _FRIENDS_FEELING_LOG_SQL,
+            {"uid": user_id},
+            ["name", "date", "time", "mood", "emoji", "comment"],
+            lambda log: [log.nickname or log.username, *_feeling_log_cells(log)],
+        ),
+        f"friends_feeling_log_{today_str}.csv",
     )
 
 
 @router.get("/download/feeling-log")
-async def download_feeling_log(session_id: str, db: Session = Depends(get_db)):
+def download_feeling_log(session_id: str, db: Session = Depends(get_db)):
     try:
-        session = stripe.checkout.Session.retrieve(session_id)
+        session = stripe_call(stripe.checkout.Session.retrieve, session_id)
         if session.payment_status != "paid":
             raise HTTPException(status_code=403, detail="決済が完了していません")
     except stripe.error.StripeError:
@@ -739,43 +746,14 @@ async def download_feeling_log(session_id: str, db: Session = Depends(get_db)):
 
     user_id = session.metadata.get("user_id")
 
-    result = db.execute(text("""
-        SELECT created_at, mood_type, comment
-        FROM mood_logs
-        WHERE user_id = :user_id
-          AND is_visible = true
-          AND created_at > NOW() - INTERVAL '3 months'
-        ORDER BY created_at DESC
-        LIMIT 1000
-    """), {"user_id": user_id})
-    logs = result.fetchall()
-
-    output = io.StringIO()
-    output.write("\ufeff")
-    writer = csv.writer(output)
-    writer.writerow(["date", "time", "mood", "emoji", "comment"])
-
-    MOOD_EMOJI = {
-        "HAPPY": "😊", "EXCITED": "🤩", "CALM": "😌",
-        "TIRED": "😥", "SAD": "😭", "ANXIOUS": "😟",
-        "ANGRY": "😡", "NEUTRAL": "😐", "GRATEFUL": "🙏", "MOTIVATED": "🔥",
-    }
-
-    for log in logs:
-        dt = log.created_at
-        writer.writerow([
-            dt.strftime("%Y-%m-%d"),
-            dt.strftime("%H:%M"),
-            log.mood_type,
-            MOOD_EMOJI.get(str(log.mood_type), ""),
-            log.comment or "",
-        ])
-
-    output.seek(0)
-    return StreamingResponse(
-        io.BytesIO(output.getvalue().encode("utf-8-sig")),
-        media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=feeling_log.csv"},
+    return csv_response(
+        iter_query_csv(
+            _FEELING_LOG_SQL,
+            {"user_id": user_id},
+            ["date", "time", "mood", "emoji", "comment"],
+            _feeling_log_cells,
+        ),
+        "feeling_log.csv",
     )
 
 
@@ -783,7 +761,7 @@ async def download_feeling_log(session_id: str, db: Session = Depends(get_db)):
 # 7. MEETUP 掲載料（500円）
 # -------------------------------------------------------
 @router.post("/stripe/meetup-checkout")
-async def create_meetup_checkout(data: dict, db: Session = Depends(get_db)):
+def create_meetup_checkout(data: dict, db: Session = Depends(get_db)):
     user_id = data.get("userId")
     post_data = data.get("postData")
 
@@ -815,7 +793,7 @@ async def create_meetup_checkout(data: dict, db: Session = Depends(get_db)):
     post_id = result.fetchone().id
 
     try:
-        session = stripe.checkout.Session.create(
+        session = stripe_call(stripe.checkout.Session.create,
             payment_method_types=["card"],
             line_items=[{
                 "price_data": {
@@ -851,13 +829,13 @@ async def create_meetup_checkout(data: dict, db: Session = Depends(get_db)):
 
 
 @router.post("/stripe/meetup-activate")
-async def activate_meetup(data: dict, db: Session = Depends(get_db)):
+def activate_meetup(data: dict, db: Session = Depends(get_db)):
     session_id = data.get("sessionId")
     if not session_id:
         raise HTTPException(status_code=400, detail="sessionId が必要です")
 
     try:
-        stripe_session = stripe.checkout.Session.retrieve(session_id)
+        stripe_session = stripe_call(stripe.checkout.Session.retrieve, session_id)
         if stripe_session.payment_status != "paid":
             raise HTTPException(status_code=403, detail="決済が完了していません")
         if stripe_session.metadata.get("product") != "meetup":
@@ -879,12 +857,12 @@ async def activate_meetup(data: dict, db: Session = Depends(get_db)):
 
 
 @router.post("/stripe/no-affiliate-checkout")
-async def create_no_affiliate_checkout(data: dict):
+def create_no_affiliate_checkout(data: dict):
     user_id = data.get("userId")
     if not user_id:
         raise HTTPException(status_code=400, detail="userId が必要です")
     try:
-        session = stripe.checkout.Session.create(
+        session = stripe_call(stripe.checkout.Session.create,
             payment_method_types=["card"],
             line_items=[{
                 "price_data": {
@@ -905,7 +883,7 @@ async def create_no_affiliate_checkout(data: dict):
 
 
 @router.post("/stripe/ad-checkout")
-async def create_ad_checkout(data: dict, db: Session = Depends(get_db)):
+def create_ad_checkout(data: dict, db: Session = Depends(get_db)):
     user_id = data.get("userId")
     amount = data.get("amount")
     ad_title = data.get("adTitle", "広告掲載")
@@ -946,7 +924,7 @@ async def create_ad_checkout(data: dict, db: Session = Depends(get_db)):
         post_ids.append(result.fetchone().id)
 
     try:
-        session = stripe.checkout.Session.create(
+        session = stripe_call(stripe.checkout.Session.create,
             payment_method_types=["card"],
             line_items=[{
                 "price_data": {
@@ -986,13 +964,13 @@ async def create_ad_checkout(data: dict, db: Session = Depends(get_db)):
 
 
 @router.post("/stripe/ad-activate")
-async def activate_ad(data: dict, db: Session = Depends(get_db)):
+def activate_ad(data: dict, db: Session = Depends(get_db)):
     session_id = data.get("sessionId")
     if not session_id:
         raise HTTPException(status_code=400, detail="sessionId が必要です")
 
     try:
-        stripe_session = stripe.checkout.Session.retrieve(session_id)
+        stripe_session = stripe_call(stripe.checkout.Session.retrieve, session_id)
         if stripe_session.payment_status != "paid":
             raise HTTPException(status_code=403, detail="決済が完了していません")
         if stripe_session.metadata.get("product") != "ad":
@@ -1046,7 +1024,7 @@ def _get_or_create_stripe_customer_for_user(user_id: int, db: Session) -> str:
     if fm and fm.stripe_customer_id:
         return fm.stripe_customer_id
 
-    customer = stripe.Customer.create(
+    customer = stripe_call(stripe.Customer.create,
         email=row.email,
         name=row.nickname or f"user_{user_id}",
         metadata={"user_id": str(user_id)},
@@ -1055,7 +1033,7 @@ def _get_or_create_stripe_customer_for_user(user_id: int, db: Session) -> str:
 
 
 @router.post("/stripe/meetup-join-setup")
-async def meetup_join_setup(data: dict, db: Session = Depends(get_db)):
+def meetup_join_setup(data: dict, db: Session = Depends(get_db)):
     user_id  = data.get("userId")
     post_id  = data.get("postId")
     if not user_id or not post_id:
@@ -1082,7 +1060,7 @@ async def meetup_join_setup(data: dict, db: Session = Depends(get_db)):
 
     try:
         is_waitlist = data.get("isWaitlist", False)
-        session = stripe.checkout.Session.create(
+        session = stripe_call(stripe.checkout.Session.create,
             customer=customer_id,
             payment_method_types=["card"],
             mode="setup",
@@ -1105,7 +1083,7 @@ async def meetup_join_setup(data: dict, db: Session = Depends(get_db)):
 
 
 @router.post("/stripe/meetup-join-complete")
-async def meetup_join_complete(data: dict, db: Session = Depends(get_db)):
+def meetup_join_complete(data: dict, db: Session = Depends(get_db)):
     user_id          = data.get("userId")
     post_id          = data.get("postId")
     setup_session_id = data.get("setupSessionId")
@@ -1118,7 +1096,7 @@ async def meetup_join_complete(data: dict, db: Session = Depends(get_db)):
     post_id = int(post_id)
 
     try:
-        session = stripe.checkout.Session.retrieve(setup_session_id)
+        session = stripe_call(stripe.checkout.Session.retrieve, setup_session_id, expand=["setup_intent"])
         if session.status != "complete":
             raise HTTPException(status_code=403, detail="カード登録が完了していません")
     except stripe.error.StripeError:
@@ -1157,13 +1135,15 @@ async def meetup_join_complete(data: dict, db: Session = Depends(get_db)):
         SET stripe_customer_id = :cid
         WHERE user_id = :uid AND post_id = :pid
     """), {"cid": customer_id, "uid": user_id, "pid": post_id})
+    remember_checkout_payment_method(db, session)
 
+    invalidate_membership(db, post_id)
     db.commit()
     return {"status": "joined", "content": content}
 
 
 @router.post("/stripe/meetup-waitlist-join")
-async def meetup_waitlist_join(data: dict, db: Session = Depends(get_db)):
+def meetup_waitlist_join(data: dict, db: Session = Depends(get_db)):
     user_id = data.get("userId")
     post_id = data.get("postId")
     if not user_id or not post_id:
@@ -1195,23 +1175,22 @@ async def meetup_waitlist_join(data: dict, db: Session = Depends(get_db)):
 
     if response.stripe_customer_id and discount_fee > 0:
         try:
-            pms = stripe.PaymentMethod.list(
-                customer=response.stripe_customer_id, type="card"
-            )
-            if pms.data:
-                stripe.PaymentIntent.create(
-                    amount=discount_fee,
-                    currency="jpy",
-                    customer=response.stripe_customer_id,
-                    payment_method=pms.data[0].id,
-                    confirm=True,
-                    off_session=True,
-                    metadata={
-                        "user_id": str(user_id),
-                        "post_id": str(post_id),
-                        "product": "meetup_waitlist_fee",
-                    },
-                )
+            charged = charge_saved_card(db, response.stripe_customer_id, lambda pm_id: stripe_call(
+                stripe.PaymentIntent.create,
+                idempotency_key=f"meetup_waitlist_fee:{post_id}:{user_id}:{pm_id}",
+                amount=discount_fee,
+                currency="jpy",
+                customer=response.stripe_customer_id,
+                payment_method=pm_id,
+                confirm=True,
+                off_session=True,
+                metadata={
+                    "user_id": str(user_id),
+                    "post_id": str(post_id),
+                    "product": "meetup_waitlist_fee",
+                },
+            ))
+            if charged:
                 db.execute(text("""
                     UPDATE post_responses
                     SET content = 'Join!', cancel_charged_at = NOW()
@@ -1220,6 +1199,7 @@ async def meetup_waitlist_join(data: dict, db: Session = Depends(get_db)):
                 db.commit()
                 return {"status": "joined", "charged": discount_fee}
         except stripe.error.StripeError as e:
+            db.commit()  # 外れていたカードの削除は残す
             raise HTTPException(status_code=500, detail=str(e))
 
     if discount_fee == 0:
@@ -1240,7 +1220,7 @@ async def meetup_waitlist_join(data: dict, db: Session = Depends(get_db)):
     db.commit()
 
     try:
-        session = stripe.checkout.Session.create(
+        session = stripe_call(stripe.checkout.Session.create,
             customer=customer_id,
             payment_method_types=["card"],
             mode="setup",
@@ -1265,7 +1245,7 @@ async def meetup_waitlist_join(data: dict, db: Session = Depends(get_db)):
 # M-2. 主催者「開催決定」→ 参加者全員に課金（主催者95% / 運営5%）
 # -------------------------------------------------------
 @router.post("/stripe/meetup-confirm")
-async def meetup_confirm(data: dict, db: Session = Depends(get_db)):
+def meetup_confirm(data: dict, db: Session = Depends(get_db)):
     """
     主催者が「開催決定」を押したとき。
     参加費ありの参加者全員のカードに一斉課金する。
@@ -1309,86 +1289,16 @@ async def meetup_confirm(data: dict, db: Session = Depends(get_db)):
     organizer_amount = int(fee * (1 - MEETUP_COMMISSION_RATE))  # 参加費の95%
     commission_amount = fee - organizer_amount                   # 運営取り分5%
 
-    participants = db.execute(text("""
-        SELECT pr.user_id, pr.stripe_customer_id
-        FROM post_responses pr
-        WHERE pr.post_id = :pid
-          AND pr.is_participation = true
-          AND pr.stripe_customer_id IS NOT NULL
-          AND pr.cancel_charged_at IS NULL
-    """), {"pid": post_id}).fetchall()
-
-    charged = []
-    failed  = []
+    # 参加者ごとの課金状態を保存しながら並行して課金する（logics/meetup_charges.py）。
+    # 途中で止まっても、もう一度「開催決定」を押すか定期ジョブで続きから再開する。
+    run = start_charge_run(db, post_id, organizer_id, fee, organizer_amount, commission_amount)
+    process_charge_run(db, run.id)
+    summary = charge_run_summary(db, run)
 
-    for p in participants:
-        try:
-            pms = stripe.PaymentMethod.list(
-                customer=p.stripe_customer_id, type="card"
-            )
-            if not pms.data:
-                failed.append({"user_id": p.user_id, "reason": "no_card"})
-                continue
-
-            pm_id = pms.data[0].id
-
-            # PaymentIntent で課金（全額）
-            pi_params: dict = {
-                "amount": fee,
-                "currency": "jpy",
-                "customer": p.stripe_customer_id,
-                "payment_method": pm_id,
-                "confirm": True,
-                "off_session": True,
-                "metadata": {
-                    "user_id":           str(p.user_id),
-                    "post_id":           str(post_id),
-                    "product":           "meetup_fee",
-                    "organizer_id":      str(organizer_id),
-                    "organizer_amount":  str(organizer_amount),
-                    "commission_amount": str(commission_amount),
-                },
-            }
-
-            # ✅ Stripe Connect設定済みの場合：主催者アカウントへ95%をTransfer
-            # 環境変数 STRIPE_CONNECT_ACCOUNT_ID が設定されていれば自動Transfer
-            organizer = db.execute(
-                text("SELECT stripe_connect_account_id, stripe_connect_onboarded FROM users WHERE id = :uid"),
-                {"uid": organizer_id}
-            ).fetchone()
-
-            if organizer and organizer.stripe_connect_account_id and organizer.stripe_connect_onboarded:
-                pi_params["transfer_data"] = {
-                    "amount": organizer_amount,
-                    "destination": organizer.stripe_connect_account_id,
-                }
-
-            pi = stripe.PaymentIntent.create(**pi_params)
-            charged.append({
-                "user_id":           p.user_id,
-                "payment_intent_id": pi.id,
-                "charged":           fee,
-                "organizer_gets":    organizer_amount,
-                "commission":        commission_amount,
-            })
-
-        except stripe.error.StripeError as e:
-            failed.append({"user_id": p.user_id, "reason": str(e)})
-
-    db.execute(text("""
-        UPDATE hobby_posts
-        SET meetup_confirmed_at = NOW()
-        WHERE id = :pid
-    """), {"pid": post_id})
-    db.commit()
-    
     return {
-        "status":            "confirmed",
-        "charged":           len(charged),
-        "failed":            len(failed),
+        **summary,
         "organizer_rate":    f"{int((1 - MEETUP_COMMISSION_RATE) * 100)}%",
         "commission_rate":   f"{int(MEETUP_COMMISSION_RATE * 100)}%",
-        "details":           {"charged": charged, "failed": failed},
     }
 
 
@@ -1396,7 +1306,7 @@ async def meetup_confirm(data: dict, db: Session = Depends(get_db)):
 # M-3. 参加者キャンセル（24時間前まで無料）
 # -------------------------------------------------------
 @router.post("/stripe/meetup-cancel")
-async def meetup_cancel(data: dict, db: Session = Depends(get_db)):
+def meetup_cancel(data: dict, db: Session = Depends(get_db)):
     """
     参加者がキャンセルするとき。
     ✅ 開催24時間前より前   → 無料キャンセル
@@ -1454,23 +1364,22 @@ async def meetup_cancel(data: dict, db: Session = Depends(get_db)):
         if fee > 0:
             cancel_fee = fee // 2
             try:
-                pms = stripe.PaymentMethod.list(
-                    customer=response.stripe_customer_id, type="card"
-                )
-                if pms.data:
-                    stripe.PaymentIntent.create(
-                        amount=cancel_fee,
-                        currency="jpy",
-                        customer=response.stripe_customer_id,
-                        payment_method=pms.data[0].id,
-                        confirm=True,
-                        off_session=True,
-                        metadata={
-                            "user_id": str(user_id),
-                            "post_id": str(post_id),
-                            "product": "meetup_cancel_fee",
-                        },
-                    )
+                charged = charge_saved_card(db, response.stripe_customer_id, lambda pm_id: stripe_call(
+                    stripe.PaymentIntent.create,
+                    idempotency_key=f"meetup_cancel_fee:{post_id}:{user_id}:{pm_id}",
+                    amount=cancel_fee,
+                    currency="jpy",
+                    customer=response.stripe_customer_id,
+                    payment_method=pm_id,
+                    confirm=True,
+                    off_session=True,
+                    metadata={
+                        "user_id": str(user_id),
+                        "post_id": str(post_id),
+                        "product": "meetup_cancel_fee",
+                    },
+                ))
+                if charged:
                     db.execute(text("""
                         UPDATE post_responses
                         SET cancel_charged_at = NOW()
@@ -1481,6 +1390,7 @@ async def meetup_cancel(data: dict, db: Session = Depends(get_db)):
 
     # 参加レコード削除
     db.execute(text("DELETE FROM post_responses WHERE id = :rid"), {"rid": response.id})
+    invalidate_membership(db, post_id)
 
     # キャンセル待ち全員に通知
     waitlist = db.execute(text("""
@@ -1498,42 +1408,23 @@ async def meetup_cancel(data: dict, db: Session = Depends(get_db)):
             ).fetchone()
 
     for w in waitlist:
+                # 通知・メールはまとめ通知で送る（同じ人に短時間で何通も送らない）
                 try:
-                    db.execute(text("""
-                        INSERT INTO notifications
-                            (recipient_id, sender_id, hobby_category_id, message, event_post_id, is_read)
-                        VALUES (:recipient, :sender, :cat_id, :msg, :post_id, false)
-                    """), {
-                        "recipient": w.user_id,
-                        "sender":    post_info.user_id,
-                        "cat_id":    post_info.hobby_category_id,
-                        "msg":       "キャンセルが出ました！参加できますか？",
-                        "post_id":   post_id,
-                    })
+                    enqueue_notification(
+                        db,
+                        recipient_id=w.user_id,
+                        sender_id=post_info.user_id,
+                        hobby_category_id=post_info.hobby_category_id,
+                        message="キャンセルが出ました！参加できますか？",
+                        kind=KIND_WAITLIST,
+                        event_post_id=post_id,
+                        email=True,
+                        dedupe_key=f"waitlist:{post_id}",
+                    )
                     waitlist_count += 1
                 except Exception:
                     pass
 
-                # ↓ここから追加（メール通知）
-                try:
-                    waitlist_user = db.execute(
-                        text("SELECT email, nickname FROM users WHERE id = :uid"),
-                        {"uid": w.user_id}
-                    ).fetchone()
-                    if waitlist_user and waitlist_user.email:
-                        import asyncio
-                        from ..utils.email import send_email, meetup_waitlist_notification_html
-                        asyncio.create_task(send_email(
-                            to=waitlist_user.email,
-                            subject="【推し道】MEETUPにキャンセルが出ました！",
-                            html=meetup_waitlist_notification_html(
-                                waitlist_user.nickname or "",
-                                f"MEETUP (ID: {post_id})",
-                            ),
-                        ))
-                except Exception as e:
-                    print(f"メール送信エラー: {e}")
-
     db.commit()
 
     return {
@@ -1548,7 +1439,7 @@ async def meetup_cancel(data: dict, db: Session = Depends(get_db)):
 # M-3b. 主催者キャンセル（期限チェック付き）
 # -------------------------------------------------------
 @router.post("/stripe/meetup-organizer-cancel")
-async def meetup_organizer_cancel(data: dict, db: Session = Depends(get_db)):
+def meetup_organizer_cancel(data: dict, db: Session = Depends(get_db)):
     """
     主催者がMEETUP自体をキャンセルするとき。
     ✅ 開催24時間前より前 → キャンセル可能（参加者全員に通知・返金）
@@ -1605,12 +1496,12 @@ async def meetup_organizer_cancel(data: dict, db: Session = Depends(get_db)):
         # 既に課金済みの参加者には返金
         if p.cancel_charged_at and p.stripe_customer_id:
             try:
-                pis = stripe.PaymentIntent.list(customer=p.stripe_customer_id, limit=5)
+                pis = stripe_call(stripe.PaymentIntent.list, customer=p.stripe_customer_id, limit=5)
                 for pi in pis.data:
                     if (pi.metadata.get("post_id") == str(post_id)
                             and pi.metadata.get("product") == "meetup_fee"
                             and pi.status == "succeeded"):
-                        stripe.Refund.create(payment_intent=pi.id)
+                        stripe_call(stripe.Refund.create, payment_intent=pi.id, idempotency_key=f"refund:{pi.id}")
                         refunded.append(p.user_id)
                         break
             except stripe.error.StripeError:
@@ -1622,17 +1513,16 @@ async def meetup_organizer_cancel(data: dict, db: Session = Depends(get_db)):
             {"pid": post_id}
         ).fetchone()
         try:
-            db.execute(text("""
-                INSERT INTO notifications
-                    (recipient_id, sender_id, hobby_category_id, message, event_post_id, is_read)
-                VALUES (:recipient, :sender, :cat_id, :msg, :post_id, false)
-            """), {
-                "recipient": p.user_id,
-                "sender":    organizer_id,
-                "cat_id":    post_info.hobby_category_id,
-                "msg":       "主催者によりMEETUPがキャンセルされました。",
-                "post_id":   post_id,
-            })
+            enqueue_notification(
+                db,
+                recipient_id=p.user_id,
+                sender_id=organizer_id,
+                hobby_category_id=post_info.hobby_category_id,
+                message="主催者によりMEETUPがキャンセルされました。",
+                kind=KIND_MEETUP,
+                event_post_id=post_id,
+                dedupe_key=f"meetup_cancel:{post_id}",
+            )
         except Exception:
             pass
 
@@ -1642,6 +1532,7 @@ async def meetup_organizer_cancel(data: dict, db: Session = Depends(get_db)):
         SET meetup_status = 'cancelled', is_hidden = false
         WHERE id = :pid
     """), {"pid": post_id})
+    invalidate_membership(db, post_id)
     db.commit()
 
     return {
@@ -1655,7 +1546,7 @@ async def meetup_organizer_cancel(data: dict, db: Session = Depends(get_db)):
 # M-4. No Show マーク
 # -------------------------------------------------------
 @router.post("/stripe/meetup-noshow")
-async def meetup_noshow(data: dict, db: Session = Depends(get_db)):
+def meetup_noshow(data: dict, db: Session = Depends(get_db)):
     post_id   = data.get("postId")
     user_id   = data.get("userId")
     target_id = data.get("targetId")
@@ -1697,30 +1588,32 @@ async def meetup_noshow(data: dict, db: Session = Depends(get_db)):
             fee = 0
 
         if fee > 0:
-            pms = stripe.PaymentMethod.list(customer=response.stripe_customer_id, type="card")
-            if pms.data:
-                try:
-                    stripe.PaymentIntent.create(
-                        amount=fee,
-                        currency="jpy",
-                        customer=response.stripe_customer_id,
-                        payment_method=pms.data[0].id,
-                        confirm=True,
-                        off_session=True,
-                        metadata={
-                            "user_id": str(target_id),
-                            "post_id": str(post_id),
-                            "product": "meetup_noshow_fee",
-                        },
-                    )
-                except stripe.error.StripeError as e:
-                    raise HTTPException(status_code=500, detail=str(e))
+            try:
+                charge_saved_card(db, response.stripe_customer_id, lambda pm_id: stripe_call(
+                    stripe.PaymentIntent.create,
+                    idempotency_key=f"meetup_noshow_fee:{post_id}:{target_id}:{pm_id}",
+                    amount=fee,
+                    currency="jpy",
+                    customer=response.stripe_customer_id,
+                    payment_method=pm_id,
+                    confirm=True,
+                    off_session=True,
+                    metadata={
+                        "user_id": str(target_id),
+                        "post_id": str(post_id),
+                        "product": "meetup_noshow_fee",
+                    },
+                ))
+            except stripe.error.StripeError as e:
+                db.commit()  # 外れていたカードの削除は残す
+                raise HTTPException(status_code=500, detail=str(e))
 
         db.execute(text("""
             UPDATE post_responses
             SET is_attended = false, cancel_charged_at = NOW()
             WHERE id = :rid
         """), {"rid": response.id})
+        invalidate_membership(db, post_id)
         db.commit()
         return {"status": "noshow_charged", "amount": fee}
 
@@ -1736,12 +1629,12 @@ async def meetup_noshow(data: dict, db: Session = Depends(get_db)):
         refunded = []
         for p in charged:
             try:
-                pis = stripe.PaymentIntent.list(customer=p.stripe_customer_id, limit=5)
+                pis = stripe_call(stripe.PaymentIntent.list, customer=p.stripe_customer_id, limit=5)
                 for pi in pis.data:
                     if (pi.metadata.get("post_id") == str(post_id)
                             and pi.metadata.get("product") == "meetup_fee"
                             and pi.status == "succeeded"):
-                        stripe.Refund.create(payment_intent=pi.id)
+                        stripe_call(stripe.Refund.create, payment_intent=pi.id, idempotency_key=f"refund:{pi.id}")
                         refunded.append(p.user_id)
                         break
             except stripe.error.StripeError:
@@ -1764,6 +1657,9 @@ async def meetup_noshow(data: dict, db: Session = Depends(get_db)):
 # -------------------------------------------------------
 # 10. Stripe Webhook
 # -------------------------------------------------------
+# 署名を確認して受信箱（stripe_webhook_events）に入れたらすぐ 200 を返す。
+# 中身の反映は定期ジョブ process_webhook_events（logics/stripe_webhooks.py）が
+# apply_webhook_event() を呼んで行う。
 @router.post("/stripe/webhook")
 async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     payload = await request.body()
@@ -1777,6 +1673,16 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
     except (ValueError, stripe.error.SignatureVerificationError):
         raise HTTPException(status_code=400, detail="Webhook署名が無効です")
 
+    # 本文を読むために async だが、DB 処理はイベントループを止めないようスレッドプールで行う
+    await run_in_threadpool(enqueue_webhook_event, db, event)
+    return {"status": "ok"}
+
+
+def apply_webhook_event(event: dict, db: Session):
+    """
+    受信箱のイベント1件を DB に反映する（commit はワーカー側）。
+    同じイベントを2回反映しても結果が変わらないように書くこと。
+    """
     event_type = event["type"]
     stripe_session_obj = event["data"]["object"]
 
@@ -1790,96 +1696,91 @@ async def stripe_webhook(request: Request, db: Session = Depends(get_db)):
             ), {"sid": stripe_session_obj["id"]}).fetchone()
 
             if not already:
-                expires_at = datetime.now(timezone.utc) + timedelta(days=30)
-                try:
-                    db.execute(text("""
-                        INSERT INTO friends_log_purchases
-                            (buyer_user_id, stripe_session_id, purchased_at, expires_at, is_active)
-                        VALUES (:uid, :sid, NOW(), :expires, true)
-                    """), {
-                        "uid": int(user_id),
-                        "sid": stripe_session_obj["id"],
-                        "expires": expires_at,
-                    })
-                    db.commit()
-                except Exception:
-                    db.rollback()
+                expires_at = datetime.fromtimestamp(event["created"], timezone.utc) + timedelta(days=30)
+                db.execute(text("""
+                    INSERT INTO friends_log_purchases
+                        (buyer_user_id, stripe_session_id, purchased_at, expires_at, is_active)
+                    VALUES (:uid, :sid, NOW(), :expires, true)
+                """), {
+                    "uid": int(user_id),
+                    "sid": stripe_session_obj["id"],
+                    "expires": expires_at,
+                })
 
         if product == "friend_manager" and user_id:
             subscription_id = stripe_session_obj.get("subscription")
             extra_count = int(stripe_session_obj.get("metadata", {}).get("extra_count", 0))
             friend_count = int(stripe_session_obj.get("metadata", {}).get("friend_count", 0))
             amount = extra_count * PRICE_PER_FRIEND
-            try:
-                db.execute(text("""
-                    UPDATE friend_manager_subscriptions
-                    SET stripe_subscription_id = :sid,
-                        status = 'active',
-                        friend_count = :fc,
-                        charged_extra_count = :ec,
-                        current_amount = :amt,
-                        updated_at = NOW()
-                    WHERE user_id = :uid
-                """), {
-                    "sid": subscription_id,
-                    "fc": friend_count,
-                    "ec": extra_count,
-                    "amt": amount,
-                    "uid": int(user_id),
-                })
-                db.commit()
-            except Exception:
-                db.rollback()
+            db.execute(text("""
+                UPDATE friend_manager_subscriptions
+                SET stripe_subscription_item_id = CASE
+                        WHEN stripe_subscription_id = :sid THEN stripe_subscription_item_id
+                    END,
+                    stripe_subscription_id = :sid,
+                    status = 'active',
+                    friend_count = :fc,
+                    charged_extra_count = :ec,
+                    current_amount = :amt,
+                    updated_at = NOW()
+                WHERE user_id = :uid
+            """), {
+                "sid": subscription_id,
+                "fc": friend_count,
+                "ec": extra_count,
+                "amt": amount,
+                "uid": int(user_id),
+            })
 
         if stripe_session_obj.get("mode") == "payment":
-            try:
-                db.execute(text("""
-                    INSERT INTO stripe_payments (session_id, user_id, product, amount, paid_at)
-                    VALUES (:session_id, :user_id, :product, :amount, NOW())
-                    ON CONFLICT (session_id) DO NOTHING
-                """), {
-                    "session_id": stripe_session_obj["id"],
-                    "user_id": user_id,
-                    "product": product,
-                    "amount": stripe_session_obj.get("amount_total", 0),
-                })
-                db.commit()
-            except Exception:
-                db.rollback()
+            db.execute(text("""
+                INSERT INTO stripe_payments (session_id, user_id, product, amount, paid_at)
+                VALUES (:session_id, :user_id, :product, :amount, NOW())
+                ON CONFLICT (session_id) DO NOTHING
+            """), {
+                "session_id": stripe_session_obj["id"],
+                "user_id": user_id,
+                "product": product,
+                "amount": stripe_session_obj.get("amount_total", 0),
+            })
+
+    # --- 課金に使うカードの更新（logics/payment_methods.py） ---
+    elif event_type == "setup_intent.succeeded":
+        remember_payment_method(db, stripe_session_obj.get("customer"), stripe_session_obj.get("payment_method"))
+
+    elif event_type == "payment_method.attached":
+        if stripe_session_obj.get("type") == "card":
+            remember_payment_method(db, stripe_session_obj.get("customer"), stripe_session_obj["id"])
+
+    elif event_type == "payment_method.detached":
+        forget_payment_method(db, stripe_session_obj["id"])
+
+    elif event_type == "customer.updated":
+        invoice_settings = stripe_session_obj.get("invoice_settings") or {}
+        remember_payment_method(db, stripe_session_obj["id"], invoice_settings.get("default_payment_method"))
 
     elif event_type == "customer.subscription.deleted":
-        subscription_id = stripe_session_obj.get("id")
-        try:
-            db.execute(text("""
-                UPDATE friend_manager_subscriptions
-                SET status = 'canceled', updated_at = NOW()
-                WHERE stripe_subscription_id = :sid
-            """), {"sid": subscription_id})
-            db.commit()
-        except Exception:
-            db.rollback()
+        db.execute(text("""
+            UPDATE friend_manager_subscriptions
+            SET status = 'canceled', updated_at = NOW()
+            WHERE stripe_subscription_id = :sid
+        """), {"sid": stripe_session_obj.get("id")})
 
     elif event_type == "invoice.payment_failed":
         subscription_id = stripe_session_obj.get("subscription")
         if subscription_id:
-            try:
-                db.execute(text("""
-                    UPDATE friend_manager_subscriptions
-                    SET status = 'past_due', updated_at = NOW()
-                    WHERE stripe_subscription_id = :sid
-                """), {"sid": subscription_id})
-                db.commit()
-            except Exception:
-                db.rollback()
-
-    return {"status": "ok"}
+            db.execute(text("""
+                UPDATE friend_manager_subscriptions
+                SET status = 'past_due', updated_at = NOW()
+                WHERE stripe_subscription_id = :sid
+            """), {"sid": subscription_id})
 
 
 # -------------------------------------------------------
 # 11. 今月の課金サマリー（MyPage用）
 # -------------------------------------------------------
 @router.get("/stripe/billing-summary")
-async def get_billing_summary(user_id: int, db: Session = Depends(get_db)):
+def get_billing_summary(user_id: int, db: Session = Depends(get_db)):
     now = datetime.now(timezone.utc)
     month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
 
@@ -1956,7 +1857,7 @@ async def get_billing_summary(user_id: int, db: Session = Depends(get_db)):
 # -------------------------------------------------------
 
 @router.post("/stripe/connect/onboard")
-async def create_connect_onboard(data: dict, db: Session = Depends(get_db)):
+def create_connect_onboard(data: dict, db: Session = Depends(get_db)):
     """
     主催者がStripe Connectアカウントを作成してオンボーディングするURL発行。
     """
@@ -1979,7 +1880,7 @@ async def create_connect_onboard(data: dict, db: Session = Depends(get_db)):
 
     if not connect_account_id:
         # 新規Expressアカウント作成
-        account = stripe.Account.create(
+        account = stripe_call(stripe.Account.create,
             type="express",
             country="JP",
             email=user.email,
@@ -2008,7 +1909,7 @@ async def create_connect_onboard(data: dict, db: Session = Depends(get_db)):
 
     # オンボーディングURL発行
     try:
-        account_link = stripe.AccountLink.create(
+        account_link = stripe_call(stripe.AccountLink.create,
             account=connect_account_id,
             refresh_url=f"{FRONTEND_URL}/profile?connect_refresh=true",
             return_url=f"{FRONTEND_URL}/profile?connect_done=true",
@@ -2020,7 +1921,7 @@ async def create_connect_onboard(data: dict, db: Session = Depends(get_db)):
 
 
 @router.get("/stripe/connect/status")
-async def get_connect_status(user_id: int, db: Session = Depends(get_db)):
+def get_connect_status(user_id: int, db: Session = Depends(get_db)):
     """
     主催者のConnect状態を確認する。
     """
@@ -2034,7 +1935,7 @@ async def get_connect_status(user_id: int, db: Session = Depends(get_db)):
 
     # Stripeから最新状態を確認
     try:
-        account = stripe.Account.retrieve(user.stripe_connect_account_id)
+        account = stripe_call(stripe.Account.retrieve, user.stripe_connect_account_id)
         is_ready = (
             account.charges_enabled and 
             account.payouts_enabled and
@@ -1,9 +1,10 @@
 import enum
-from fastapi import APIRouter, Depends, HTTPException, status, Query 
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import func, desc, or_
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel, BaseModel as PydanticBase, ConfigDict
 
 from .. import models, schemas
@@ -11,6 +12,11 @@ from ..database import get_db
 from .auth import get_current_user 
 from ..utils.security import get_password_hash
 from ..schemas import MoodLogResponse, UserPublic
+from ..logics.friend_moods import get_friend_moods, invalidate_friends_of
+from ..logics.mood_rollup import record_mood, mood_stats, MOOD_TYPES
+from ..logics.friend_graph import remove_user as remove_user_from_graph
+from ..logics.friend_suggestions import get_friend_suggestions
+from ..logics.community_mood import record_community_mood, community_moods, COMMUNITY_MOOD_MAX_HOURS
 
 # ▼ 自動グループ作成ロジック
 from .community import check_and_create_region_group 
@@ -74,6 +80,7 @@ def update_user_me(user_update: schemas.UserProfileUpdate, db: Session = Depends
             setattr(current_user, "hashed_password", get_password_hash(value))
         elif hasattr(current_user, key):
             setattr(current_user, key, value)
+    invalidate_friends_of(db, current_user.id)  # ニックネーム・コメント公開設定は友達のボードに出る
     db.commit()
     db.refresh(current_user)
     return current_user
@@ -94,19 +101,79 @@ def update_my_mood(
     current_user.current_mood         = mood_data.mood_type
     current_user.current_mood_comment = mood_data.comment
     current_user.mood_updated_at      = func.now()
+    record_mood(db, current_user.id, mood_data.mood_type, mood_data.category)
+    record_community_mood(db, current_user, mood_data.mood_type)
+    invalidate_friends_of(db, current_user.id)
     db.commit()
     db.refresh(current_user)
     return current_user
 
 
+# --- 気分履歴（グラフ用） ---
+# format=compact では列ごとの配列で返す（グラフ描画用。通常形式の 1/10 程度のサイズ）:
+#   {"format": "compact-v1", "moods": [気分の一覧], "id": [...], "t": [UNIX秒],
+#    "m": [moods の添字], "comments": {"行番号": コメント}, "categories": {"行番号": カテゴリ},
+#    "hidden": [is_visible=False の行番号]}
+# どちらの形式も ETag（最新ログID + 件数）を付け、If-None-Match が一致すれば 304 を返す。
+MOOD_HISTORY_DAYS = 90
+MOOD_HISTORY_LIMIT = 1000
+MOOD_CODES = {m: i for i, m in enumerate(MOOD_TYPES)}
+
+def _mood_history(db: Session, user_id: int, request: Request, response: Response, fmt: str):
+    since = datetime.now() - timedelta(days=MOOD_HISTORY_DAYS)
+    Log = models.MoodLog
+    window = (Log.user_id == user_id, Log.created_at >= since)
+
+    latest_id, count = db.query(func.max(Log.id), func.count(Log.id)).filter(*window).one()
+    etag = f'W/"mood-{user_id}-{latest_id or 0}-{min(count, MOOD_HISTORY_LIMIT)}-{fmt}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    rows = db.query(Log.id, Log.mood_type, Log.comment, Log.is_visible, Log.created_at, Log.category).filter(
+        *window
+    ).order_by(Log.created_at.desc()).limit(MOOD_HISTORY_LIMIT).all()
+
+    if fmt != "compact":
+        response.headers["ETag"] = etag
+        return rows
+
+    payload = {
+        "format": "compact-v1",
+        "moods": list(MOOD_CODES),
+        "id": [r.id for r in rows],
+        "t": [int((r.created_at if r.created_at.tzinfo else r.created_at.replace(tzinfo=timezone.utc)).timestamp())
+              for r in rows],
+        "m": [MOOD_CODES.get(getattr(r.mood_type, "value", r.mood_type), -1) for r in rows],
+        "comments": {str(i): r.comment for i, r in enumerate(rows) if r.comment},
+        "categories": {str(i): r.category for i, r in enumerate(rows) if r.category},
+        "hidden": [i for i, r in enumerate(rows) if not r.is_visible],
+    }
+    return JSONResponse(payload, headers={"ETag": etag})
+
 @router.get("/me/mood-history", response_model=List[schemas.MoodLogResponse])
-def get_my_mood_history(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    three_months_ago = datetime.now() - timedelta(days=90)
-    return db.query(models.MoodLog).filter(models.MoodLog.user_id == current_user.id, models.MoodLog.created_at >= three_months_ago).order_by(models.MoodLog.created_at.desc()).limit(1000).all()
+def get_my_mood_history(
+    request: Request,
+    response: Response,
+    fmt: str = Query("full", alias="format", pattern="^(full|compact)$"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    return _mood_history(db, current_user.id, request, response, fmt)
+
+@router.get("/me/mood-stats")
+def get_my_mood_stats(
+    days: int = Query(30, ge=1, le=365, description="集計期間（日）。7 / 30 / 90 など"),
+    category: Optional[str] = Query(None, description="指定するとそのカテゴリの気分だけを集計"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # 生ログではなく日別集計（mood_daily_rollup）から計算する
+    return mood_stats(db, current_user.id, days=days, category=category)
 
 @router.patch("/me/mood-visibility")
 def toggle_mood_visibility(is_visible: bool, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     current_user.is_mood_visible = is_visible
+    invalidate_friends_of(db, current_user.id)
     db.commit()
     return {"message": "設定を更新しました"}
 
@@ -114,6 +181,15 @@ def toggle_mood_visibility(is_visible: bool, db: Session = Depends(get_db), curr
 def read_my_notifications(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user), limit: int = 20, offset: int = 0):
     return db.query(models.Notification).filter(models.Notification.recipient_id == current_user.id).order_by(desc(models.Notification.created_at)).offset(offset).limit(limit).all()
 
+@router.get("/me/friend-suggestions", response_model=List[schemas.FriendSuggestionResponse])
+def read_my_friend_suggestions(
+    limit: int = Query(20, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # 共通の友達・共通のコミュニティ・地域から計算したおすすめ（毎晩更新）
+    return get_friend_suggestions(db, current_user.id, limit=limit)
+
 @router.get("/search", response_model=List[schemas.UserPublic])
 def search_users(query: str = Query(..., min_length=1), db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     search_pattern = f"%{query}%"
@@ -210,48 +286,19 @@ def delete_my_tag(
 
 @router.get("/following/moods", response_model=List[UserMoodResponse])
 def get_following_moods(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    # 1. 自分が登録している友達関係を取得
-    friendships = db.query(models.Friendship).filter(
-        models.Friendship.user_id == current_user.id,
-    ).all()
-
-    # 友達がいない場合は、即座に空のリストを返す（Noneを返すとエラーになります）
-    if not friendships:
-        return []
-
-    friend_ids = [f.friend_id for f in friendships]
-    friendship_map = {f.friend_id: f for f in friendships}
-
-    # 2. 全体公開設定がONのユーザーのみ取得
-    users = db.query(models.User).filter(
-        models.User.id.in_(friend_ids),
-        models.User.is_mood_visible == True
-    ).all()
-
-    # 3. 返却用のリストを作成
-    results = []
-    for user in users:
-        fs = friendship_map.get(user.id)
-
-        # 【送り手優先】コメント非公開設定ならコメントをNoneにする
-        is_comment_ok = getattr(user, "is_mood_comment_visible", True)
-        final_comment = user.current_mood_comment if is_comment_ok else None
-
-        results.append({
-            "user_id": user.id,
-            "nickname": user.nickname,
-            "username": user.username,
-            "email": user.email,
-            "current_mood": user.current_mood,
-            "current_mood_comment": final_comment,
-            "mood_updated_at": user.mood_updated_at,
-            "is_mood_comment_visible": bool(is_comment_ok),
-            "friend_note": fs.friend_note if fs else None,
-            "is_muted": bool(fs.is_muted) if fs else False,
-        })
-    
-    # 4. 最後に必ずリスト（results）を返す
-    return results
+    # 友達の気分ボードはキャッシュから返す（気分の投稿・友達関係の変更で破棄される）
+    return get_friend_moods(db, current_user.id)
+
+@router.get("/community-moods")
+def get_community_moods(
+    scope: str = Query("hobby", pattern="^(hobby|pref|city)$"),
+    hours: int = Query(24, ge=1, le=COMMUNITY_MOOD_MAX_HOURS),
+    key: Optional[str] = Query(None, max_length=160),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    # 趣味（マスター）・都道府県・市区町村ごとの気分（集計済みのバケットから計算）
+    return community_moods(db, scope, hours=hours, key=key)
 
 # ==========================================
 # 💡 ID指定の操作 (末尾に置く)
@@ -269,13 +316,19 @@ def read_user(user_id: int, db: Session = Depends(get_db), current_user: models.
     return user
 
 @router.get("/{user_id}/mood-history", response_model=List[schemas.MoodLogResponse])
-def get_user_mood_history(user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+def get_user_mood_history(
+    user_id: int,
+    request: Request,
+    response: Response,
+    fmt: str = Query("full", alias="format", pattern="^(full|compact)$"),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
     target_user = db.query(models.User).filter(models.User.id == user_id).first()
     if not target_user: raise HTTPException(status_code=404, detail="見つかりません")
     if current_user.id != target_user.id and not target_user.is_mood_visible:
         raise HTTPException(status_code=403, detail="権限がありません")
-    three_months_ago = datetime.now() - timedelta(days=90)
-    return db.query(models.MoodLog).filter(models.MoodLog.user_id == user_id, models.MoodLog.created_at >= three_months_ago).order_by(models.MoodLog.created_at.desc()).limit(1000).all()
+    return _mood_history(db, user_id, request, response, fmt)
 
 @router.post("/{user_id}/follow")
 def follow_user(user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
@@ -295,6 +348,8 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: model
     user = db.query(models.User).filter(models.User.id == user_id).first()
     if not user: raise HTTPException(status_code=404)
     if user.id != current_user.id: raise HTTPException(status_code=403)
+    invalidate_friends_of(db, user.id)
+    remove_user_from_graph(db, user.id)
     db.delete(user)
     db.commit()
     return
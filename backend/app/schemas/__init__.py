@@ -2,7 +2,7 @@
 # app.schemas.〇〇 として参照できるようにする。
 
 # User/Auth
-from .users import UserCreate, UserPublic, UserMe, UserProfileUpdate, MoodLogCreate, MoodLogResponse, NotificationResponse
+from .users import UserCreate, UserPublic, UserMe, UserProfileUpdate, MoodLogCreate, MoodLogResponse, NotificationResponse, FriendSuggestionResponse
 from .auth import Token, TokenData
 
 # Access Logs
@@ -20,4 +20,19 @@ from .posts import HobbyPostCreate, HobbyPostResponse, PostResponseCreate, PostR
 from .hobbies import HobbyCategoryResponse, HobbySearchParams
 
 # 💡 Friend Requests (新規追加)
-from .friend_requests import FriendRequestBase, FriendRequestUpdate, FriendRequestResponse, FriendStatusUpdate, FriendshipResponse, FriendshipUpdate
\ No newline at end of file
+from .friend_requests import FriendRequestBase, FriendRequestUpdate, FriendRequestResponse, FriendStatusUpdate, FriendshipResponse, FriendshipUpdate
+
+# 再エクスポートするスキーマ（schemas.〇〇 で参照されるもの）
+__all__ = [
+    "UserCreate", "UserPublic", "UserMe", "UserProfileUpdate", "MoodLogCreate", "MoodLogResponse",
+    "NotificationResponse", "FriendSuggestionResponse",
+    "Token", "TokenData",
+    "AccessLogCreate", "AccessLogUpdate", "AccessLogRead", "UsageAnalytics",
+    "BranchCreate", "BranchResponse", "EventCreate", "EventResponse",
+    "SeatCreate", "SeatResponse", "ReservationCreate", "ReservationResponse",
+    "InvoiceCreate", "InvoiceRead", "SubscriptionCreate", "SubscriptionResponse",
+    "HobbyPostCreate", "HobbyPostResponse", "PostResponseCreate", "PostResponseResponse", "AllPostCreate",
+    "HobbyCategoryResponse", "HobbySearchParams",
+    "FriendRequestBase", "FriendRequestUpdate", "FriendRequestResponse", "FriendStatusUpdate",
+    "FriendshipResponse", "FriendshipUpdate",
+]
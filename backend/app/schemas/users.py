@@ -114,6 +114,13 @@ class UserPublic(BaseModel):
     
     model_config = ConfigDict(from_attributes=True)
 
+class FriendSuggestionResponse(BaseModel):
+    """3-3. 友達のおすすめ (GET /users/me/friend-suggestions)"""
+    user: UserPublic
+    score: float
+    mutual_friends: int        # 共通の友達の数
+    shared_communities: int    # 共通のコミュニティの数
+
 class UserMe(UserPublic):
     """3-2. ログインユーザー本人用の全情報 (GET /users/me)"""
     email: EmailStr
@@ -0,0 +1,51 @@
+import codecs
+import csv
+import io
+from typing import Any, Callable, Iterator, Sequence
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import TextClause
+
+from ..database import SessionLocal
+
+# --------------------------------------------------
+# 💡 CSV のストリーミング出力
+# --------------------------------------------------
+# 全行をメモリに載せずに、サーバーサイドカーソル（yield_per）で chunk_rows 行ずつ読み、
+# CSV にしてそのままクライアントへ流す。BOM（Excel 用）は先頭で1回だけ付ける。
+# レスポンス送信中もセッションを使うので、リクエストの db ではなく専用のセッションを開く。
+
+CSV_CHUNK_ROWS = 500
+
+
+def iter_query_csv(
+    query: TextClause,
+    params: dict,
+    header: Sequence[str],
+    to_row: Callable[[Any], Sequence[Any]],
+    chunk_rows: int = CSV_CHUNK_ROWS,
+) -> Iterator[bytes]:
+    """query の結果を CSV（UTF-8 BOM 付き）のバイト列として少しずつ返す"""
+    db = SessionLocal()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        yield codecs.BOM_UTF8 + buffer.getvalue().encode("utf-8")
+
+        result = db.execute(query.execution_options(yield_per=chunk_rows), params)
+        for rows in result.partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(to_row(row) for row in rows)
+            yield buffer.getvalue().encode("utf-8")
+    finally:
+        db.close()
+
+
+def csv_response(chunks: Iterator[bytes], filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
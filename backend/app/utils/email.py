@@ -77,6 +77,27 @@ def meetup_waitlist_notification_html(nickname: str, meetup_title: str) -> str:
     </div>
     """
 
+def meetup_waitlist_digest_html(nickname: str, meetup_titles: list) -> str:
+    items = "".join(f'<li style="font-weight:700;">{t}</li>' for t in meetup_titles)
+    return f"""
+    <div style="font-family:sans-serif;max-width:480px;margin:0 auto;padding:32px 24px;">
+      <h2 style="color:#FF4D8D;">キャンセルが出ました！</h2>
+      <p>{nickname} さん、キャンセル待ちのMEETUP {len(meetup_titles)}件に空きが出ました。</p>
+      <ul>{items}</ul>
+      <p>アプリから参加手続きをお早めに！<br>
+         先着順のため、お急ぎください。</p>
+      <a href="https://osidou.com"
+         style="display:inline-block;margin-top:16px;padding:12px 28px;
+                background:#FF4D8D;color:#fff;border-radius:40px;
+                text-decoration:none;font-weight:700;">
+        今すぐ確認する →
+      </a>
+      <p style="margin-top:32px;font-size:12px;color:#999;">
+        ※ このメールは自動送信です。返信はできません。
+      </p>
+    </div>
+    """
+
 def password_reset_email_html(nickname: str, reset_url: str) -> str:
     return f"""
     <div style="font-family:sans-serif;max-width:480px;margin:0 auto;padding:32px 24px;">
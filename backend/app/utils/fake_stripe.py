@@ -0,0 +1,446 @@
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import stripe
+
+# --------------------------------------------------
+# 💡 ローカル用の Stripe 代替（プロセス内の偽トランスポート）
+# --------------------------------------------------
+# STRIPE_FAKE=true のとき stripe_gateway が stripe.default_http_client をこれに差し替える。
+# Stripe SDK はそのまま使い、HTTP の送受信だけをメモリ上の偽 Stripe で受ける。
+# そのため stripe_call() のタイムアウト・再試行・冪等キーや、SDK のエラー変換
+# （CardError / APIError / APIConnectionError）もそのまま通る。
+# STRIPE_SECRET_KEY はダミー（例: sk_test_fake）でよい。
+#
+# 再現しているのは stripe_payment.py などで使っているエンドポイントだけ:
+#   customers / checkout/sessions / payment_intents / payment_methods / prices /
+#   subscriptions / refunds / accounts / account_links
+# Checkout Session は作成した時点で「完了済み」として扱う（ブラウザでの入力を省略）。
+#   setup        → SetupIntent とカードを作って顧客に紐付ける
+#   subscription → サブスクリプションを作る
+#   payment      → 支払い済み（payment_status = paid）
+# 同じ冪等キーの POST には最初の結果をそのまま返す（本物の Stripe と同じ）。
+#
+# 遅延と障害は環境変数で入れられる（ベンチマークや障害試験用）:
+#   FAKE_STRIPE_LATENCY_MS          1回の呼び出しの遅延（ミリ秒）
+#   FAKE_STRIPE_JITTER_MS           遅延のばらつき（0〜この値をランダムに足す）
+#   FAKE_STRIPE_ERROR_RATE          503 を返す割合（0〜1）
+#   FAKE_STRIPE_CONNECTION_ERROR_RATE  通信エラーにする割合（0〜1）
+#   FAKE_STRIPE_DECLINE_RATE        off_session 課金でカードを拒否する割合（0〜1）
+# 状態はプロセス内だけ。再起動すると消える。
+
+FAKE_STRIPE_LATENCY_MS = float(os.getenv("FAKE_STRIPE_LATENCY_MS", "0"))
+FAKE_STRIPE_JITTER_MS = float(os.getenv("FAKE_STRIPE_JITTER_MS", "0"))
+FAKE_STRIPE_ERROR_RATE = float(os.getenv("FAKE_STRIPE_ERROR_RATE", "0"))
+FAKE_STRIPE_CONNECTION_ERROR_RATE = float(os.getenv("FAKE_STRIPE_CONNECTION_ERROR_RATE", "0"))
+FAKE_STRIPE_DECLINE_RATE = float(os.getenv("FAKE_STRIPE_DECLINE_RATE", "0"))
+
+FAKE_CHECKOUT_URL = "https://checkout.stripe.test/c/pay"
+
+
+class _FakeError(Exception):
+    """偽 Stripe の API エラー（Stripe と同じ形の JSON で返す）"""
+
+    def __init__(self, status: int, error_type: str, message: str, **extra):
+        super().__init__(message)
+        self.status = status
+        self.body = {"error": {"type": error_type, "message": message, **extra}}
+
+
+def _missing(kind: str, object_id: str) -> _FakeError:
+    return _FakeError(404, "invalid_request_error", f"No such {kind}: '{object_id}'",
+                      code="resource_missing")
+
+
+def _decode_params(raw: Optional[str]) -> Dict[str, Any]:
+    """Stripe のフォーム形式（a[b][0][c]=1）をネストした dict / list に戻す"""
+    params: Dict[str, Any] = {}
+    for key, value in parse_qsl(raw or "", keep_blank_values=True):
+        parts = key.replace("]", "").split("[")
+        node = params
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return _listify(params)
+
+
+def _listify(node: Any) -> Any:
+    if not isinstance(node, dict):
+        return node
+    items = {k: _listify(v) for k, v in node.items()}
+    if items and all(k.isdigit() for k in items):
+        return [items[k] for k in sorted(items, key=int)]
+    return items
+
+
+def _as_list(value: Any) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _truthy(value: Any) -> bool:
+    return str(value).lower() == "true"
+
+
+class FakeStripeClient(stripe.HTTPClient):
+    """メモリ上で Stripe API を再現する HTTP クライアント（stripe.default_http_client 用）"""
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency_ms: float = FAKE_STRIPE_LATENCY_MS,
+        jitter_ms: float = FAKE_STRIPE_JITTER_MS,
+        error_rate: float = FAKE_STRIPE_ERROR_RATE,
+        connection_error_rate: float = FAKE_STRIPE_CONNECTION_ERROR_RATE,
+        decline_rate: float = FAKE_STRIPE_DECLINE_RATE,
+        seed: Optional[int] = None,
+    ):
+        super().__init__()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.connection_error_rate = connection_error_rate
+        self.decline_rate = decline_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """保存しているオブジェクトと呼び出し回数を消す"""
+        with self._lock:
+            self._objects: Dict[str, dict] = {}
+            self._idempotent: Dict[str, Tuple[str, int]] = {}
+            self._by_customer: Dict[Tuple[str, str], List[str]] = {}  # (種類, 顧客ID) → 新しい順のID
+            self._prices_by_lookup_key: Dict[str, str] = {}
+            self.calls: Counter = Counter()  # "POST /v1/payment_intents" → 回数
+
+    # ---------------------------------------------------------------
+    # HTTPClient の実装
+    # ---------------------------------------------------------------
+    def request(self, method, url, headers, post_data=None, *, _usage=None):
+        method = method.lower()
+        parts = urlsplit(url)
+        segments = [s for s in parts.path.split("/") if s][1:]  # 先頭の "v1" を除く
+        params = _decode_params(parts.query if method in ("get", "delete") else post_data)
+        idempotency_key = next(
+            (v for k, v in (headers or {}).items() if k.lower() == "idempotency-key"), None
+        )
+
+        delay_ms = self.latency_ms + self._random.uniform(0, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+        if self._random.random() < self.connection_error_rate:
+            raise stripe.error.APIConnectionError("偽 Stripe: 通信エラー（障害注入）")
+
+        if self._random.random() < self.error_rate:
+            body = {"error": {"type": "api_error", "message": "偽 Stripe: 一時的なエラー（障害注入）"}}
+            return json.dumps(body), 503, self._headers(idempotency_key)
+
+        resource, object_id = self._split(segments)
+        with self._lock:
+            self.calls[f"{method.upper()} /v1/{resource}{'/{id}' if object_id else ''}"] += 1
+            if idempotency_key and idempotency_key in self._idempotent:
+                body, status = self._idempotent[idempotency_key]
+                return body, status, self._headers(idempotency_key)
+            try:
+                status, body = 200, self._route(method, resource, object_id, params)
+            except _FakeError as e:
+                status, body = e.status, e.body
+            raw = json.dumps(body)
+            # 本物と同じく、5xx 以外の結果は冪等キーで再生する
+            if idempotency_key and method == "post":
+                self._idempotent[idempotency_key] = (raw, status)
+        return raw, status, self._headers(idempotency_key)
+
+    def request_stream(self, method, url, headers, post_data=None, *, _usage=None):
+        raise NotImplementedError("偽 Stripe はストリーミングに対応していません")
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _split(segments: List[str]) -> Tuple[str, Optional[str]]:
+        """["checkout", "sessions", "cs_1"] → ("checkout/sessions", "cs_1")"""
+        size = 2 if segments[:1] == ["checkout"] else 1
+        resource = "/".join(segments[:size])
+        return resource, (segments[size] if len(segments) > size else None)
+
+    @staticmethod
+    def _headers(idempotency_key: Optional[str]) -> Dict[str, str]:
+        headers = {"request-id": f"req_{uuid.uuid4().hex[:14]}"}
+        if idempotency_key:
+            headers["idempotency-key"] = idempotency_key
+        return headers
+
+    # ---------------------------------------------------------------
+    # ルーティング（ロックを持った状態で呼ばれる）
+    # ---------------------------------------------------------------
+    def _route(self, method: str, resource: str, object_id: Optional[str], params: dict) -> dict:
+        name = f"_{method}_{resource.replace('/', '_')}{'_id' if object_id else ''}"
+        handler = getattr(self, name, None)
+        if handler is None:
+            path = f"/v1/{resource}{'/' + object_id if object_id else ''}"
+            raise _FakeError(404, "invalid_request_error", f"偽 Stripe は {method.upper()} {path} に対応していません")
+        result = handler(object_id, params) if object_id else handler(params)
+        return self._expand(result, _as_list(params.get("expand")))
+
+    def _new_id(self, prefix: str) -> str:
+        return f"{prefix}_fake{uuid.uuid4().hex[:16]}"
+
+    def _save(self, obj: dict, customer: Optional[str] = None) -> dict:
+        obj.setdefault("created", int(time.time()))
+        obj.setdefault("livemode", False)
+        self._objects[obj["id"]] = obj
+        if customer:
+            self._by_customer.setdefault((obj["object"], customer), []).insert(0, obj["id"])
+        return obj
+
+    def _get(self, kind: str, object_id: str) -> dict:
+        obj = self._objects.get(object_id)
+        if not obj or obj["object"] != kind:
+            raise _missing(kind, object_id)
+        return obj
+
+    def _list(self, objects: List[dict], params: dict, url: str) -> dict:
+        limit = int(params.get("limit", 10))
+        return {"object": "list", "data": objects[:limit], "has_more": len(objects) > limit, "url": url}
+
+    def _customer_objects(self, kind: str, customer: Optional[str]) -> List[dict]:
+        return [self._objects[i] for i in self._by_customer.get((kind, customer), [])]
+
+    def _expand(self, obj: dict, paths: List[str]) -> dict:
+        if not paths:
+            return obj
+        obj = dict(obj)
+        for path in paths:
+            value = obj.get(path)
+            if isinstance(value, str) and value in self._objects:
+                obj[path] = self._objects[value]
+        return obj
+
+    # ---------------------------------------------------------------
+    # 各リソース
+    # ---------------------------------------------------------------
+    def _post_customers(self, params: dict) -> dict:
+        return self._save({
+            "id": self._new_id("cus"),
+            "object": "customer",
+            "email": params.get("email"),
+            "name": params.get("name"),
+            "metadata": params.get("metadata", {}),
+            "invoice_settings": {"default_payment_method": None},
+        })
+
+    def _attach_card(self, customer: str) -> dict:
+        return self._save({
+            "id": self._new_id("pm"),
+            "object": "payment_method",
+            "type": "card",
+            "customer": customer,
+            "card": {"brand": "visa", "last4": "4242", "exp_month": 12, "exp_year": 2099},
+        }, customer)
+
+    def _post_checkout_sessions(self, params: dict) -> dict:
+        session_id = self._new_id("cs_test")
+        mode = params.get("mode", "payment")
+        customer = params.get("customer")
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "mode": mode,
+            "customer": customer,
+            "status": "complete",
+            "payment_status": "paid",
+            "metadata": params.get("metadata", {}),
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+            "url": f"{FAKE_CHECKOUT_URL}/{session_id}",
+            "setup_intent": None,
+            "subscription": None,
+            "payment_intent": None,
+            "amount_total": sum(
+                int(item.get("price_data", {}).get("unit_amount", 0)) * int(item.get("quantity", 1))
+                for item in _as_list(params.get("line_items"))
+            ),
+        }
+        if mode == "setup":
+            if not customer:
+                customer = session["customer"] = self._post_customers({})["id"]
+            card = self._attach_card(customer)
+            session["payment_status"] = "no_payment_required"
+            session["setup_intent"] = self._save({
+                "id": self._new_id("seti"),
+                "object": "setup_intent",
+                "customer": customer,
+                "payment_method": card["id"],
+                "status": "succeeded",
+                "usage": "off_session",
+            })["id"]
+        elif mode == "subscription":
+            card = self._attach_card(customer)
+            subscription = self._post_subscriptions({
+                "customer": customer,
+                "items": params.get("line_items"),
+                "default_payment_method": card["id"],
+                "metadata": params.get("metadata", {}),
+                **params.get("subscription_data", {}),
+            })
+            session["subscription"] = subscription["id"]
+        else:
+            session["payment_intent"] = self._save({
+                "id": self._new_id("pi"),
+                "object": "payment_intent",
+                "amount": session["amount_total"],
+                "currency": "jpy",
+                "customer": customer,
+                "status": "succeeded",
+                "metadata": session["metadata"],
+            }, customer)["id"]
+        return self._save(session)
+
+    def _get_checkout_sessions_id(self, session_id: str, params: dict) -> dict:
+        return self._get("checkout.session", session_id)
+
+    def _post_payment_intents(self, params: dict) -> dict:
+        customer = params.get("customer")
+        payment_method = params.get("payment_method")
+        if payment_method and payment_method not in self._objects:
+            raise _missing("payment_method", payment_method)
+        status = "requires_confirmation"
+        if _truthy(params.get("confirm")):
+            if self._random.random() < self.decline_rate:
+                raise _FakeError(402, "card_error", "Your card was declined.",
+                                 code="card_declined", decline_code="generic_decline")
+            status = "succeeded"
+        return self._save({
+            "id": self._new_id("pi"),
+            "object": "payment_intent",
+            "amount": int(params.get("amount", 0)),
+            "currency": params.get("currency", "jpy"),
+            "customer": customer,
+            "payment_method": payment_method,
+            "status": status,
+            "metadata": params.get("metadata", {}),
+            "transfer_data": params.get("transfer_data"),
+        }, customer)
+
+    def _get_payment_intents(self, params: dict) -> dict:
+        return self._list(self._customer_objects("payment_intent", params.get("customer")),
+                          params, "/v1/payment_intents")
+
+    def _get_payment_methods(self, params: dict) -> dict:
+        return self._list(self._customer_objects("payment_method", params.get("customer")),
+                          params, "/v1/payment_methods")
+
+    def _post_prices(self, params: dict) -> dict:
+        price = self._save({
+            "id": self._new_id("price"),
+            "object": "price",
+            "active": True,
+            "currency": params.get("currency", "jpy"),
+            "unit_amount": int(params.get("unit_amount", 0)),
+            "recurring": params.get("recurring"),
+            "lookup_key": params.get("lookup_key"),
+        })
+        if price["lookup_key"]:
+            self._prices_by_lookup_key[price["lookup_key"]] = price["id"]
+        return price
+
+    def _get_prices(self, params: dict) -> dict:
+        ids = [self._prices_by_lookup_key.get(key) for key in _as_list(params.get("lookup_keys"))]
+        return self._list([self._objects[i] for i in ids if i], params, "/v1/prices")
+
+    def _subscription_item(self, subscription_id: str, item: dict) -> dict:
+        price = item.get("price")
+        if isinstance(price, str) and price not in self._objects:
+            raise _missing("price", price)
+        return {
+            "id": self._new_id("si"),
+            "object": "subscription_item",
+            "subscription": subscription_id,
+            "price": self._objects.get(price) if isinstance(price, str) else price,
+            "quantity": int(item.get("quantity", 1)),
+        }
+
+    def _post_subscriptions(self, params: dict) -> dict:
+        subscription_id = self._new_id("sub")
+        trial_end = params.get("trial_end")
+        return self._save({
+            "id": subscription_id,
+            "object": "subscription",
+            "customer": params.get("customer"),
+            "default_payment_method": params.get("default_payment_method"),
+            "status": "trialing" if trial_end else "active",
+            "trial_end": int(trial_end) if trial_end else None,
+            "cancel_at_period_end": False,
+            "metadata": params.get("metadata", {}),
+            "items": {
+                "object": "list",
+                "data": [self._subscription_item(subscription_id, item) for item in _as_list(params.get("items"))],
+                "has_more": False,
+                "url": f"/v1/subscription_items?subscription={subscription_id}",
+            },
+        }, params.get("customer"))
+
+    def _get_subscriptions_id(self, subscription_id: str, params: dict) -> dict:
+        return self._get("subscription", subscription_id)
+
+    def _post_subscriptions_id(self, subscription_id: str, params: dict) -> dict:
+        subscription = self._get("subscription", subscription_id)
+        for change in _as_list(params.get("items")):
+            current = next((i for i in subscription["items"]["data"] if i["id"] == change.get("id")), None)
+            if current is None:
+                subscription["items"]["data"].append(self._subscription_item(subscription_id, change))
+                continue
+            if change.get("price"):
+                current["price"] = self._get("price", change["price"])
+            if change.get("quantity") is not None:
+                current["quantity"] = int(change["quantity"])
+        if "cancel_at_period_end" in params:
+            subscription["cancel_at_period_end"] = _truthy(params["cancel_at_period_end"])
+        if "metadata" in params:
+            subscription["metadata"].update(params["metadata"])
+        return subscription
+
+    def _post_refunds(self, params: dict) -> dict:
+        payment_intent = self._get("payment_intent", params.get("payment_intent", ""))
+        return self._save({
+            "id": self._new_id("re"),
+            "object": "refund",
+            "amount": int(params.get("amount", payment_intent["amount"])),
+            "payment_intent": payment_intent["id"],
+            "status": "succeeded",
+        })
+
+    def _post_accounts(self, params: dict) -> dict:
+        return self._save({
+            "id": self._new_id("acct"),
+            "object": "account",
+            "type": params.get("type", "express"),
+            "email": params.get("email"),
+            "charges_enabled": True,
+            "payouts_enabled": True,
+            "details_submitted": True,
+            "metadata": params.get("metadata", {}),
+        })
+
+    def _get_accounts_id(self, account_id: str, params: dict) -> dict:
+        return self._get("account", account_id)
+
+    def _post_account_links(self, params: dict) -> dict:
+        self._get("account", params.get("account", ""))
+        return {
+            "object": "account_link",
+            "url": f"https://connect.stripe.test/setup/{params['account']}",
+            "created": int(time.time()),
+            "expires_at": int(time.time()) + 300,
+        }
@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+from ..database import engine, run_after_commit, DATABASE_URL
+
+# --------------------------------------------------
+# 💡 プロセス内 Pub/Sub（バックエンド差し替え可能）
+# --------------------------------------------------
+# チャンネル名（例: "user:12", "meetup:34"）ごとに購読者へメッセージ(dict)を配る。
+# PUBSUB_BACKEND=local    : 同一プロセス内のみ（デフォルト・ワーカー1台構成向け）
+# PUBSUB_BACKEND=postgres : PostgreSQL の LISTEN/NOTIFY で全ワーカーに配る
+# publish はスレッドセーフなので、同期エンドポイント（スレッドプール）からも呼べる。
+
+PUBSUB_BACKEND = os.getenv("PUBSUB_BACKEND", "local")
+PG_NOTIFY_CHANNEL = "osidou_events"
+PG_NOTIFY_MAX_BYTES = 7900          # NOTIFY のペイロード上限（8000バイト）未満に抑える
+SUBSCRIBER_QUEUE_SIZE = 100         # 購読者ごとの未送信メッセージ上限
+
+# 受信側が追いつけずキューがあふれたときに1件だけ入れる目印。
+# 受け取った側は DB から取り直す（再同期）か、接続を切る。
+RESYNC = {"type": "resync"}
+
+
+class Subscription:
+    """購読者1人分のキュー。subscribe() はイベントループ上で呼ぶこと。"""
+
+    def __init__(self, channels: Iterable[str], maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.channels = list(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflow_count = 0
+
+    def _deliver(self, message: dict):
+        # イベントループのスレッドで実行される
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflow_count += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class LocalBackend:
+    """同一プロセス内だけで配信するバックエンド"""
+
+    def start(self, dispatch: Callable[[str, dict], None]):
+        self._dispatch = dispatch
+
+    def publish(self, channel: str, message: dict):
+        self._dispatch(channel, message)
+
+    def publish_many(self, items: List[Tuple[str, dict]]):
+        for channel, message in items:
+            self._dispatch(channel, message)
+
+
+class PostgresBackend:
+    """
+    LISTEN/NOTIFY で全ワーカーに配信するバックエンド。
+    自分の NOTIFY も LISTEN で受け取るので、publish 時にローカル配信はしない。
+    """
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+
+    def start(self, dispatch: Callable[[str, dict], None]):
+        self._dispatch = dispatch
+        thread = threading.Thread(target=self._listen_loop, name="pubsub-listener", daemon=True)
+        thread.start()
+
+    def _payload(self, channel: str, message: dict) -> str:
+        payload = json.dumps({"c": channel, "m": message}, ensure_ascii=False, default=str)
+        if len(payload.encode("utf-8")) > PG_NOTIFY_MAX_BYTES:
+            # 大きすぎるメッセージは再同期の合図だけ送る
+            payload = json.dumps({"c": channel, "m": RESYNC})
+        return payload
+
+    def publish(self, channel: str, message: dict):
+        from sqlalchemy import text
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:ch, :payload)"),
+                         {"ch": PG_NOTIFY_CHANNEL, "payload": self._payload(channel, message)})
+
+    def publish_many(self, items: List[Tuple[str, dict]]):
+        # 1往復でまとめて NOTIFY する
+        from sqlalchemy import text
+        payloads = [self._payload(ch, msg) for ch, msg in items]
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:ch, p) FROM unnest(CAST(:payloads AS text[])) AS p"),
+                         {"ch": PG_NOTIFY_CHANNEL, "payloads": payloads})
+
+    def _listen_loop(self):
+        import select
+        import psycopg2
+        import psycopg2.extensions
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                conn.cursor().execute(f"LISTEN {PG_NOTIFY_CHANNEL};")
+                while True:
+                    if select.select([conn], [], [], 10) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        data = json.loads(notify.payload)
+                        self._dispatch(data["c"], data["m"])
+            except Exception as e:
+                print(f"Pub/Sub リスナーエラー（3秒後に再接続）: {e}")
+                time.sleep(3)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+class PubSub:
+    def __init__(self):
+        self._subs: Dict[str, Set[Subscription]] = {}
+        self._listeners: List[Callable[[str, dict], None]] = []
+        self._lock = threading.Lock()
+        self._backend = None
+
+    def _get_backend(self):
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    if PUBSUB_BACKEND == "postgres" and DATABASE_URL.startswith("postgresql"):
+                        backend = PostgresBackend(DATABASE_URL)
+                    else:
+                        backend = LocalBackend()
+                    backend.start(self._dispatch)
+                    self._backend = backend
+        return self._backend
+
+    def subscribe(self, channels: Iterable[str], maxsize: int = SUBSCRIBER_QUEUE_SIZE) -> Subscription:
+        self._get_backend()
+        sub = Subscription(channels, maxsize=maxsize)
+        with self._lock:
+            for ch in sub.channels:
+                self._subs.setdefault(ch, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            for ch in sub.channels:
+                subs = self._subs.get(ch)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subs[ch]
+
+    def subscriber_count(self, channel: str) -> int:
+        return len(self._subs.get(channel, ()))
+
+    def add_listener(self, fn: Callable[[str, dict], None]):
+        """全チャンネルのメッセージを受け取る関数を登録（キャッシュの同期など、同期処理用）"""
+        self._listeners.append(fn)
+
+    def publish(self, channel: str, message: dict):
+        try:
+            self._get_backend().publish(channel, message)
+        except Exception as e:
+            print(f"Pub/Sub 配信エラー: {e}")
+
+    def publish_many(self, items: List[Tuple[str, dict]]):
+        """(チャンネル, メッセージ) の一覧をまとめて配信する（一斉通知用）"""
+        if not items:
+            return
+        try:
+            self._get_backend().publish_many(items)
+        except Exception as e:
+            print(f"Pub/Sub 配信エラー: {e}")
+
+    def _dispatch(self, channel: str, message: dict):
+        for fn in self._listeners:
+            try:
+                fn(channel, message)
+            except Exception as e:
+                print(f"Pub/Sub リスナー処理エラー: {e}")
+        with self._lock:
+            subs = list(self._subs.get(channel, ()))
+        for sub in subs:
+            try:
+                sub.loop.call_soon_threadsafe(sub._deliver, message)
+            except RuntimeError:
+                # イベントループが終了済み
+                self.unsubscribe(sub)
+
+
+pubsub = PubSub()
+
+
+def user_channel(user_id: int) -> str:
+    """ユーザー個人宛て（通知・未読数）のチャンネル名"""
+    return f"user:{user_id}"
+
+
+def meetup_channel(post_id: int) -> str:
+    """MEETUP チャットルームのチャンネル名"""
+    return f"meetup:{post_id}"
+
+
+def publish_after_commit(db, channel: str, message: dict):
+    """現在のトランザクションが commit された後に配信する"""
+    run_after_commit(db, lambda: pubsub.publish(channel, message))
@@ -0,0 +1,74 @@
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Optional
+
+import stripe
+
+# --------------------------------------------------
+# 💡 Stripe 呼び出しの窓口
+# --------------------------------------------------
+# Stripe SDK はブロッキングなので、呼び出しはすべて stripe_call() を通す。
+#   - 専用のスレッドプール（最大 STRIPE_MAX_CONCURRENCY 本）で実行する。
+#     Stripe が遅くなっても同時に待つ数はここで頭打ちになる
+#   - 1回の呼び出しは STRIPE_CALL_TIMEOUT 秒で打ち切る（HTTP のタイムアウトも同じ値）
+#   - 通信エラー・429・5xx・タイムアウトはジッター付きの指数バックオフで再試行する
+#   - 作成・更新系（GET 以外）には冪等キーを付けるので、再試行しても二重に作られない。
+#     呼び出し側が業務的に一意なキー（例: "meetup_fee:12:34"）を渡せば、
+#     リクエストをやり直しても同じ結果が返る
+# エラーは stripe.error.StripeError のサブクラスとして投げるので、呼び出し側の except はそのまま使える。
+
+STRIPE_MAX_CONCURRENCY = int(os.getenv("STRIPE_MAX_CONCURRENCY", "16"))
+STRIPE_CALL_TIMEOUT = float(os.getenv("STRIPE_CALL_TIMEOUT", "20"))  # 秒
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "2"))
+STRIPE_RETRY_BASE_DELAY = 0.5  # 秒
+STRIPE_RETRY_MAX_DELAY = 4.0   # 秒
+# true にすると Stripe には接続せず、プロセス内の偽 Stripe（utils/fake_stripe.py）を使う
+STRIPE_FAKE = os.getenv("STRIPE_FAKE", "false").lower() == "true"
+
+# 再試行は stripe_call() で行うので SDK 側の自動再試行は切る。
+# RequestsClient はスレッドごとに requests.Session を持つので、接続は使い回される。
+stripe.max_network_retries = 0
+if STRIPE_FAKE:
+    from .fake_stripe import FakeStripeClient
+
+    stripe.default_http_client = FakeStripeClient()
+else:
+    stripe.default_http_client = stripe.RequestsClient(timeout=STRIPE_CALL_TIMEOUT)
+
+_executor = ThreadPoolExecutor(max_workers=STRIPE_MAX_CONCURRENCY, thread_name_prefix="stripe")
+
+# 冪等キーを付けない（読み取り専用の）メソッド
+_READ_METHODS = {"retrieve", "list", "search", "list_line_items"}
+
+
+def _is_retryable(e: stripe.error.StripeError) -> bool:
+    if isinstance(e, (stripe.error.APIConnectionError, stripe.error.RateLimitError)):
+        return True
+    return isinstance(e, stripe.error.APIError) and (e.http_status or 500) >= 500
+
+
+def stripe_call(fn: Callable[..., Any], *args, idempotency_key: Optional[str] = None, **kwargs) -> Any:
+    """fn（例: stripe.Customer.create）をスレッドプールで実行し、タイムアウト・再試行付きで結果を返す"""
+    if getattr(fn, "__name__", "") not in _READ_METHODS:
+        kwargs["idempotency_key"] = idempotency_key or f"osidou-{uuid.uuid4()}"
+
+    for attempt in range(STRIPE_MAX_RETRIES + 1):
+        future = _executor.submit(fn, *args, **kwargs)
+        try:
+            return future.result(timeout=STRIPE_CALL_TIMEOUT)
+        except FutureTimeout:
+            future.cancel()  # 順番待ちのまま時間切れなら実行させない
+            error: stripe.error.StripeError = stripe.error.APIConnectionError(
+                f"Stripe の応答が {STRIPE_CALL_TIMEOUT:g} 秒以内にありませんでした"
+            )
+        except stripe.error.StripeError as e:
+            if not _is_retryable(e):
+                raise
+            error = e
+        if attempt == STRIPE_MAX_RETRIES:
+            raise error
+        delay = min(STRIPE_RETRY_MAX_DELAY, STRIPE_RETRY_BASE_DELAY * 2 ** attempt)
+        time.sleep(random.uniform(0, delay))
@@ -0,0 +1,246 @@
+"""
+決済エンドポイント（routers/stripe_payment.py）の負荷試験。
+偽 Stripe（utils/fake_stripe.py）を使い、エンドポイントごとに同時実行数を決めて叩き、
+スループット（req/s）と遅延の p50 / p95 / p99 を計測する。
+
+    # サーバーを立てずに、このプロセス内の app に直接リクエストする（偽 Stripe は自動で有効）
+    cd backend && FAKE_STRIPE_LATENCY_MS=80 FAKE_STRIPE_JITTER_MS=120 \
+        python -m scripts.payment_bench --in-process --concurrency 16 --requests 200
+
+    # 起動済みのサーバーに対して（サーバー側も STRIPE_FAKE=true で起動しておくこと）
+    cd backend && STRIPE_FAKE=true STRIPE_SECRET_KEY=sk_test_fake uvicorn app.main:app --port 8000
+    cd backend && python -m scripts.payment_bench --url http://127.0.0.1:8000 --concurrency 32
+
+--max-p99-ms を付けると、p99 がその値を超えたエンドポイントがあれば終了コード 1 で終わる（CI 用）。
+※ ユーザー・カテゴリ・MEETUP 投稿は DATABASE_URL の DB に直接作る（サーバーと同じ DB を指すこと）。
+  作ったデータは消さないので、ベンチマーク用の DB で実行すること。
+※ post_responses.stripe_customer_id など本番スキーマにしかない列を使うので、DB は PostgreSQL を想定。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, requests: list, concurrency: int) -> dict:
+    """requests（(パス, JSON) のリスト）を concurrency 本ずつ並行して送り、結果をまとめる"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in requests:
+        queue.put_nowait(item)
+    latencies: list = []
+    stats = {"name": name, "ok": 0, "errors": 0, "status": {}, "last_error": None, "responses": []}
+
+    async def worker():
+        while True:
+            try:
+                path, body = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                res = await client.post(path, json=body)
+                latencies.append(time.perf_counter() - started)
+                stats["status"][res.status_code] = stats["status"].get(res.status_code, 0) + 1
+                if res.status_code < 400:
+                    stats["ok"] += 1
+                    stats["responses"].append((body, res.json()))
+                else:
+                    stats["errors"] += 1
+                    stats["last_error"] = f"{res.status_code} {res.text[:200]}"
+            except Exception as e:
+                latencies.append(time.perf_counter() - started)
+                stats["errors"] += 1
+                stats["last_error"] = repr(e)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000 if latencies else 0.0
+    stats.update({
+        "count": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": p(0.5), "p95": p(0.95), "p99": p(0.99),
+        "max": latencies[-1] * 1000 if latencies else 0.0,
+        "mean": statistics.mean(latencies) * 1000 if latencies else 0.0,
+    })
+    return stats
+
+
+def print_result(stats: dict):
+    print(f"{stats['name']:<26} {stats['count']:>6} {stats['ok']:>6} {stats['errors']:>6} "
+          f"{stats['rps']:>8.1f} {stats['p50']:>8.1f} {stats['p95']:>8.1f} {stats['p99']:>8.1f} {stats['max']:>8.1f}")
+    if stats["errors"]:
+        print(f"  ステータス: {stats['status']}  最後のエラー: {stats['last_error']}")
+
+
+def session_id_from_url(url: str) -> str:
+    """偽 Stripe の Checkout URL（.../c/pay/<セッションID>）からセッションIDを取り出す"""
+    return url.rstrip("/").rsplit("/", 1)[-1]
+
+
+def seed(users: int, posts: int, fee: int):
+    """ベンチマーク用のユーザー・カテゴリ・MEETUP 投稿を作り、(ユーザーID, カテゴリID, 投稿ID) を返す"""
+    from app.database import SessionLocal
+    from app import models
+
+    tag = uuid.uuid4().hex[:6]
+    db = SessionLocal()
+    try:
+        category = models.HobbyCategory(name=f"payment_bench_{tag}", unique_code=tag[:7], depth=0)
+        db.add(category)
+        user_rows = [
+            models.User(
+                username=f"bench_{tag}_{i}",
+                email=f"bench_{tag}_{i}@example.com",
+                nickname=f"bench_{tag}_{i}",
+                hashed_password="!",
+                public_code=uuid.uuid4().hex[:8],
+            )
+            for i in range(users)
+        ]
+        db.add_all(user_rows)
+        db.flush()
+        # 開催1時間前にしておく（参加者キャンセルでキャンセル料の課金まで通る）
+        meetup_date = datetime.now(timezone.utc) + timedelta(hours=1)
+        post_rows = [
+            models.HobbyPost(
+                content=f"payment_bench MEETUP {i}",
+                user_id=user_rows[0].id,
+                hobby_category_id=category.id,
+                is_meetup=True,
+                meetup_date=meetup_date,
+                meetup_location="bench",
+                meetup_capacity=users,
+                meetup_fee_info=str(fee),
+                meetup_status="open",
+            )
+            for i in range(posts)
+        ]
+        db.add_all(post_rows)
+        db.commit()
+        return [u.id for u in user_rows], category.id, [p.id for p in post_rows]
+    finally:
+        db.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--in-process", action="store_true", help="サーバーを立てずにこのプロセス内の app を叩く")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="Checkout 系シナリオ1つあたりのリクエスト数")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=10)
+    parser.add_argument("--participants", type=int, default=20, help="MEETUP 1件あたりの参加者数")
+    parser.add_argument("--fee", type=int, default=1000, help="MEETUP の参加費（円）")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="超えたら終了コード 1")
+    args = parser.parse_args()
+    args.participants = min(args.participants, args.users - 1)
+
+    if args.in_process:
+        # app を読み込む前に偽 Stripe を有効にする
+        os.environ["STRIPE_FAKE"] = "true"
+        os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test_fake")
+        os.environ.setdefault("BACKGROUND_JOBS_ENABLED", "false")
+        from app.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120)
+    else:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120,
+                                   limits=httpx.Limits(max_connections=args.concurrency * 2))
+
+    user_ids, category_id, post_ids = seed(args.users, args.posts, args.fee)
+    organizer, members = user_ids[0], user_ids[1:]
+    pick = lambda i: members[i % len(members)]
+    print(f"準備: ユーザー {len(user_ids)} 人 / MEETUP {len(post_ids)} 件 × 参加者 {args.participants} 人 "
+          f"/ 同時実行 {args.concurrency}")
+    print(f"{'endpoint':<26} {'count':>6} {'ok':>6} {'errors':>6} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+
+    results = []
+
+    async def scenario(name, requests, concurrency=args.concurrency):
+        stats = await run_scenario(client, name, requests, concurrency)
+        print_result(stats)
+        results.append(stats)
+        return stats
+
+    async with client:
+        n = args.requests
+        await scenario("no-affiliate-checkout", [
+            ("/api/stripe/no-affiliate-checkout", {"userId": pick(i)}) for i in range(n)
+        ])
+        await scenario("feeling-log-checkout", [
+            ("/api/stripe/feeling-log-checkout", {"userId": pick(i)}) for i in range(n)
+        ])
+        await scenario("ad-checkout", [
+            ("/api/stripe/ad-checkout", {"userId": pick(i), "amount": 1000, "categoryIds": [category_id]})
+            for i in range(n)
+        ])
+
+        # FRIEND's MANAGER: 申込み → 有効化 → 人数変更（Subscription.modify）
+        fm_users = members[:min(n, len(members))]
+        stats = await scenario("friend-manager-checkout", [
+            ("/api/stripe/friend-manager-checkout", {"userId": uid, "newFriendCount": 12}) for uid in fm_users
+        ])
+        await scenario("friend-manager-activate", [
+            ("/api/stripe/friend-manager-activate", {"sessionId": session_id_from_url(res["checkout_url"])})
+            for _, res in stats["responses"] if res.get("checkout_url")
+        ])
+        await scenario("friend-manager-update", [
+            ("/api/stripe/friend-manager-checkout", {"userId": fm_users[i % len(fm_users)], "newFriendCount": 13 + i % 5})
+            for i in range(n)
+        ])
+
+        # MEETUP: カード登録 → 参加 → 開催決定（一斉課金）→ No Show → キャンセル
+        joins = [(pid, members[j]) for pid in post_ids for j in range(args.participants)]
+        stats = await scenario("meetup-join-setup", [
+            ("/api/stripe/meetup-join-setup", {"userId": uid, "postId": pid, "categoryId": category_id})
+            for pid, uid in joins
+        ])
+        await scenario("meetup-join-complete", [
+            ("/api/stripe/meetup-join-complete", {
+                "userId": body["userId"], "postId": body["postId"],
+                "setupSessionId": session_id_from_url(res["checkout_url"]),
+            })
+            for body, res in stats["responses"]
+        ])
+        # 1リクエストで参加者全員に課金するので、同時実行数は投稿数まで
+        await scenario("meetup-confirm", [
+            ("/api/stripe/meetup-confirm", {"postId": pid, "organizerId": organizer}) for pid in post_ids
+        ], min(args.concurrency, len(post_ids)))
+        half = args.participants // 2
+        await scenario("meetup-noshow", [
+            ("/api/stripe/meetup-noshow", {"postId": pid, "userId": organizer, "targetId": members[j], "type": "organizer"})
+            for pid in post_ids for j in range(half)
+        ])
+        await scenario("meetup-cancel", [
+            ("/api/stripe/meetup-cancel", {"userId": members[j], "postId": pid})
+            for pid in post_ids for j in range(half, args.participants)
+        ])
+
+    if args.in_process:
+        import stripe
+        calls = getattr(stripe.default_http_client, "calls", None)
+        if calls:
+            print("偽 Stripe への呼び出し回数:")
+            for key, count in sorted(calls.items()):
+                print(f"  {key:<36} {count}")
+
+    if args.max_p99_ms is not None:
+        slow = [s["name"] for s in results if s["p99"] > args.max_p99_ms]
+        if slow:
+            print(f"❌ p99 が {args.max_p99_ms:g}ms を超えました: {', '.join(slow)}")
+            sys.exit(1)
+        print(f"✅ すべてのエンドポイントで p99 <= {args.max_p99_ms:g}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
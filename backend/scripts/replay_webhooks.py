@@ -0,0 +1,40 @@
+"""
+Stripe Webhook の受信箱で dead になったイベントを確認・再処理する。
+    cd backend && python -m scripts.replay_webhooks --list
+    cd backend && python -m scripts.replay_webhooks --all            # dead を全部 pending に戻して処理
+    cd backend && python -m scripts.replay_webhooks evt_123 evt_456  # 指定したイベントだけ
+※ 戻したイベントは、同じオブジェクトの新しいイベントより後に反映される。
+  状態が古くならないか（例: 解約後に past_due に戻る）を --list で確認してから実行すること。
+"""
+import sys
+
+from app.database import SessionLocal
+from app import models
+from app.logics.stripe_webhooks import replay_webhook_events, process_webhook_events
+
+
+def main():
+    args = sys.argv[1:]
+    db = SessionLocal()
+    try:
+        if not args or args[0] == "--list":
+            dead = db.query(models.StripeWebhookEvent).filter(
+                models.StripeWebhookEvent.status == "dead"
+            ).order_by(models.StripeWebhookEvent.event_created).all()
+            print(f"dead のイベント: {len(dead)} 件")
+            for event in dead:
+                print(f"  {event.event_id}  {event.event_type}  {event.object_key}  "
+                      f"試行 {event.attempts} 回  {event.last_error}")
+            return
+
+        event_ids = None if args[0] == "--all" else args
+        count = replay_webhook_events(db, event_ids)
+        print(f"✅ {count} 件を pending に戻しました")
+        processed = process_webhook_events(db)
+        print(f"✅ {processed} 件を処理しました")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+定期ジョブを1回だけ実行する。
+    cd backend && python -m scripts.run_job archive_notifications
+    cd backend && python -m scripts.run_job --list
+"""
+import asyncio
+import sys
+
+from app.logics.jobs import _jobs, run_job_once
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] == "--list":
+        print("登録済みジョブ:", ", ".join(sorted(_jobs)))
+        return
+    name = sys.argv[1]
+    if name not in _jobs:
+        print(f"❌ 不明なジョブ: {name}")
+        sys.exit(1)
+    result = asyncio.run(run_job_once(name))
+    print(f"✅ {name} 完了: {result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+MEETUP チャット WebSocket の負荷試験。
+同じルームに N 本の接続を張り、数本から一定間隔でメッセージを送って
+全接続への配信遅延（送信 → 受信）を計測する。
+
+    cd backend && python -m scripts.ws_load_test \
+        --url ws://127.0.0.1:8000 --post-id 12 --token <JWT> \
+        --connections 2000 --senders 5 --rate 2 --duration 30
+
+※ 接続数が多い場合は先に `ulimit -n 65535` でファイルディスクリプタ上限を上げておくこと。
+※ token は主催者または参加者のもの（同じトークンで複数接続して構わない）。
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import websockets
+
+
+async def receiver(url: str, latencies: list, stats: dict, stop: asyncio.Event):
+    try:
+        async with websockets.connect(url, open_timeout=30, max_queue=1024) as ws:
+            stats["connected"] += 1
+            while not stop.is_set():
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=1)
+                except asyncio.TimeoutError:
+                    continue
+                data = json.loads(raw)
+                if data.get("type") != "message":
+                    continue
+                try:
+                    sent_at = float(data["message"]["content"].split(":", 1)[1])
+                except (IndexError, ValueError):
+                    continue
+                latencies.append(time.time() - sent_at)
+    except websockets.ConnectionClosed as e:
+        code = e.rcvd.code if e.rcvd else None
+        if code != 1000:
+            stats["closed"][code] = stats["closed"].get(code, 0) + 1
+    except Exception as e:
+        stats["errors"] += 1
+        stats["last_error"] = repr(e)
+
+
+async def sender(url: str, rate: float, stats: dict, stop: asyncio.Event):
+    async with websockets.connect(url, open_timeout=30) as ws:
+        while not stop.is_set():
+            await ws.send(json.dumps({"type": "message", "content": f"loadtest:{time.time()}"}))
+            stats["sent"] += 1
+            await asyncio.sleep(1 / rate)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="ws://127.0.0.1:8000")
+    parser.add_argument("--post-id", type=int, required=True)
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--connections", type=int, default=1000)
+    parser.add_argument("--senders", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=1.0, help="送信者1人あたりの毎秒送信数")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--ramp", type=int, default=200, help="同時に接続を開始する数")
+    args = parser.parse_args()
+
+    url = f"{args.url}/meetup-chat/ws/{args.post_id}?token={args.token}"
+    latencies: list = []
+    stats = {"connected": 0, "errors": 0, "sent": 0, "closed": {}, "last_error": None}
+    stop = asyncio.Event()
+
+    tasks = []
+    started = time.time()
+    for i in range(args.connections):
+        tasks.append(asyncio.create_task(receiver(url, latencies, stats, stop)))
+        if (i + 1) % args.ramp == 0:
+            await asyncio.sleep(0.5)
+    while stats["connected"] + stats["errors"] < args.connections and time.time() - started < 60:
+        await asyncio.sleep(0.5)
+    print(f"接続完了: {stats['connected']}/{args.connections}（{time.time() - started:.1f}秒, エラー {stats['errors']}）")
+
+    senders = [asyncio.create_task(sender(url, args.rate, stats, stop)) for _ in range(args.senders)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*senders, *tasks, return_exceptions=True)
+
+    expected = stats["sent"] * stats["connected"]
+    print(f"送信: {stats['sent']}件 / 受信: {len(latencies)}件（期待値 {expected}）")
+    if latencies:
+        latencies.sort()
+        p = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+        print(f"配信遅延 ms: p50={p(0.5):.1f} p95={p(0.95):.1f} p99={p(0.99):.1f} "
+              f"max={latencies[-1] * 1000:.1f} mean={statistics.mean(latencies) * 1000:.1f}")
+    if stats["closed"]:
+        print(f"サーバーからの切断: {stats['closed']}")
+    if stats["last_error"]:
+        print(f"最後のエラー: {stats['last_error']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())